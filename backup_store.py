@@ -0,0 +1,280 @@
+import os
+import json
+import zlib
+import random
+import hashlib
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Параметры разбиения на чанки (в байтах)
+MIN_CHUNK = 32 * 1024
+MAX_CHUNK = 512 * 1024
+# Доля границ-кандидатов, на которых режется чанк: 1 / (BOUNDARY_MASK + 1)
+BOUNDARY_MASK = 0x1F
+# Сколько байт строки ключа учитывается в контрольной сумме границы
+MAX_KEY_LINE = 1024
+READ_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+
+def detect_boundary_marker(head):
+    """Возвращает (маркер начала ключа, перевод строки) для кодировки файла.
+
+    Экспорт regedit в UTF-16LE, поэтому '[' после перевода строки занимает
+    по два байта на символ. Для остальных файлов используется UTF-8/ANSI.
+    """
+    if head.startswith(b'\xff\xfe'):
+        return b'\n\x00[\x00', b'\n\x00'
+    if head.startswith(b'\xfe\xff'):
+        return b'\x00\n\x00[', b'\x00\n'
+    return b'\n[', b'\n'
+
+
+def find_cut(buf, start, marker, newline, eof,
+             min_size=MIN_CHUNK, max_size=MAX_CHUNK, mask=BOUNDARY_MASK):
+    """Ищет конец чанка, начинающегося с позиции start.
+
+    Граница ставится перед строкой ключа реестра, если контрольная сумма
+    этой строки (полного пути ключа) даёт нули в битах mask. Поэтому границы
+    зависят только от содержимого: вставка ключа в начало экспорта сдвигает
+    лишь соседние чанки, а остальные совпадают с предыдущим бэкапом.
+    Возвращает None, если для решения нужно больше данных.
+    """
+    newline_len = len(newline)
+    limit = start + max_size
+    pos = buf.find(marker, start + min_size - newline_len)
+    while pos != -1 and pos + newline_len < limit:
+        boundary = pos + newline_len
+        line_end = buf.find(newline, boundary, boundary + MAX_KEY_LINE)
+        if line_end == -1:
+            if not eof and len(buf) < boundary + MAX_KEY_LINE:
+                return None
+            line_end = min(len(buf), boundary + MAX_KEY_LINE)
+        if zlib.crc32(buf[boundary:line_end]) & mask == 0:
+            return boundary
+        pos = buf.find(marker, pos + 1)
+    if len(buf) >= limit:
+        return limit
+    if eof and len(buf) > start:
+        return len(buf)
+    return None
+
+
+def iter_chunks(stream, **params):
+    """Читает поток блоками и выдаёт чанки с границами, зависящими от содержимого"""
+    buf = stream.read(READ_SIZE)
+    marker, newline = detect_boundary_marker(buf[:4])
+    eof = not buf
+    while True:
+        start = 0
+        while True:
+            cut = find_cut(buf, start, marker, newline, eof, **params)
+            if cut is None:
+                break
+            yield buf[start:cut]
+            start = cut
+        buf = buf[start:]
+        if eof:
+            return
+        data = stream.read(READ_SIZE)
+        if data:
+            buf += data
+        else:
+            eof = True
+
+
+class BackupStore:
+    """Хранилище бэкапов реестра с дедупликацией.
+
+    Экспорт разбивается на чанки, каждый уникальный чанк сжимается и хранится
+    один раз в chunks/<первые 2 символа хэша>/<sha256>. Бэкап (снимок) — это
+    манифест в snapshots/<id>.json со списком чанков и хэшем всего файла,
+    по которому восстанавливается побайтово идентичный .reg.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _manifest_path(self, snapshot_id):
+        return os.path.join(self.snapshots_dir, f'{snapshot_id}.json')
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def add(self, source_path, snapshot_id=None, created=None):
+        """Сохраняет файл как снимок и возвращает его манифест.
+
+        created — время создания снимка (datetime), по умолчанию текущее.
+        """
+        if snapshot_id is None:
+            snapshot_id = f"registry_backup_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        file_hash = hashlib.sha256()
+        chunks = []
+        size = 0
+        new_chunks = 0
+        stored_bytes = 0
+        with open(source_path, 'rb') as f:
+            for chunk in iter_chunks(f):
+                digest = hashlib.sha256(chunk).hexdigest()
+                file_hash.update(chunk)
+                size += len(chunk)
+                chunks.append([digest, len(chunk)])
+                path = self._chunk_path(digest)
+                if not os.path.exists(path):
+                    compressed = zlib.compress(chunk, COMPRESS_LEVEL)
+                    self._write_atomic(path, compressed)
+                    new_chunks += 1
+                    stored_bytes += len(compressed)
+        manifest = {
+            'id': snapshot_id,
+            'created': (created or datetime.now()).isoformat(timespec='seconds'),
+            'source': os.path.basename(source_path),
+            'size': size,
+            'sha256': file_hash.hexdigest(),
+            'chunks': chunks,
+        }
+        self._write_atomic(self._manifest_path(snapshot_id),
+                           json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+        logger.info(f"Снимок {snapshot_id}: {size} байт, чанков {len(chunks)}, новых {new_chunks} ({stored_bytes} байт на диске)")
+        manifest['new_chunks'] = new_chunks
+        manifest['stored_bytes'] = stored_bytes
+        return manifest
+
+    def get(self, snapshot_id):
+        with open(self._manifest_path(snapshot_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list(self):
+        """Список манифестов снимков, от старых к новым"""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        manifests = []
+        for name in os.listdir(self.snapshots_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                manifests.append(self.get(name[:-len('.json')]))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Повреждённый манифест {name}: {e}")
+        return sorted(manifests, key=lambda m: (m['created'], m['id']))
+
+    def latest(self):
+        snapshots = self.list()
+        return snapshots[-1] if snapshots else None
+
+    def random_snapshot(self):
+        snapshots = self.list()
+        return random.choice(snapshots) if snapshots else None
+
+    def iter_data(self, snapshot_id):
+        """Выдаёт содержимое снимка по чанкам"""
+        for digest, length in self.get(snapshot_id)['chunks']:
+            with open(self._chunk_path(digest), 'rb') as f:
+                chunk = zlib.decompress(f.read())
+            if len(chunk) != length:
+                raise ValueError(f"Чанк {digest} повреждён: {len(chunk)} байт вместо {length}")
+            yield chunk
+
+    def verify(self, snapshot_id):
+        """Проверяет, что снимок восстанавливается без ошибок и с тем же хэшем"""
+        try:
+            file_hash = hashlib.sha256()
+            for chunk in self.iter_data(snapshot_id):
+                file_hash.update(chunk)
+            return file_hash.hexdigest() == self.get(snapshot_id)['sha256']
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Снимок {snapshot_id} не прошёл проверку: {e}")
+            return False
+
+    def restore(self, snapshot_id, dest_path):
+        """Восстанавливает снимок в файл .reg, побайтово идентичный исходному"""
+        manifest = self.get(snapshot_id)
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        temp_path = f'{dest_path}.tmp'
+        file_hash = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in self.iter_data(snapshot_id):
+                    file_hash.update(chunk)
+                    f.write(chunk)
+            if file_hash.hexdigest() != manifest['sha256']:
+                raise ValueError(f"Хэш восстановленного снимка {snapshot_id} не совпадает")
+            os.replace(temp_path, dest_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.info(f"Снимок {snapshot_id} восстановлен в {dest_path}")
+        return dest_path
+
+    def remove(self, snapshot_id):
+        """Удаляет манифест снимка (чанки освобождает gc)"""
+        os.remove(self._manifest_path(snapshot_id))
+
+    def gc(self):
+        """Удаляет чанки, на которые не ссылается ни один снимок.
+
+        Возвращает (число удалённых чанков, освобождено байт).
+        """
+        referenced = set()
+        for manifest in self.list():
+            referenced.update(digest for digest, _ in manifest['chunks'])
+        removed = 0
+        freed = 0
+        if not os.path.isdir(self.chunks_dir):
+            return removed, freed
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                if name in referenced:
+                    continue
+                path = os.path.join(prefix_dir, name)
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+            if not os.listdir(prefix_dir):
+                os.rmdir(prefix_dir)
+        logger.info(f"Сборка мусора в хранилище бэкапов: удалено чанков {removed}, освобождено {freed} байт")
+        return removed, freed
+
+    def disk_usage(self):
+        """Сколько байт занимают чанки на диске"""
+        total = 0
+        if os.path.isdir(self.chunks_dir):
+            for dirpath, _, filenames in os.walk(self.chunks_dir):
+                total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+        return total
+
+    def import_legacy(self, backup_dir, remove_originals=False):
+        """Переносит старые полные .reg-бэкапы из backup_dir в хранилище.
+
+        Временем создания снимка становится время изменения файла. Исходные
+        файлы удаляются только при remove_originals=True и только после
+        успешной проверки снимка.
+        """
+        imported = []
+        known = {m['id'] for m in self.list()}
+        for name in sorted(os.listdir(backup_dir)):
+            path = os.path.join(backup_dir, name)
+            if not name.lower().endswith('.reg') or not os.path.isfile(path):
+                continue
+            snapshot_id = os.path.splitext(name)[0]
+            if snapshot_id not in known:
+                self.add(path, snapshot_id, datetime.fromtimestamp(os.path.getmtime(path)))
+            if remove_originals and self.verify(snapshot_id):
+                os.remove(path)
+                logger.info(f"Старый бэкап {name} перенесён в хранилище и удалён")
+            imported.append(snapshot_id)
+        return imported
@@ -0,0 +1,314 @@
+import re
+import sys
+import time
+import uuid
+import queue
+import logging
+import threading
+import subprocess
+from collections import deque, namedtuple
+
+from startup_profile import lazy_import
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_START_TIMEOUT = 10.0
+# Сколько последних строк вывода команды хранится в CommandResult
+OUTPUT_TAIL = 20
+
+# Оболочка:
+#   argv     — команда запуска долгоживущей оболочки, читающей команды из stdin
+#   sentinel — строка, печатающая маркер и код возврата предыдущей команды
+#   script   — команда, выполняющая файл целиком в этой же оболочке
+#   newline  — перевод строки при записи команд
+#   encoding — кодировка ввода и вывода оболочки
+ShellDialect = namedtuple('ShellDialect', 'argv sentinel script newline encoding')
+
+DIALECTS = {
+    # %ERRORLEVEL% раскрывается при разборе всей строки, то есть до echo
+    'cmd': ShellDialect(['cmd.exe', '/D', '/Q', '/K'], 'echo.&echo {marker} %ERRORLEVEL%', 'call "{path}"',
+                        '\r\n', 'oem' if sys.platform == 'win32' else 'cp866'),
+    # Замена cmd для проверки на Linux
+    'bash': ShellDialect(['bash', '--noprofile', '--norc'], "printf '\\n%s %d\\n' '{marker}' $?", '. "{path}"',
+                         '\n', 'utf-8'),
+}
+
+# Команда сценария: line — номер первой строки в файле, text — что отправляется в оболочку
+BatchCommand = namedtuple('BatchCommand', 'line text')
+
+# Результат команды:
+#   status     — 'OK', 'FAILED' (код возврата не 0), 'TIMEOUT' (оболочка перезапущена)
+#                или 'EXITED' (команда завершила оболочку, она перезапущена)
+#   returncode — код возврата (None при TIMEOUT и EXITED)
+#   output     — последние OUTPUT_TAIL строк вывода (stdout и stderr вместе)
+CommandResult = namedtuple('CommandResult', 'line text status returncode seconds output')
+
+# Команды .bat, которые нельзя выполнить по одной в общей оболочке:
+# переходы, метки и параметры самого сценария
+BATCH_ONLY = re.compile(r'^\s*:[^:]|\bgoto\b|\bcall\s+:|%~|%[0-9*]|^\s*shift\b', re.IGNORECASE)
+# Пропускаются: в интерактивной оболочке они не нужны или мешают
+# (pause прочитал бы следующую команду из stdin)
+SKIPPED = re.compile(r'^@?(echo\s+(off|on)|setlocal|endlocal|pause|cls|title)\b', re.IGNORECASE)
+EXIT = re.compile(r'^@?exit\b', re.IGNORECASE)
+
+
+def _is_comment(line):
+    lowered = line.lower()
+    return lowered.startswith('::') or re.match(r'^@?rem(\s|$)', lowered) is not None
+
+
+def _paren_depth(line):
+    depth = 0
+    quoted = False
+    escaped = False
+    for char in line:
+        if escaped:
+            escaped = False
+        elif char == '^':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+    return depth
+
+
+def parse_batch(text, interactive=True):
+    """Разбивает .bat/.cmd на команды для интерактивного cmd.
+
+    Строки с ^ в конце склеиваются, многострочные блоки в скобках
+    собираются в одну строку через &. %% заменяется на %: в
+    интерактивном cmd переменные for пишутся с одним знаком
+    (interactive=False оставляет команды пригодными для .bat).
+    Если сценарий использует метки, goto или свои параметры,
+    выполнить его по командам нельзя — ValueError.
+    """
+    commands = []
+    parts = []
+    first = None
+    depth = 0
+    continued = False
+    for number, raw in enumerate((text or '').splitlines(), 1):
+        line = raw.strip()
+        if not continued and (not line or _is_comment(line)):
+            continue
+        if BATCH_ONLY.search(line):
+            raise ValueError(f"строка {number}: {line}")
+        if first is None:
+            first = number
+        if continued:
+            parts[-1] += line
+        else:
+            parts.append(line)
+        continued = line.endswith('^') and not line.endswith('^^')
+        if continued:
+            parts[-1] = parts[-1][:-1]
+            continue
+        depth += _paren_depth(line)
+        if depth > 0:
+            continue
+        command = parts[0]
+        for part in parts[1:]:
+            command += ' ' if command.endswith('(') or part.startswith(')') else ' & '
+            command += part
+        parts = []
+        depth = 0
+        if EXIT.match(command):
+            logger.info(f"Строка {first}: {command} — дальше сценарий не выполняется")
+            break
+        if not SKIPPED.match(command):
+            commands.append(BatchCommand(first, command.replace('%%', '%') if interactive else command))
+        first = None
+    if parts:
+        raise ValueError(f"строка {first}: незакрытый блок")
+    return commands
+
+
+def parse_shell_script(text):
+    """Команды сценария bash по строкам (комментарии # и пустые строки пропускаются)"""
+    commands = []
+    for number, raw in enumerate((text or '').splitlines(), 1):
+        line = raw.strip()
+        if line and not line.startswith('#'):
+            commands.append(BatchCommand(number, line))
+    return commands
+
+
+PARSERS = {'cmd': parse_batch, 'bash': parse_shell_script}
+
+
+class PersistentShell:
+    """Одна долгоживущая оболочка, в которой команды выполняются по очереди.
+
+    После каждой команды оболочка печатает маркер с кодом возврата, и по
+    нему отмеряется время команды. Если команда не уложилась в timeout,
+    дерево процессов оболочки завершается и запускается новая оболочка
+    (текущий каталог и переменные окружения при этом сбрасываются).
+    Оболочка наследует права процесса программы.
+    """
+
+    def __init__(self, dialect='cmd', argv=None, timeout=DEFAULT_TIMEOUT, start_timeout=DEFAULT_START_TIMEOUT,
+                 log_path=None, clock=time.perf_counter):
+        self.name = dialect
+        self.dialect = DIALECTS[dialect]
+        self.argv = list(argv or self.dialect.argv)
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.log_path = log_path
+        self.clock = clock
+        self.marker = f'__AIT_DONE_{uuid.uuid4().hex}'
+        self.process = None
+        self._lines = None
+        self._counter = 0
+        self._log = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+    def start(self):
+        """Запускает оболочку и проверяет, что она отвечает; иначе RuntimeError"""
+        if self.process is not None:
+            return
+        self.process = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, bufsize=0)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.process.stdout, self._lines), daemon=True).start()
+        result = self.run_command('', self.start_timeout)
+        if result.status != 'OK':
+            self.close()
+            raise RuntimeError(f"оболочка {' '.join(self.argv)} не отвечает ({result.status})")
+        logger.info(f"Запущена оболочка {' '.join(self.argv)} (pid {self.process.pid}) "
+                    f"за {result.seconds:.2f} сек")
+
+    @staticmethod
+    def _read(stream, lines):
+        try:
+            for line in iter(stream.readline, b''):
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    def _kill(self):
+        psutil = lazy_import('psutil')
+        try:
+            parent = psutil.Process(self.process.pid)
+            for child in parent.children(recursive=True):
+                child.kill()
+        except psutil.Error:
+            pass
+        self.process.kill()
+        self.process.wait()
+        self.process = None
+
+    def _output(self, line, tail):
+        tail.append(line)
+        if self._log is not None:
+            self._log.write(line + '\n')
+
+    def run_command(self, text, timeout=None):
+        """Выполняет одну команду; возвращает CommandResult"""
+        if self.process is None:
+            self.start()
+        timeout = self.timeout if timeout is None else timeout
+        self._counter += 1
+        marker = f'{self.marker} {self._counter}'
+        script = (text + self.dialect.newline if text else '') + self.dialect.sentinel.format(marker=marker)
+        tail = deque(maxlen=OUTPUT_TAIL)
+        if self._log is not None and text:
+            self._log.write(f'> {text}\n')
+        start = self.clock()
+        status = returncode = None
+        try:
+            self.process.stdin.write((script + self.dialect.newline).encode(self.dialect.encoding, 'replace'))
+            self.process.stdin.flush()
+        except OSError:
+            status = 'EXITED'
+        deadline = start + timeout
+        previous = None
+        while status is None:
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                status = 'TIMEOUT'
+                break
+            try:
+                raw = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if raw is None:
+                status = 'EXITED'
+                break
+            line = raw.decode(self.dialect.encoding, 'replace').rstrip('\r\n')
+            if line.startswith(marker + ' '):
+                returncode = int(line[len(marker) + 1:].strip() or 0)
+                status = 'OK' if returncode == 0 else 'FAILED'
+                break
+            # Пустая строка перед маркером — его часть, а не вывод команды
+            if previous is not None:
+                self._output(previous, tail)
+            previous = line
+        if previous:
+            self._output(previous, tail)
+        seconds = self.clock() - start
+        if status == 'TIMEOUT':
+            logger.error(f"Команда не завершилась за {timeout:.0f} сек, оболочка перезапускается: {text}")
+            self._kill()
+        elif status == 'EXITED':
+            logger.warning(f"Оболочка завершилась на команде: {text}")
+            self.process.wait()
+            self.process = None
+        if self._log is not None:
+            self._log.flush()
+        return CommandResult(None, text, status, returncode, seconds, list(tail))
+
+    def run_commands(self, commands, timeout=None):
+        """Выполняет BatchCommand по очереди; после таймаута продолжает в новой оболочке"""
+        results = []
+        for command in commands:
+            result = self.run_command(command.text, timeout)._replace(line=command.line)
+            level = logging.INFO if result.status == 'OK' else logging.WARNING
+            logger.log(level, f"Строка {command.line}: {result.status}"
+                              f"{'' if result.returncode is None else f' (код {result.returncode})'} "
+                              f"за {result.seconds:.3f} сек: {command.text}")
+            results.append(result)
+        return results
+
+    def run_file(self, path, timeout=None):
+        """Выполняет сценарий по командам, а если это невозможно — целиком одной командой"""
+        with open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        try:
+            commands = PARSERS[self.name](text)
+        except ValueError as e:
+            logger.info(f"{path} выполняется целиком, а не по командам: {e}")
+            commands = [BatchCommand(1, self.dialect.script.format(path=path))]
+        return self.run_commands(commands, timeout)
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(self.start_timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            if self.process.poll() is None:
+                self._kill()
+            self.process = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def summarize(results):
+    """(всего секунд, число команд, с ошибкой, по таймауту или с выходом из оболочки)"""
+    return (sum(r.seconds for r in results), len(results),
+            sum(1 for r in results if r.status == 'FAILED'),
+            sum(1 for r in results if r.status in ('TIMEOUT', 'EXITED')))
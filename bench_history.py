@@ -0,0 +1,344 @@
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque, namedtuple
+
+from bench_stats import median, mann_whitney
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB = 'bench_history.db'
+# Сколько предыдущих запусков той же системы берётся для поиска регрессий
+DEFAULT_WINDOW = 5
+# Рост медианы эталона относительно окна, после которого запуск считается регрессией
+DEFAULT_REGRESSION = 0.10
+# Перевод MAD в оценку стандартного отклонения для нормального распределения
+MAD_SCALE = 1.4826
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    fingerprint TEXT NOT NULL,
+    system TEXT NOT NULL,
+    note TEXT
+);
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    iteration INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    tweak_hash TEXT,
+    recorded REAL NOT NULL,
+    count INTEGER NOT NULL,
+    median REAL,
+    mad REAL,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    series_id INTEGER NOT NULL REFERENCES series(id),
+    position INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS effects (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    iteration INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    tweak_hash TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    before REAL,
+    after REAL,
+    delta REAL,
+    relative REAL,
+    effect_size REAL,
+    p_value REAL,
+    verdict TEXT NOT NULL,
+    accepted INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waits (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    iteration INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    waited REAL NOT NULL,
+    quiet INTEGER NOT NULL,
+    cpu REAL,
+    disk_mb REAL,
+    new_processes INTEGER,
+    peak_cpu REAL,
+    peak_disk_mb REAL,
+    peak_new_processes INTEGER
+);
+CREATE INDEX IF NOT EXISTS waits_run ON waits(run_id, iteration);
+CREATE INDEX IF NOT EXISTS series_metric ON series(metric, phase, recorded);
+CREATE INDEX IF NOT EXISTS series_run ON series(run_id);
+CREATE INDEX IF NOT EXISTS samples_series ON samples(series_id);
+CREATE INDEX IF NOT EXISTS effects_tweak ON effects(tweak_hash, metric);
+CREATE INDEX IF NOT EXISTS runs_fingerprint ON runs(fingerprint, started);
+'''
+
+# Строка истории запусков: число итераций и принятых твиков, сколько секунд
+# ждали тишины перед замерами и сколько ожиданий закончилось по таймауту
+RunInfo = namedtuple('RunInfo', 'run_id started fingerprint system iterations accepted waited noisy')
+# Точка тренда: медиана эталонного замера метрики в одном запуске
+TrendPoint = namedtuple('TrendPoint', 'run_id started fingerprint median mad count')
+# Регрессия: эталон запуска хуже медианы предыдущих window запусков той же системы
+Regression = namedtuple('Regression', 'metric run_id started fingerprint median reference change')
+# Сводка по твику: сколько раз проверялся, средние изменения и вердикты
+TweakEffect = namedtuple('TweakEffect', 'tweak_hash metric trials accepted better worse '
+                                        'mean_delta mean_relative mean_effect')
+# Сравнение эталонов двух запусков по одной метрике
+RunComparison = namedtuple('RunComparison', 'metric median_a median_b change p_value')
+
+
+def system_fingerprint(sysinfo):
+    """Короткий хэш описания системы (get_system_info)"""
+    data = json.dumps(sysinfo, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+def tweak_hash(reg_text, bat_text):
+    """Хэш содержимого твика без различий в пробелах, пустых строках и переводах строк"""
+    digest = hashlib.sha256()
+    for kind, text in (('reg', reg_text), ('bat', bat_text)):
+        lines = [' '.join(line.split()) for line in (text or '').splitlines()]
+        digest.update(kind.encode('ascii') + b'\0')
+        digest.update('\n'.join(line for line in lines if line).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _new_run_id():
+    return time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+
+class BenchmarkHistory:
+    """Постоянная история замеров бенчмарков в SQLite.
+
+    Каждый запуск оптимизатора получает run_id и отпечаток системы.
+    Серии замеров (Summary из bench_stats) пишутся вместе с сырыми
+    значениями: эталон — итерация 0, замеры после твика — с хэшем твика.
+    Для каждого сравнения отдельно хранится изменение и размер эффекта,
+    поэтому отчёты по трендам и твикам считаются запросами к базе без
+    загрузки всех замеров в память.
+    """
+
+    def __init__(self, path=HISTORY_DB, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def start_run(self, sysinfo, note=None, run_id=None):
+        """Регистрирует запуск; возвращает run_id"""
+        run_id = run_id or _new_run_id()
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO runs (run_id, started, fingerprint, system, note) VALUES (?, ?, ?, ?, ?)',
+                             (run_id, self.clock(), system_fingerprint(sysinfo),
+                              json.dumps(sysinfo, ensure_ascii=False), note))
+        logger.info(f"История бенчмарков: запуск {run_id} ({self.path})")
+        return run_id
+
+    def record_summary(self, run_id, iteration, phase, summary, tweak=None):
+        """Сохраняет серию замеров; phase — 'baseline' или 'after'"""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO series (run_id, iteration, phase, metric, tweak_hash, recorded, count, median, mad, status) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, iteration, phase, summary.name, tweak, self.clock(), len(summary.samples),
+                 summary.median, summary.mad, summary.status))
+            self._db.executemany('INSERT INTO samples (series_id, position, value) VALUES (?, ?, ?)',
+                                 [(cursor.lastrowid, i, value) for i, value in enumerate(summary.samples)])
+            return cursor.lastrowid
+
+    def record_value(self, run_id, iteration, phase, metric, value):
+        """Сохраняет одиночный замер (дополнительные бенчмарки)"""
+        status = None if isinstance(value, (int, float)) else str(value)
+        samples = [float(value)] if status is None else []
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO series (run_id, iteration, phase, metric, tweak_hash, recorded, count, median, mad, status) '
+                'VALUES (?, ?, ?, ?, NULL, ?, ?, ?, ?, ?)',
+                (run_id, iteration, phase, metric, self.clock(), len(samples),
+                 samples[0] if samples else None, 0.0 if samples else None, status))
+            self._db.executemany('INSERT INTO samples (series_id, position, value) VALUES (?, 0, ?)',
+                                 [(cursor.lastrowid, v) for v in samples])
+
+    def record_comparison(self, run_id, iteration, comparison, tweak, accepted):
+        """Сохраняет серию после твика и итог сравнения с эталоном (Comparison)"""
+        self.record_summary(run_id, iteration, 'after', comparison.after, tweak)
+        before, after = comparison.before.median, comparison.after.median
+        relative = effect_size = None
+        if comparison.delta is not None:
+            if before:
+                relative = comparison.delta / before
+            # Изменение медианы в единицах робастного разброса обеих серий
+            spread = MAD_SCALE * ((comparison.before.mad or 0) + (comparison.after.mad or 0)) / 2
+            if spread > 0:
+                effect_size = comparison.delta / spread
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT INTO effects (run_id, iteration, metric, tweak_hash, recorded, before, after, delta, relative, '
+                'effect_size, p_value, verdict, accepted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, iteration, comparison.name, tweak, self.clock(), before, after, comparison.delta,
+                 relative, effect_size, comparison.p_value, comparison.verdict, int(bool(accepted))))
+
+    def record_wait(self, run_id, iteration, metric, wait):
+        """Сохраняет ожидание тишины перед замером (QuietWait из quiet_gate)"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT INTO waits (run_id, iteration, metric, recorded, waited, quiet, cpu, disk_mb, new_processes, '
+                'peak_cpu, peak_disk_mb, peak_new_processes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, iteration, metric, self.clock(), wait.waited, int(wait.quiet), *wait.last, *wait.peak))
+
+    # Запросы
+
+    def runs(self, fingerprint=None, limit=20):
+        """Последние запуски (новые первыми)"""
+        where, params = ('WHERE r.fingerprint = ?', [fingerprint]) if fingerprint else ('', [])
+        query = f'''
+            SELECT r.run_id, r.started, r.fingerprint, r.system,
+                   (SELECT COUNT(DISTINCT iteration) FROM effects e WHERE e.run_id = r.run_id),
+                   (SELECT COUNT(DISTINCT iteration) FROM effects e WHERE e.run_id = r.run_id AND e.accepted),
+                   (SELECT COALESCE(SUM(waited), 0) FROM waits w WHERE w.run_id = r.run_id),
+                   (SELECT COUNT(*) FROM waits w WHERE w.run_id = r.run_id AND NOT w.quiet)
+            FROM runs r {where} ORDER BY r.started DESC LIMIT ?'''
+        with self._lock:
+            rows = self._db.execute(query, params + [limit]).fetchall()
+        return [RunInfo(run_id, started, fp, json.loads(system), *counts)
+                for run_id, started, fp, system, *counts in rows]
+
+    def metrics(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT DISTINCT metric FROM series ORDER BY metric')]
+
+    def trend(self, metric, fingerprint=None, limit=50):
+        """Медианы эталонных замеров метрики по запускам, в порядке времени"""
+        query = '''
+            SELECT s.run_id, r.started, r.fingerprint, s.median, s.mad, s.count
+            FROM series s JOIN runs r ON r.run_id = s.run_id
+            WHERE s.metric = ? AND s.phase = 'baseline' AND s.median IS NOT NULL'''
+        params = [metric]
+        if fingerprint:
+            query += ' AND r.fingerprint = ?'
+            params.append(fingerprint)
+        query += ' ORDER BY r.started DESC LIMIT ?'
+        with self._lock:
+            rows = self._db.execute(query, params + [limit]).fetchall()
+        return [TrendPoint(*row) for row in reversed(rows)]
+
+    def regressions(self, window=DEFAULT_WINDOW, threshold=DEFAULT_REGRESSION, fingerprint=None):
+        """Запуски, в которых эталон метрики медленнее медианы предыдущих window
+        запусков той же системы больше чем на threshold (доля).
+
+        Серии читаются курсором по порядку, в памяти держится только окно.
+        """
+        query = '''
+            SELECT s.metric, s.run_id, r.started, r.fingerprint, s.median
+            FROM series s JOIN runs r ON r.run_id = s.run_id
+            WHERE s.phase = 'baseline' AND s.median IS NOT NULL'''
+        params = []
+        if fingerprint:
+            query += ' AND r.fingerprint = ?'
+            params.append(fingerprint)
+        query += ' ORDER BY r.fingerprint, s.metric, r.started'
+        found = []
+        key = None
+        history = deque(maxlen=window)
+        with self._lock:
+            for metric, run_id, started, fp, value in self._db.execute(query, params):
+                if (fp, metric) != key:
+                    key = (fp, metric)
+                    history.clear()
+                if len(history) == window:
+                    reference = median(history)
+                    if reference and (value - reference) / reference > threshold:
+                        found.append(Regression(metric, run_id, started, fp, value, reference,
+                                                (value - reference) / reference))
+                history.append(value)
+        return found
+
+    def tweak_effects(self, fingerprint=None, metric=None, min_trials=1, limit=50):
+        """Сводка по твикам: вердикты и средние изменения по всем проверкам"""
+        query = '''
+            SELECT e.tweak_hash, e.metric, COUNT(*), SUM(e.accepted),
+                   SUM(e.verdict = 'better'), SUM(e.verdict = 'worse'),
+                   AVG(e.delta), AVG(e.relative), AVG(e.effect_size)
+            FROM effects e JOIN runs r ON r.run_id = e.run_id'''
+        conditions, params = [], []
+        if fingerprint:
+            conditions.append('r.fingerprint = ?')
+            params.append(fingerprint)
+        if metric:
+            conditions.append('e.metric = ?')
+            params.append(metric)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' GROUP BY e.tweak_hash, e.metric HAVING COUNT(*) >= ? ORDER BY AVG(e.relative) LIMIT ?'
+        with self._lock:
+            rows = self._db.execute(query, params + [min_trials, limit]).fetchall()
+        return [TweakEffect(*row) for row in rows]
+
+    def compare_runs(self, run_a, run_b):
+        """Эталоны двух запусков по каждой общей метрике с U-тестом по сырым замерам"""
+        comparisons = []
+        for metric in self._common_metrics(run_a, run_b):
+            a = self._baseline_samples(run_a, metric)
+            b = self._baseline_samples(run_b, metric)
+            if not a or not b:
+                continue
+            median_a, median_b = median(a), median(b)
+            _, p_value = mann_whitney(a, b)
+            change = (median_b - median_a) / median_a if median_a else None
+            comparisons.append(RunComparison(metric, median_a, median_b, change, p_value))
+        return comparisons
+
+    def _common_metrics(self, run_a, run_b):
+        query = '''
+            SELECT metric FROM series WHERE run_id = ? AND phase = 'baseline'
+            INTERSECT
+            SELECT metric FROM series WHERE run_id = ? AND phase = 'baseline'
+            ORDER BY metric'''
+        with self._lock:
+            return [row[0] for row in self._db.execute(query, (run_a, run_b))]
+
+    def _baseline_samples(self, run_id, metric):
+        query = '''
+            SELECT p.value FROM samples p JOIN series s ON s.id = p.series_id
+            WHERE s.run_id = ? AND s.metric = ? AND s.phase = 'baseline' ORDER BY p.position'''
+        with self._lock:
+            return [row[0] for row in self._db.execute(query, (run_id, metric))]
+
+    def resolve_run(self, prefix):
+        """run_id по началу идентификатора или 'last' / 'prev'"""
+        with self._lock:
+            if prefix in ('last', 'prev'):
+                rows = self._db.execute('SELECT run_id FROM runs ORDER BY started DESC LIMIT 2').fetchall()
+                index = 0 if prefix == 'last' else 1
+                if len(rows) <= index:
+                    raise ValueError(f"В истории нет запуска {prefix}")
+                return rows[index][0]
+            rows = self._db.execute('SELECT run_id FROM runs WHERE run_id LIKE ? LIMIT 2',
+                                    (prefix.replace('%', '') + '%',)).fetchall()
+        if not rows:
+            raise ValueError(f"Запуск {prefix} не найден")
+        if len(rows) > 1:
+            raise ValueError(f"Идентификатор {prefix} подходит к нескольким запускам")
+        return rows[0][0]
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,300 @@
+import math
+import time
+import random
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP = 1
+# 8 замеров против 8 при 6 метриках ещё дают значимость на первой проверке
+DEFAULT_REPETITIONS = 8
+DEFAULT_MAX_REPETITIONS = 16
+DEFAULT_ALPHA = 0.05
+# При p-value выше этого порога разницы считаются отсутствующей без дозамеров
+DEFAULT_AMBIGUOUS_P = 0.5
+BOOTSTRAP_ROUNDS = 2000
+CONFIDENCE = 0.95
+
+# Результат серии замеров одной метрики (время в секундах, меньше — лучше):
+#   status — None или код ошибки функции замера ("NO_FILES", ...), если
+#            ни одного числового замера не получилось
+Summary = namedtuple('Summary', 'name samples median mad ci_low ci_high status')
+
+# Сравнение метрики до и после твика:
+#   p_value — p-value с поправкой на последовательные проверки (а после
+#             holm() — и на число метрик); значимо, если меньше alpha
+#   verdict — 'better', 'worse' или 'same'
+#   delta   — медиана после минус медиана до (отрицательная — ускорение)
+#   delta_ci — бутстреп-интервал для delta
+Comparison = namedtuple('Comparison', 'name before after p_value verdict delta delta_ci')
+
+
+def median(values):
+    ordered = sorted(values)
+    n = len(ordered)
+    if not n:
+        return None
+    middle = n // 2
+    if n % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def percentile(ordered, q):
+    """Перцентиль q (0–100) уже отсортированной выборки с линейной интерполяцией"""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def mad(values):
+    """Медианное абсолютное отклонение"""
+    center = median(values)
+    if center is None:
+        return None
+    return median([abs(v - center) for v in values])
+
+
+def bootstrap_ci(statistic, *groups, rounds=BOOTSTRAP_ROUNDS, confidence=CONFIDENCE, rng=None):
+    """Перцентильный бутстреп-интервал статистики statistic(*выборки)"""
+    rng = rng or random.Random(0)
+    if any(not g for g in groups):
+        return None, None
+    estimates = sorted(
+        statistic(*[[rng.choice(g) for _ in g] for g in groups])
+        for _ in range(rounds)
+    )
+    tail = (1 - confidence) / 2
+    low = estimates[int(tail * (rounds - 1))]
+    high = estimates[int(math.ceil((1 - tail) * (rounds - 1)))]
+    return low, high
+
+
+def mann_whitney(a, b):
+    """Двусторонний U-тест Манна–Уитни (нормальное приближение с поправкой на связи).
+
+    Возвращает (U для выборки a, p-value).
+    """
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return None, 1.0
+    combined = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(combined)
+    ties = 0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        for k in range(i, j + 1):
+            ranks[k] = rank
+        count = j - i + 1
+        ties += count ** 3 - count
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    p_value = 2 * (1 - 0.5 * (1 + math.erf(max(z, 0) / math.sqrt(2))))
+    return u, min(1.0, p_value)
+
+
+def spent_alpha(n, first, total):
+    """Доля alpha, которую можно потратить на проверку после n замеров.
+
+    Линейная функция расходования (Лан — ДеМетс): к замеру n всего
+    потрачено n / total от alpha, причём первая проверка (first замеров)
+    получает сразу first / total. По неравенству Бонферрони суммарная
+    вероятность ложной значимости по всем проверкам не больше alpha.
+    """
+    if n <= first:
+        return first / total
+    return 1 / total
+
+
+def separated_p_value(n1, n2):
+    """p-value U-теста для полностью разделённых выборок — меньше не бывает"""
+    return mann_whitney(list(range(n1)), list(range(n1, n1 + n2)))[1]
+
+
+def holm(comparisons, alpha=DEFAULT_ALPHA):
+    """Поправка Холма на число метрик: {имя: Comparison} с исправленными p_value и verdict"""
+    tested = sorted((c for c in comparisons.values() if c.p_value is not None), key=lambda c: c.p_value)
+    adjusted = {}
+    running = 0.0
+    for rank, comparison in enumerate(tested):
+        running = max(running, min(1.0, (len(tested) - rank) * comparison.p_value))
+        verdict = ('better' if comparison.delta < 0 else 'worse') if running < alpha else 'same'
+        adjusted[comparison.name] = comparison._replace(p_value=running, verdict=verdict)
+    return {name: adjusted.get(name, comparison) for name, comparison in comparisons.items()}
+
+
+def summarize(name, samples, status=None, rng=None):
+    if not samples:
+        return Summary(name, [], None, None, None, None, status)
+    low, high = bootstrap_ci(median, samples, rng=rng)
+    return Summary(name, list(samples), median(samples), mad(samples), low, high, None)
+
+
+def _median_delta(before, after):
+    return median(after) - median(before)
+
+
+class BenchmarkHarness:
+    """Повторные замеры с прогревом и статистическим сравнением.
+
+    Функция замера возвращает время в секундах или строку-код ошибки.
+    Эталон меряется warmup + repetitions раз. После твика сначала берётся
+    repetitions замеров, а дальше — по одному, пока U-тест не даст
+    однозначный ответ или не наберётся max_repetitions. Каждая проверка
+    получает свою часть alpha (spent_alpha), поэтому дозамеры не
+    увеличивают вероятность ложной значимости; p > ambiguous_p
+    останавливает дозамеры без вывода о разнице. Поправку на число
+    метрик делает holm() по всем сравнениям итерации, поэтому дозамеры
+    прекращаются, только когда p_value * metrics < alpha: такая разница
+    значима при любом исходе остальных метрик.
+
+    pre_sample(name) — необязательный вызов перед каждым замером (вне
+    измеряемого времени), например ожидание тишины в системе.
+    """
+
+    def __init__(self, warmup=DEFAULT_WARMUP, repetitions=DEFAULT_REPETITIONS,
+                 max_repetitions=DEFAULT_MAX_REPETITIONS, alpha=DEFAULT_ALPHA,
+                 ambiguous_p=DEFAULT_AMBIGUOUS_P, seed=0, pre_sample=None, metrics=1):
+        self.warmup = warmup
+        self.repetitions = max(1, repetitions)
+        self.max_repetitions = max(self.repetitions, max_repetitions)
+        self.alpha = alpha
+        self.ambiguous_p = ambiguous_p
+        self.rng = random.Random(seed)
+        self.seconds = 0.0
+        self.pre_sample = pre_sample
+        # Сколько метрик сравнивается за итерацию (поправка Холма)
+        self.metrics = max(1, metrics)
+
+    def best_p_value(self):
+        """Наименьшее достижимое p-value с поправками на дозамеры и число метрик.
+
+        Если оно не меньше alpha, ни одна метрика не будет признана значимой.
+        """
+        return min(
+            min(1.0, separated_p_value(self.repetitions, n) / spent_alpha(n, self.repetitions, self.max_repetitions)
+                * self.metrics)
+            for n in range(self.repetitions, self.max_repetitions + 1)
+        )
+
+    def _run(self, name, func, count, samples, failures):
+        for _ in range(count):
+            if self.pre_sample is not None:
+                self.pre_sample(name)
+            start = time.perf_counter()
+            try:
+                value = func()
+            finally:
+                self.seconds += time.perf_counter() - start
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                samples.append(float(value))
+            else:
+                failures.append(value)
+
+    def warm_up(self, name, func):
+        if self.warmup:
+            logger.info(f"Прогрев бенчмарка {name}: {self.warmup} запуск(а)")
+            self._run(name, func, self.warmup, [], [])
+
+    def measure(self, name, func, warmup=True):
+        """Эталонная серия замеров"""
+        if warmup:
+            self.warm_up(name, func)
+        samples, failures = [], []
+        self._run(name, func, self.repetitions, samples, failures)
+        summary = summarize(name, samples, failures[0] if failures else None, self.rng)
+        self._log_summary(summary)
+        return summary
+
+    def compare(self, before, func, warmup=True):
+        """Замеры после твика с адаптивной остановкой и сравнение с эталоном"""
+        name = before.name
+        if warmup:
+            self.warm_up(name, func)
+        samples, failures = [], []
+        self._run(name, func, self.repetitions, samples, failures)
+        p_value = raw_p = 1.0
+        while True:
+            if before.samples and samples:
+                _, raw_p = mann_whitney(before.samples, samples)
+                # p-value, сравнимое с alpha: делим на долю alpha этой проверки
+                share = spent_alpha(len(samples) + len(failures), self.repetitions, self.max_repetitions)
+                p_value = min(1.0, raw_p / share)
+                if p_value * self.metrics < self.alpha or raw_p > self.ambiguous_p:
+                    break
+            elif len(samples) + len(failures) >= self.repetitions:
+                # Без чисел с одной из сторон сравнивать нечего
+                break
+            if len(samples) + len(failures) >= self.max_repetitions:
+                break
+            self._run(name, func, 1, samples, failures)
+        after = summarize(name, samples, failures[0] if failures else None, self.rng)
+        self._log_summary(after)
+        if not before.samples or not after.samples:
+            return Comparison(name, before, after, None, 'same', None, (None, None))
+        delta = after.median - before.median
+        delta_ci = bootstrap_ci(_median_delta, before.samples, after.samples, rng=self.rng)
+        if p_value < self.alpha:
+            verdict = 'better' if delta < 0 else 'worse'
+        else:
+            verdict = 'same'
+        comparison = Comparison(name, before, after, p_value, verdict, delta, delta_ci)
+        logger.info(f"Сравнение {name}: медиана {before.median:.3f} -> {after.median:.3f} сек "
+                    f"(Δ {delta:+.3f}, 95% ДИ [{delta_ci[0]:+.3f}; {delta_ci[1]:+.3f}]), "
+                    f"замеров {len(before.samples)}/{len(after.samples)}, p = {raw_p:.4f} "
+                    f"(с поправкой на дозамеры {p_value:.4f}): {verdict}")
+        return comparison
+
+    def _log_summary(self, summary):
+        if summary.median is None:
+            logger.warning(f"Бенчмарк {summary.name}: нет успешных замеров ({summary.status})")
+            return
+        logger.info(f"Бенчмарк {summary.name}: замеров {len(summary.samples)}, медиана {summary.median:.3f} сек, "
+                    f"MAD {summary.mad:.3f}, 95% ДИ [{summary.ci_low:.3f}; {summary.ci_high:.3f}]")
+
+
+if __name__ == "__main__":
+    # Проверка мощности на синтетических замерах: 6 метрик, шум 5%.
+    # Твик, ускоряющий всё в 10 раз, должен приниматься всегда, твик без
+    # эффекта — не чаще alpha.
+    import sys
+    metrics = 6
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rng = random.Random(1)
+
+    def noisy(center):
+        return lambda: rng.gauss(center, center * 0.05)
+
+    def acceptance(speedup):
+        harness = BenchmarkHarness(warmup=0, metrics=metrics, seed=rng.random())
+        accepted = 0
+        for _ in range(runs):
+            names = [f"m{index}" for index in range(metrics)]
+            baseline = {name: harness.measure(name, noisy(1.0), warmup=False) for name in names}
+            comparisons = holm({name: harness.compare(baseline[name], noisy(1.0 / speedup), warmup=False)
+                                for name in names}, harness.alpha)
+            verdicts = [c.verdict for c in comparisons.values()]
+            accepted += 'better' in verdicts and 'worse' not in verdicts
+        return accepted / runs
+
+    harness = BenchmarkHarness(metrics=metrics)
+    print(f"Наименьшее достижимое p-value: {harness.best_p_value():.4f} (alpha {harness.alpha})")
+    strong, null = acceptance(10.0), acceptance(1.0)
+    print(f"Принято твиков с ускорением в 10 раз: {strong:.0%}, без эффекта: {null:.0%}")
+    if strong < 1.0 or null > harness.alpha:
+        sys.exit(1)
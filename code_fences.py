@@ -0,0 +1,175 @@
+import os
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+FENCE = '```'
+PART_SUFFIX = '.part'
+
+# Метка блока -> тип файла, в который он пишется
+BLOCK_KINDS = {
+    'reg': 'reg',
+    'bat': 'bat',
+    'cmd': 'bat',
+    'batch': 'bat',
+}
+
+# Блок кода из ответа:
+#   label  — метка после ``` в нижнем регистре ('' если её нет)
+#   text   — содержимое без пустых строк по краям
+#   line   — номер строки ответа с открывающей ```
+#   closed — False, если ответ оборвался внутри блока
+CodeBlock = namedtuple('CodeBlock', 'label text line closed')
+
+
+class FenceTokenizer:
+    """Потоковый разбор блоков ```метка ... ``` в тексте ответа модели.
+
+    Текст подаётся кусками произвольной длины через feed(), события
+    возвращаются по мере появления полных строк:
+      ('start', (метка, строка)) — открыт блок в строке с этим номером
+                                   (метка в нижнем регистре, может быть '')
+      ('line', текст)            — строка внутри блока (без перевода строки)
+      ('end', закрыт)            — блок закончился (закрыт=False, если ответ оборвался)
+    Строки вне блоков не возвращаются.
+    """
+
+    def __init__(self):
+        self._partial = ''
+        self.in_block = False
+        self.label = None
+        self.line_number = 0
+
+    def feed(self, text):
+        events = []
+        self._partial += text
+        *lines, self._partial = self._partial.split('\n')
+        for line in lines:
+            self._line(line.rstrip('\r'), events)
+        return events
+
+    def finish(self):
+        """Обрабатывает последнюю неполную строку и закрывает оборванный блок"""
+        events = []
+        if self._partial:
+            self._line(self._partial.rstrip('\r'), events)
+            self._partial = ''
+        if self.in_block:
+            events.append(('end', False))
+            self.in_block = False
+        return events
+
+    def _line(self, line, events):
+        self.line_number += 1
+        stripped = line.strip()
+        if not self.in_block:
+            if stripped.startswith(FENCE):
+                words = stripped[len(FENCE):].split()
+                self.label = words[0].lower() if words else ''
+                self.in_block = True
+                events.append(('start', (self.label, self.line_number)))
+            return
+        if stripped == FENCE:
+            self.in_block = False
+            events.append(('end', True))
+            return
+        events.append(('line', line))
+
+
+def scan_blocks(text):
+    """Все блоки кода из готового текста за один проход"""
+    spooler = BlockSpooler()
+    spooler.feed(text)
+    spooler.close()
+    return spooler.blocks
+
+
+class BlockSpooler:
+    """Собирает блоки кода из ответа, пока ответ ещё генерируется.
+
+    paths — {'reg': путь, 'bat': путь}. Первый блок с меткой reg и первый
+    с меткой bat/cmd сразу пишутся во временные файлы <путь>.part; решение,
+    какой блок попадёт в итоговый файл, принимается после проверки ответа
+    (response_extract.finish_spooled). После close() в blocks лежат все
+    блоки ответа (CodeBlock), в spooled — {тип: индекс блока в .part}.
+    """
+
+    def __init__(self, paths=None):
+        self.paths = paths or {}
+        self.blocks = []
+        self.spooled = {}
+        self.tokenizer = FenceTokenizer()
+        self._parts = []
+        self._label = None
+        self._start_line = 0
+        self._lines = None
+        self._file = None
+
+    @property
+    def text(self):
+        return ''.join(self._parts)
+
+    def part_path(self, kind):
+        return self.paths[kind] + PART_SUFFIX
+
+    def feed(self, chunk):
+        self._parts.append(chunk)
+        self._handle(self.tokenizer.feed(chunk))
+
+    def close(self):
+        self._handle(self.tokenizer.finish())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _handle(self, events):
+        for event, value in events:
+            if event == 'start':
+                self._start(*value)
+            elif event == 'line':
+                self._lines.append(value)
+                if self._file is not None:
+                    self._spool(value)
+            else:
+                self._end(value)
+
+    def _spool(self, line):
+        # Пустые строки по краям блока не пишутся (как при strip()):
+        # пустые строки откладываются до следующей непустой
+        if not line.strip():
+            self._blank += 1
+            return
+        if self._written:
+            self._file.write('\n' * self._blank)
+        self._file.write(line + '\n')
+        self._file.flush()
+        self._written = True
+        self._blank = 0
+
+    def _start(self, label, line):
+        self._label = label
+        self._start_line = line
+        self._lines = []
+        kind = BLOCK_KINDS.get(label)
+        if kind is None or kind in self.spooled or kind not in self.paths:
+            return
+        path = self.part_path(kind)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'w', encoding='utf-8')
+        self._written = False
+        self._blank = 0
+        self.spooled[kind] = len(self.blocks)
+        logger.info(f"Блок {label} пишется в {path}")
+
+    def _end(self, closed):
+        self.blocks.append(CodeBlock(self._label, '\n'.join(self._lines).strip(), self._start_line, closed))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if not closed:
+                logger.warning(f"Блок {self._label} в ответе модели не закрыт")
+        self._label = None
+        self._lines = None
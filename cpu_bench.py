@@ -0,0 +1,297 @@
+import gc
+import os
+import time
+import array
+import random
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from startup_profile import lazy_import
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET = 0.2
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+# Шагов по случайному циклу при замере задержки памяти без NumPy
+LATENCY_STEPS = 200000
+# С NumPy: столько цепочек идут по циклу одновременно (одна выборка
+# chain[index] на шаг для всех), и столько шагов делает каждая
+GATHER_LANES = 1024
+GATHER_STEPS = 2048
+# Предельная длина цикла (2^21 элементов по 8 байт — 16 МБ, больше типичного L3)
+CHAIN_LIMIT = 1 << 21
+MASK64 = (1 << 64) - 1
+
+# Точка кривой масштабирования: workers процессов выполняют по одной
+# одинаковой задаче; speedup — пропускная способность относительно одного
+# процесса, efficiency — speedup / workers
+ScalingPoint = namedtuple('ScalingPoint', 'workers seconds throughput speedup efficiency')
+
+
+# Ядра должны быть функциями модуля: они передаются в дочерние процессы
+
+def int_kernel(n, seed=1):
+    """Целочисленное ядро: xorshift64 и перемешивание; возвращает контрольную сумму"""
+    x = (0x9E3779B97F4A7C15 * seed) & MASK64 or 1
+    acc = 0
+    for _ in range(n):
+        x ^= (x << 13) & MASK64
+        x ^= x >> 7
+        x ^= (x << 17) & MASK64
+        acc = (acc * 31 + (x & 0xFFFF)) % 1000000007
+    return acc
+
+
+def float_kernel(n, seed=1):
+    """Ядро с плавающей точкой: итерации отображения Мандельброта по сетке точек"""
+    total = 0
+    width = 64
+    for i in range(n):
+        cr = -2.0 + 2.5 * ((i * seed) % width) / width
+        ci = -1.25 + 2.5 * ((i // width) % width) / width
+        zr = zi = 0.0
+        for k in range(32):
+            zr, zi = zr * zr - zi * zi + cr, 2.0 * zr * zi + ci
+            if zr * zr + zi * zi > 4.0:
+                break
+        total += k
+    return total
+
+
+def _pool_task(n):
+    return int_kernel(n)
+
+
+def _timed(func, *args):
+    # Сборщик мусора выключается, чтобы его паузы не попадали в замер
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def available_cores():
+    """Число ядер, на которых может работать процесс (с учётом привязки к ядрам)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    try:
+        return len(lazy_import('psutil').Process().cpu_affinity())
+    except Exception:
+        return os.cpu_count() or 1
+
+
+def _power_steps(limit):
+    steps = []
+    n = 1
+    while n < limit:
+        steps.append(n)
+        n *= 2
+    steps.append(limit)
+    return steps
+
+
+class CpuBenchmark:
+    """Набор микробенчмарков процессора и памяти с фиксированным объёмом работы.
+
+    Размер работы каждого ядра подбирается один раз (prepare) так, чтобы
+    оно шло около target секунд, и дальше не меняется: замеры до и после
+    твика выполняют одну и ту же работу, и результат — время в секундах
+    (меньше — лучше), как у остальных бенчмарков. Пропускная способность
+    (операций/с, ГБ/с, нс на обращение) пишется в лог и в last.
+
+    NumPy используется для полосы памяти (copy и triad) и случайных
+    обращений (выборка по индексам), если установлен и use_numpy не False.
+    Без него полоса меряется копированием bytearray, а обход цикла в
+    Python — это в основном время интерпретатора, поэтому он только
+    пишется в лог и в результат замера не входит.
+    """
+
+    def __init__(self, target=DEFAULT_TARGET, memory_bytes=DEFAULT_MEMORY_BYTES, workers=0,
+                 use_numpy=None, seed=0):
+        self.target = target
+        self.memory_bytes = max(1024 * 1024, memory_bytes)
+        self.workers = workers or available_cores()
+        self.seed = seed
+        self.numpy = None
+        if use_numpy is not False:
+            try:
+                self.numpy = lazy_import('numpy')
+            except ImportError:
+                if use_numpy:
+                    raise
+                logger.info("NumPy не установлен, полоса памяти меряется копированием bytearray")
+        self.sizes = None
+        self.last = {}
+        self._pool = None
+        self._buffers = None
+        self._chain = None
+
+    # Подготовка
+
+    def _calibrate(self, func, start=1000):
+        n = start
+        while True:
+            seconds, _ = _timed(func, n)
+            if seconds >= self.target / 10 or n >= 1 << 30:
+                return max(1, int(n * self.target / max(seconds, 1e-9)))
+            n *= 4
+
+    def prepare(self):
+        """Подбирает объём работы ядер и выделяет буферы (один раз)"""
+        if self.sizes is not None:
+            return
+        self.sizes = {'int': self._calibrate(int_kernel), 'float': self._calibrate(float_kernel, 100)}
+        if self.numpy is not None:
+            np = self.numpy
+            count = self.memory_bytes // 8
+            self._buffers = (np.full(count, 1.5), np.full(count, 2.5), np.empty(count))
+        else:
+            source = bytearray(b'\x5a') * self.memory_bytes
+            self._buffers = (source, bytearray(self.memory_bytes))
+        self._chain = self._build_chain(min(self.memory_bytes // 8, CHAIN_LIMIT))
+        rounds_time, _ = _timed(self._bandwidth_round)
+        self.sizes['memory'] = max(1, int(self.target / max(rounds_time, 1e-9)))
+        logger.info(f"Микробенчмарки CPU: объём работы {self.sizes}, процессов {self.workers}, "
+                    f"NumPy {'есть' if self.numpy is not None else 'нет'}")
+
+    def _build_chain(self, count):
+        # Один случайный цикл по всем элементам (алгоритм Саттоло):
+        # каждое следующее обращение — в непредсказуемое место памяти
+        if self.numpy is not None:
+            order = self.numpy.random.default_rng(self.seed).permutation(count)
+            chain = self.numpy.empty(count, dtype=self.numpy.intp)
+            chain[order] = self.numpy.roll(order, -1)
+            return chain
+        rng = random.Random(self.seed)
+        order = list(range(count))
+        for i in range(count - 1, 0, -1):
+            j = rng.randrange(i)
+            order[i], order[j] = order[j], order[i]
+        chain = array.array('q', bytes(8 * count))
+        for i in range(count):
+            chain[order[i]] = order[(i + 1) % count]
+        return chain
+
+    def _bandwidth_round(self):
+        if self.numpy is not None:
+            a, b, c = self._buffers
+            self.numpy.copyto(c, a)
+            # triad: c = a + 3 * b
+            self.numpy.multiply(b, 3.0, out=c)
+            self.numpy.add(c, a, out=c)
+            return 7 * self.memory_bytes
+        source, target = self._buffers
+        target[:] = source
+        return 2 * self.memory_bytes
+
+    # Замеры (время в секундах)
+
+    def measure_cpu(self):
+        """Целочисленное и плавающее ядра в одном потоке"""
+        self.prepare()
+        int_time, _ = _timed(int_kernel, self.sizes['int'], self.seed + 1)
+        float_time, _ = _timed(float_kernel, self.sizes['float'], self.seed + 1)
+        self.last['int_ops'] = self.sizes['int'] / int_time
+        self.last['float_ops'] = self.sizes['float'] / float_time
+        logger.info(f"CPU: целочисленное ядро {int_time:.3f} сек ({self.last['int_ops'] / 1e6:.2f} млн итераций/с), "
+                    f"плавающее {float_time:.3f} сек ({self.last['float_ops'] / 1e3:.1f} тыс. точек/с)")
+        return int_time + float_time
+
+    def measure_memory(self):
+        """Полоса памяти на буферах memory_bytes и задержка случайного доступа"""
+        self.prepare()
+
+        def bandwidth():
+            moved = 0
+            for _ in range(self.sizes['memory']):
+                moved += self._bandwidth_round()
+            return moved
+
+        seconds, moved = _timed(bandwidth)
+        chain = self._chain
+
+        if self.numpy is not None:
+            np = self.numpy
+            lanes = min(GATHER_LANES, len(chain))
+
+            def chase():
+                # Цепочки стартуют в разных местах цикла; шаг — одна выборка по индексам
+                index = np.arange(lanes, dtype=np.intp) * (len(chain) // lanes)
+                scratch = np.empty_like(index)
+                for _ in range(GATHER_STEPS):
+                    np.take(chain, index, out=scratch)
+                    index, scratch = scratch, index
+                return int(index[0])
+
+            accesses = lanes * GATHER_STEPS
+        else:
+            def chase():
+                index = 0
+                for _ in range(LATENCY_STEPS):
+                    index = chain[index]
+                return index
+
+            accesses = LATENCY_STEPS
+        chase_time, _ = _timed(chase)
+        self.last['bandwidth'] = moved / seconds
+        self.last['latency_ns'] = chase_time / accesses * 1e9
+        # С NumPy цепочки идут параллельно, и это время на обращение при
+        # нескольких одновременных промахах кэша, а не задержка одного
+        logger.info(f"Память: {self.last['bandwidth'] / 1024 ** 3:.2f} ГБ/с, случайное обращение "
+                    f"{self.last['latency_ns']:.1f} нс"
+                    f"{f' (выборка NumPy, {lanes} цепочек)' if self.numpy is not None else ' (цикл Python, в замер не входит)'}")
+        if self.numpy is None:
+            return seconds
+        return seconds + chase_time
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+            # Прогрев: все процессы пула запущены до первого замера
+            list(self._pool.map(_pool_task, [1] * self.workers))
+        return self._pool
+
+    def _run_parallel(self, pool, workers):
+        n = self.sizes['int']
+        start = time.perf_counter()
+        list(pool.map(_pool_task, [n] * workers))
+        return time.perf_counter() - start
+
+    def measure_parallel(self):
+        """Одинаковая задача на каждом из workers процессов одновременно"""
+        self.prepare()
+        seconds = self._run_parallel(self._get_pool(), self.workers)
+        self.last['parallel_ops'] = self.sizes['int'] * self.workers / seconds
+        logger.info(f"CPU, {self.workers} процессов: {seconds:.3f} сек "
+                    f"({self.last['parallel_ops'] / 1e6:.2f} млн итераций/с)")
+        return seconds
+
+    def scaling(self, limit=None):
+        """Кривая масштабирования от 1 до limit (по умолчанию workers) процессов"""
+        self.prepare()
+        points = []
+        base = None
+        for workers in _power_steps(limit or self.workers):
+            with ProcessPoolExecutor(workers) as pool:
+                list(pool.map(_pool_task, [1] * workers))
+                seconds = self._run_parallel(pool, workers)
+            throughput = self.sizes['int'] * workers / seconds
+            base = base or throughput
+            point = ScalingPoint(workers, seconds, throughput, throughput / base, throughput / base / workers)
+            logger.info(f"Масштабирование: {workers} процессов — {seconds:.3f} сек, ускорение {point.speedup:.2f}, "
+                        f"эффективность {point.efficiency * 100:.0f}%")
+            points.append(point)
+        return points
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._buffers = None
+        self._chain = None
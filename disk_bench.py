@@ -0,0 +1,299 @@
+import os
+import sys
+import mmap
+import time
+import random
+import logging
+import threading
+from collections import namedtuple
+
+from bench_stats import percentile
+
+logger = logging.getLogger(__name__)
+
+TEST_FILE = 'io_bench.dat'
+DEFAULT_FILE_SIZE = 256 * 1024 * 1024
+# Выравнивание смещений и буферов для прямого ввода-вывода
+ALIGNMENT = 4096
+FILL_CHUNK = 1024 * 1024
+FSYNC_POLICIES = ('none', 'end', 'each')
+PATTERNS = ('seq', 'rand')
+OPERATIONS = ('read', 'write')
+
+# Задание бенчмарка:
+#   pattern    — 'seq' (каждый поток идёт по своей полосе файла) или 'rand'
+#   op         — 'read' или 'write'
+#   block_size — размер одной операции в байтах
+#   threads    — число потоков (глубина очереди): у каждого свой дескриптор
+#                файла, иначе Windows выполняет синхронные операции над одним
+#                дескриптором по очереди
+#   ops        — операций на поток; limit — предел времени задания в секундах
+IOJob = namedtuple('IOJob', 'name pattern op block_size threads ops limit')
+
+# Результат задания: задержки одной операции в миллисекундах;
+# queue_depth — сколько операций могло выполняться одновременно
+# (число потоков, каждый со своим дескриптором файла)
+IOResult = namedtuple('IOResult', 'name ops bytes seconds mb_per_s iops p50 p95 p99 direct queue_depth')
+
+DEFAULT_JOBS = [
+    IOJob('seq_read_1m', 'seq', 'read', 1024 * 1024, 1, 64, 10.0),
+    IOJob('seq_write_1m', 'seq', 'write', 1024 * 1024, 1, 64, 10.0),
+    IOJob('rand_read_4k_qd4', 'rand', 'read', 4096, 4, 1024, 10.0),
+    IOJob('rand_write_4k_qd4', 'rand', 'write', 4096, 4, 512, 10.0),
+]
+
+
+def parse_job(line):
+    """Задание из строки settings.ini: название|seq/rand|read/write|блок_КБ|потоков|операций[|предел_сек]"""
+    parts = [part.strip() for part in line.split('|')]
+    if len(parts) not in (6, 7):
+        raise ValueError(f"ожидается 6 или 7 полей через |: {line}")
+    name, pattern, op = parts[0], parts[1].lower(), parts[2].lower()
+    if pattern not in PATTERNS:
+        raise ValueError(f"неизвестный шаблон доступа {pattern}")
+    if op not in OPERATIONS:
+        raise ValueError(f"неизвестная операция {op}")
+    block_size = int(parts[3]) * 1024
+    if block_size <= 0 or block_size % ALIGNMENT:
+        raise ValueError(f"размер блока должен быть кратен {ALIGNMENT // 1024} КБ")
+    limit = float(parts[6]) if len(parts) == 7 else 10.0
+    return IOJob(name, pattern, op, block_size, max(1, int(parts[4])), max(1, int(parts[5])), limit)
+
+
+class _PosixFile:
+    """Файл с позиционным вводом-выводом; O_DIRECT, если его поддерживает ФС"""
+
+    def __init__(self, path, direct):
+        flags = os.O_RDWR
+        self.direct = False
+        if direct and hasattr(os, 'O_DIRECT'):
+            try:
+                self.fd = os.open(path, flags | os.O_DIRECT)
+                self.direct = True
+                return
+            except OSError as e:
+                logger.info(f"O_DIRECT для {path} недоступен ({e}), используется кэш ОС")
+        self.fd = os.open(path, flags)
+        if direct and sys.platform == 'darwin':
+            import fcntl
+            fcntl.fcntl(self.fd, fcntl.F_NOCACHE, 1)
+            self.direct = True
+
+    def pread(self, buffer, offset):
+        return os.preadv(self.fd, [buffer], offset)
+
+    def pwrite(self, buffer, offset):
+        return os.pwritev(self.fd, [buffer], offset)
+
+    def fsync(self):
+        os.fsync(self.fd)
+
+    def drop_cache(self):
+        # Без O_DIRECT чтение шло бы из кэша страниц: выгружаем файл из кэша
+        if not self.direct and hasattr(os, 'posix_fadvise'):
+            os.fsync(self.fd)
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _WindowsFile:
+    """Файл Windows с FILE_FLAG_NO_BUFFERING и позиционными ReadFile/WriteFile"""
+
+    def __init__(self, path, direct):
+        import ctypes
+        from ctypes import wintypes
+
+        class OVERLAPPED(ctypes.Structure):
+            _fields_ = [('Internal', ctypes.c_void_p), ('InternalHigh', ctypes.c_void_p),
+                        ('Offset', wintypes.DWORD), ('OffsetHigh', wintypes.DWORD),
+                        ('hEvent', wintypes.HANDLE)]
+
+        GENERIC_READ_WRITE = 0x80000000 | 0x40000000
+        FILE_SHARE_READ_WRITE = 0x1 | 0x2
+        OPEN_EXISTING = 3
+        FILE_FLAG_NO_BUFFERING = 0x20000000
+        self.ctypes = ctypes
+        self.wintypes = wintypes
+        self.OVERLAPPED = OVERLAPPED
+        self.kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        self.kernel32.CreateFileW.restype = wintypes.HANDLE
+        self.direct = bool(direct)
+        self.handle = self.kernel32.CreateFileW(path, GENERIC_READ_WRITE, FILE_SHARE_READ_WRITE, None, OPEN_EXISTING,
+                                                FILE_FLAG_NO_BUFFERING if direct else 0, None)
+        if self.handle == wintypes.HANDLE(-1).value:
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def _io(self, function, buffer, offset):
+        overlapped = self.OVERLAPPED(0, 0, offset & 0xFFFFFFFF, offset >> 32, None)
+        done = self.wintypes.DWORD()
+        # Массив ctypes поверх выровненного буфера mmap, без копирования
+        array = (self.ctypes.c_char * len(buffer)).from_buffer(buffer)
+        ok = function(self.handle, array, len(buffer), self.ctypes.byref(done), self.ctypes.byref(overlapped))
+        del array
+        if not ok:
+            raise self.ctypes.WinError(self.ctypes.get_last_error())
+        return done.value
+
+    def pread(self, buffer, offset):
+        return self._io(self.kernel32.ReadFile, buffer, offset)
+
+    def pwrite(self, buffer, offset):
+        return self._io(self.kernel32.WriteFile, buffer, offset)
+
+    def fsync(self):
+        self.kernel32.FlushFileBuffers(self.handle)
+
+    def drop_cache(self):
+        pass
+
+    def close(self):
+        self.kernel32.CloseHandle(self.handle)
+
+
+def open_test_file(path, direct):
+    if sys.platform == 'win32':
+        return _WindowsFile(path, direct)
+    return _PosixFile(path, direct)
+
+
+class DiskBenchmark:
+    """Бенчмарк диска на одном заранее созданном тестовом файле.
+
+    Файл размером file_size создаётся один раз и переиспользуется между
+    замерами и запусками (пересоздаётся только при смене размера), поэтому
+    запись на SSD ограничена самими заданиями записи. Буферы выровнены по
+    странице, что нужно для прямого ввода-вывода (O_DIRECT, F_NOCACHE,
+    FILE_FLAG_NO_BUFFERING). Если прямой ввод-вывод недоступен, перед
+    заданиями чтения файл выгружается из кэша ОС, где это возможно.
+
+    fsync — политика сброса при записи: 'none', 'end' (один раз после
+    задания, входит во время) или 'each' (после каждой операции).
+    """
+
+    def __init__(self, path, file_size=DEFAULT_FILE_SIZE, jobs=None, direct=True, fsync='end', seed=0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Неизвестная политика fsync: {fsync}")
+        self.path = path
+        self.file_size = max(ALIGNMENT, file_size - file_size % ALIGNMENT)
+        self.jobs = list(jobs or DEFAULT_JOBS)
+        self.direct = direct
+        self.fsync = fsync
+        self.seed = seed
+        self.last_results = []
+        for job in self.jobs:
+            if job.block_size > self.file_size // job.threads:
+                raise ValueError(f"Задание {job.name}: блок больше полосы файла на поток")
+
+    def prepare(self):
+        """Создаёт тестовый файл, если его нет или размер другой"""
+        try:
+            if os.path.getsize(self.path) == self.file_size:
+                return False
+        except OSError:
+            pass
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        logger.info(f"Создание тестового файла {self.path} ({self.file_size // (1024 * 1024)} МБ)")
+        # Несжимаемые данные, чтобы контроллер SSD не мог схлопнуть запись
+        chunk = bytearray(os.urandom(FILL_CHUNK))
+        with open(self.path, 'wb') as f:
+            written = 0
+            while written < self.file_size:
+                size = min(FILL_CHUNK, self.file_size - written)
+                chunk[:8] = written.to_bytes(8, 'little')
+                f.write(chunk[:size])
+                written += size
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+
+    def _offsets(self, job, worker):
+        blocks = self.file_size // job.block_size
+        if job.pattern == 'rand':
+            rng = random.Random(f'{self.seed}:{job.name}:{worker}')
+            for _ in range(job.ops):
+                yield rng.randrange(blocks) * job.block_size
+            return
+        # Последовательно: у каждого потока своя полоса файла, по кругу
+        stripe = blocks // job.threads
+        first = worker * stripe
+        for i in range(job.ops):
+            yield (first + i % stripe) * job.block_size
+
+    def _worker(self, handle, job, worker, deadline, latencies, errors):
+        buffer = mmap.mmap(-1, job.block_size)
+        if job.op == 'write':
+            buffer.write(os.urandom(job.block_size))
+        io = handle.pread if job.op == 'read' else handle.pwrite
+        each = job.op == 'write' and self.fsync == 'each'
+        clock = time.perf_counter_ns
+        try:
+            for offset in self._offsets(job, worker):
+                start = clock()
+                io(buffer, offset)
+                if each:
+                    handle.fsync()
+                latencies.append(clock() - start)
+                if start > deadline:
+                    break
+        except OSError as e:
+            errors.append(e)
+        finally:
+            buffer.close()
+
+    def run_job(self, job):
+        handles = []
+        try:
+            # Дескрипторы открываются до старта: время открытия не входит в замер
+            for _ in range(job.threads):
+                handles.append(open_test_file(self.path, self.direct))
+            if job.op == 'read':
+                handles[0].drop_cache()
+            latencies = [[] for _ in range(job.threads)]
+            errors = []
+            start = time.perf_counter_ns()
+            deadline = start + int(job.limit * 1e9)
+            threads = [threading.Thread(target=self._worker, args=(handles[n], job, n, deadline, latencies[n], errors))
+                       for n in range(job.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if job.op == 'write' and self.fsync == 'end':
+                for handle in handles:
+                    handle.fsync()
+            seconds = (time.perf_counter_ns() - start) / 1e9
+            direct = all(handle.direct for handle in handles)
+        finally:
+            for handle in handles:
+                handle.close()
+        if errors:
+            raise errors[0]
+        samples = sorted(value / 1e6 for worker in latencies for value in worker)
+        ops = len(samples)
+        total = ops * job.block_size
+        result = IOResult(job.name, ops, total, seconds, total / (1024 * 1024) / seconds if seconds else 0.0,
+                          ops / seconds if seconds else 0.0, percentile(samples, 50), percentile(samples, 95),
+                          percentile(samples, 99), direct, len(handles))
+        logger.info(f"Диск {job.name} (очередь {result.queue_depth}): {result.mb_per_s:.1f} МБ/с, {result.iops:.0f} IOPS, "
+                    f"задержка p50/p95/p99 {result.p50:.3f}/{result.p95:.3f}/{result.p99:.3f} мс, "
+                    f"{ops} операций за {seconds:.2f} сек{'' if direct else ' (через кэш ОС)'}")
+        return result
+
+    def run(self):
+        """Выполняет все задания; возвращает список IOResult"""
+        self.prepare()
+        self.last_results = [self.run_job(job) for job in self.jobs]
+        return self.last_results
+
+    def measure(self):
+        """Суммарное время всех заданий в секундах (меньше — лучше) для BenchmarkHarness"""
+        try:
+            results = self.run()
+        except OSError as e:
+            logger.error(f"Ошибка дискового бенчмарка на {self.path}: {e}")
+            return "IO_ERROR"
+        return sum(result.seconds for result in results)
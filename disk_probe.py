@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import base64
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from startup_profile import lazy_import
+
+logger = logging.getLogger(__name__)
+
+SSD = 'SSD'
+HDD = 'HDD'
+UNKNOWN = 'UNKNOWN'
+
+# Файл кэша результатов и время его жизни (в секундах)
+CACHE_FILE = 'disk_cache.json'
+CACHE_TTL = 7 * 24 * 3600
+PROBE_TIMEOUT = 15
+
+
+def run_command(cmd, timeout=PROBE_TIMEOUT):
+    """Выполняет команду оболочки и возвращает её stdout"""
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
+    return result.stdout or ''
+
+
+class CommandRunner:
+    """Запуск команд проб, которые можно завершить, когда ответ уже получен.
+
+    Как run_command, но запущенные процессы запоминаются, и kill_all()
+    завершает их вместе с потомками (shell=True запускает команду через
+    cmd.exe, и сама проба — его дочерний процесс).
+    """
+
+    def __init__(self, timeout=PROBE_TIMEOUT):
+        self.timeout = timeout
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, cmd, timeout=None):
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        with self._lock:
+            self._processes.add(process)
+        try:
+            stdout, _ = process.communicate(timeout=self.timeout if timeout is None else timeout)
+        except subprocess.TimeoutExpired:
+            self._kill(process)
+            process.communicate()
+            raise
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        return stdout or ''
+
+    @staticmethod
+    def _kill(process):
+        psutil = lazy_import('psutil')
+        try:
+            for child in psutil.Process(process.pid).children(recursive=True):
+                child.kill()
+        except psutil.Error:
+            pass
+        process.kill()
+
+    def kill_all(self):
+        """Завершает все ещё работающие команды; возвращает их число"""
+        with self._lock:
+            processes = [p for p in self._processes if p.poll() is None]
+        for process in processes:
+            self._kill(process)
+        return len(processes)
+
+
+def powershell(script):
+    """Команда PowerShell со сценарием в -EncodedCommand: без экранирования кавычек для cmd"""
+    encoded = base64.b64encode(script.encode('utf-16-le')).decode('ascii')
+    return f'powershell -NoProfile -NonInteractive -EncodedCommand {encoded}'
+
+
+# --- Стратегии определения типа диска ---
+# Каждая стратегия получает букву диска и функцию запуска команд,
+# возвращает 'SSD', 'HDD' или None, если ответа нет.
+
+def probe_powershell_wmi(drive_letter, runner):
+    # Диск тома находится по связям WMI: логический диск -> раздел -> физический диск
+    # (ASSOCIATORS OF Win32_LogicalDiskToPartition и Win32_DiskDriveToDiskPartition)
+    cmd = powershell(f"Get-CimInstance Win32_LogicalDisk -Filter \"DeviceID='{drive_letter.upper()}:'\" | "
+                     "Get-CimAssociatedInstance -ResultClassName Win32_DiskPartition | "
+                     "Get-CimAssociatedInstance -ResultClassName Win32_DiskDrive | "
+                     "Select-Object MediaType,Model | Format-List")
+    output = runner(cmd)
+    logger.info(f"PowerShell результат для диска {drive_letter}: {output}")
+    if 'SSD' in output.upper() or 'SOLID' in output.upper():
+        return SSD
+    elif 'HDD' in output.upper():
+        return HDD
+    return None
+
+
+def probe_physical_disk(drive_letter, runner):
+    cmd = f'powershell "Get-PhysicalDisk | Get-Disk | Get-Partition | Where-Object {{$_.DriveLetter -eq \'{drive_letter}\'}} | Get-Disk | Get-PhysicalDisk | Select-Object MediaType"'
+    output = runner(cmd)
+    logger.info(f"PowerShell альтернативный результат для диска {drive_letter}: {output}")
+    if 'SSD' in output.upper():
+        return SSD
+    elif 'HDD' in output.upper():
+        return HDD
+    return None
+
+
+def probe_wmi(drive_letter, runner):
+    try:
+        import wmi
+    except ImportError:
+        logger.warning(f"WMI не установлен для диска {drive_letter}")
+        return None
+    # Стратегии выполняются в рабочих потоках, где COM ещё не инициализирован
+    import pythoncom
+    pythoncom.CoInitialize()
+    c = wmi.WMI()
+    for partition in c.Win32_DiskPartition():
+        if partition.DriveLetter != drive_letter.upper():
+            continue
+        for physical_disk in c.Win32_DiskDrive():
+            if physical_disk.Index != partition.DiskIndex:
+                continue
+            logger.info(f"WMI данные для диска {drive_letter}: Model={getattr(physical_disk, 'Model', 'N/A')}, MediaType={getattr(physical_disk, 'MediaType', 'N/A')}, InterfaceType={getattr(physical_disk, 'InterfaceType', 'N/A')}")
+            for attr, keywords in (('MediaType', ('ssd', 'solid')),
+                                   ('Model', ('ssd', 'solid', 'nvme')),
+                                   ('InterfaceType', ('nvme', 'ssd'))):
+                value = (getattr(physical_disk, attr, None) or '').lower()
+                if any(keyword in value for keyword in keywords):
+                    return SSD
+            return HDD
+    return None
+
+
+def probe_wmic(drive_letter, runner):
+    output = runner('wmic diskdrive get model,mediatype,interfacetype /format:csv')
+    logger.info(f"WMIC результат для диска {drive_letter}: {output}")
+    if 'ssd' in output.lower() or 'nvme' in output.lower():
+        return SSD
+    elif 'hdd' in output.lower() or 'ata' in output.lower():
+        return HDD
+    return None
+
+
+def probe_wmic_model(drive_letter, runner):
+    output = runner('wmic diskdrive get model /format:csv')
+    logger.info(f"WMIC модель для диска {drive_letter}: {output}")
+    if any(keyword in output.lower() for keyword in ['ssd', 'nvme', 'solid', 'samsung', 'crucial', 'kingston']):
+        return SSD
+    return None
+
+
+# Стратегии в порядке убывания точности. Флаг definitive означает, что
+# стратегия смотрит именно на нужный диск: её ответ принимается сразу.
+# Ответы эвристических стратегий (wmic по всем дискам) используются только
+# если ни одна точная стратегия не дала результата.
+DEFAULT_STRATEGIES = [
+    ('powershell_wmi', probe_powershell_wmi, True),
+    ('physical_disk', probe_physical_disk, True),
+    ('wmi', probe_wmi, True),
+    ('wmic', probe_wmic, False),
+    ('wmic_model', probe_wmic_model, False),
+]
+
+
+# --- Нативные быстрые пути ---
+
+def _drive_root(drive):
+    if len(drive) == 1 and drive.isalpha():
+        return f'{drive.upper()}:\\'
+    return drive
+
+
+def _linux_sysfs_dir(path):
+    """Находит каталог блочного устройства в /sys для файла или точки монтирования"""
+    st = os.stat(path)
+    dev_dir = f'/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}'
+    if not os.path.exists(dev_dir):
+        return None
+    dev_dir = os.path.realpath(dev_dir)
+    # Для раздела очередь находится у родительского устройства
+    if not os.path.exists(os.path.join(dev_dir, 'queue')):
+        dev_dir = os.path.dirname(dev_dir)
+    return dev_dir
+
+
+def _linux_disk_type(path):
+    dev_dir = _linux_sysfs_dir(path)
+    if not dev_dir:
+        return None
+    try:
+        with open(os.path.join(dev_dir, 'queue', 'rotational')) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if value == '0':
+        return SSD
+    if value == '1':
+        return HDD
+    return None
+
+
+def _windows_disk_type(drive):
+    """Спрашивает у драйвера диска, есть ли у него задержка позиционирования головки"""
+    import ctypes
+    from ctypes import wintypes
+
+    class STORAGE_PROPERTY_QUERY(ctypes.Structure):
+        _fields_ = [('PropertyId', wintypes.DWORD),
+                    ('QueryType', wintypes.DWORD),
+                    ('AdditionalParameters', ctypes.c_ubyte * 1)]
+
+    class DEVICE_SEEK_PENALTY_DESCRIPTOR(ctypes.Structure):
+        _fields_ = [('Version', wintypes.DWORD),
+                    ('Size', wintypes.DWORD),
+                    ('IncursSeekPenalty', wintypes.BOOLEAN)]
+
+    IOCTL_STORAGE_QUERY_PROPERTY = 0x2D1400
+    StorageDeviceSeekPenaltyProperty = 7
+    FILE_SHARE_READ_WRITE = 0x1 | 0x2
+    OPEN_EXISTING = 3
+    INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    handle = kernel32.CreateFileW(f'\\\\.\\{drive.upper()}:', 0, FILE_SHARE_READ_WRITE,
+                                  None, OPEN_EXISTING, 0, None)
+    if handle == INVALID_HANDLE_VALUE:
+        return None
+    try:
+        query = STORAGE_PROPERTY_QUERY(StorageDeviceSeekPenaltyProperty, 0)
+        descriptor = DEVICE_SEEK_PENALTY_DESCRIPTOR()
+        returned = wintypes.DWORD()
+        ok = kernel32.DeviceIoControl(handle, IOCTL_STORAGE_QUERY_PROPERTY,
+                                      ctypes.byref(query), ctypes.sizeof(query),
+                                      ctypes.byref(descriptor), ctypes.sizeof(descriptor),
+                                      ctypes.byref(returned), None)
+        if not ok:
+            return None
+        return HDD if descriptor.IncursSeekPenalty else SSD
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def native_disk_type(drive):
+    """Быстрое определение типа диска без запуска внешних процессов"""
+    try:
+        if sys.platform == 'win32' and len(drive) == 1:
+            return _windows_disk_type(drive)
+        if sys.platform.startswith('linux'):
+            return _linux_disk_type(_drive_root(drive))
+    except Exception as e:
+        logger.warning(f"Ошибка нативного определения типа диска {drive}: {e}")
+    return None
+
+
+def volume_identity(drive):
+    """Возвращает строку, однозначно определяющую том (для ключа кэша)"""
+    try:
+        if sys.platform == 'win32' and len(drive) == 1:
+            import ctypes
+            serial = ctypes.c_ulong()
+            if ctypes.windll.kernel32.GetVolumeInformationW(_drive_root(drive), None, 0,
+                                                             ctypes.byref(serial), None, None, None, 0):
+                return f'{drive.upper()}:{serial.value:08X}'
+        else:
+            st = os.stat(_drive_root(drive))
+            return f'{drive}:{os.major(st.st_dev)}:{os.minor(st.st_dev)}'
+    except Exception as e:
+        logger.warning(f"Не удалось получить идентификатор тома {drive}: {e}")
+    return None
+
+
+class DiskProbe:
+    """Определяет тип диска: кэш -> нативный запрос -> параллельные внешние пробы"""
+
+    def __init__(self, runner=None, strategies=None, cache_path=CACHE_FILE,
+                 ttl=CACHE_TTL, native=True, identity=volume_identity):
+        # None — для каждого диска свой CommandRunner, проигравшие пробы завершаются
+        self.runner = runner
+        self.strategies = DEFAULT_STRATEGIES if strategies is None else strategies
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.native = native
+        self.identity = identity
+        self._lock = threading.Lock()
+
+    # --- Кэш ---
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Кэш типов дисков повреждён и будет перезаписан: {e}")
+            return {}
+
+    def _save_cache(self, cache):
+        if not self.cache_path:
+            return
+        temp_path = f'{self.cache_path}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш типов дисков: {e}")
+
+    def cached(self, key):
+        entry = self._load_cache().get(key)
+        if entry and time.time() - entry.get('time', 0) < self.ttl:
+            return entry['type']
+        return None
+
+    def remember(self, key, disk_type, source):
+        with self._lock:
+            cache = self._load_cache()
+            now = time.time()
+            cache = {k: v for k, v in cache.items() if now - v.get('time', 0) < self.ttl}
+            cache[key] = {'type': disk_type, 'source': source, 'time': now}
+            self._save_cache(cache)
+
+    # --- Пробы ---
+
+    def run_strategies(self, drive):
+        """Запускает все стратегии одновременно и возвращает (тип, имя стратегии).
+
+        Первый ответ точной стратегии возвращается сразу, остальные пробы
+        отменяются, а их ещё работающие процессы завершаются. Эвристические
+        ответы используются в порядке приоритета, только когда точных
+        ответов нет.
+        """
+        if not self.strategies:
+            return UNKNOWN, None
+        heuristic = {}
+        runner = self.runner or CommandRunner()
+        executor = ThreadPoolExecutor(max_workers=len(self.strategies))
+        # Заполняется по одной пробе, чтобы при ошибке запуска отменить уже запущенные
+        futures = {}
+        try:
+            for index, (name, func, definitive) in enumerate(self.strategies):
+                futures[executor.submit(func, drive, runner)] = (index, name, definitive)
+            for future in as_completed(futures):
+                index, name, definitive = futures[future]
+                try:
+                    verdict = future.result()
+                except Exception as e:
+                    logger.warning(f"Ошибка пробы {name} для диска {drive}: {e}")
+                    continue
+                if verdict not in (SSD, HDD):
+                    continue
+                if definitive:
+                    return verdict, name
+                heuristic[index] = (verdict, name)
+        finally:
+            for future in futures:
+                future.cancel()
+            if hasattr(runner, 'kill_all'):
+                killed = runner.kill_all()
+                if killed:
+                    logger.info(f"Завершено проб диска {drive}, ответ которых не понадобился: {killed}")
+            executor.shutdown(wait=False)
+        if heuristic:
+            return heuristic[min(heuristic)]
+        return UNKNOWN, None
+
+    def disk_type(self, drive):
+        key = self.identity(drive) if self.identity else None
+        if key:
+            disk_type = self.cached(key)
+            if disk_type:
+                logger.info(f"Тип диска {drive} взят из кэша: {disk_type}")
+                return disk_type
+        disk_type, source = None, None
+        if self.native:
+            disk_type = native_disk_type(drive)
+            source = 'native'
+        if disk_type is None:
+            disk_type, source = self.run_strategies(drive)
+        logger.info(f"Тип диска {drive}: {disk_type} (источник: {source})")
+        if key and disk_type != UNKNOWN:
+            self.remember(key, disk_type, source)
+        return disk_type
+
+    def disk_types(self, drives):
+        """Определяет типы нескольких дисков параллельно"""
+        if not drives:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(drives)) as executor:
+            return dict(zip(drives, executor.map(self.disk_type, drives)))
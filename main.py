@@ -1,21 +1,39 @@
+from startup_profile import profiler, lazy_import, DEFAULT_BUDGET_MS
 import time
 import sys
 import os
-import shutil
-from tqdm import tqdm
-from rich.console import Console
-from rich.progress import Progress, SpinnerColumn, TextColumn
-from rich.table import Table
-from rich.prompt import Prompt, Confirm
 import platform
-import psutil
 import argparse
 from datetime import datetime
 import random
-import glob
 import subprocess
+import multiprocessing
 import logging
 import configparser
+from contextlib import ExitStack
+from disk_probe import DiskProbe
+from backup_store import BackupStore
+from reg_parser import open_text
+from prompt_builder import build_examples, DEFAULT_MAX_TOKENS
+from tweak_catalog import TweakCatalog
+from tweak_bundle import BUNDLE_FILE, build_bundle
+from tweak_compactor import compact_tweaks
+from model_pipeline import ModelPipeline, create_provider, DEFAULT_CONCURRENCY, DEFAULT_STUB_LATENCY, DEFAULT_CACHE_KINDS
+from code_fences import BlockSpooler
+from response_extract import finish_spooled, has_tweaks
+from registry_model import derive_undo, export_scopes
+from tweak_attribution import DeltaDebugger, split_units, build_scripts, keeps_gain, DEFAULT_MAX_TRIALS
+from process_watch import ProcessWatcher, any_process, run_phases
+from disk_bench import DiskBenchmark, DEFAULT_FILE_SIZE, TEST_FILE, parse_job
+from cpu_bench import CpuBenchmark, DEFAULT_TARGET, DEFAULT_MEMORY_BYTES
+from quiet_gate import (QuietGate, parse_cores, pin_affinity, DEFAULT_CPU_PERCENT, DEFAULT_DISK_MB,
+                        DEFAULT_NEW_PROCESSES, DEFAULT_INTERVAL, DEFAULT_QUIET_SAMPLES, DEFAULT_TIMEOUT)
+from bench_stats import BenchmarkHarness, DEFAULT_WARMUP, DEFAULT_REPETITIONS, DEFAULT_MAX_REPETITIONS, DEFAULT_ALPHA, holm
+from response_cache import ResponseCache, RESPONSE_CACHE_DB, CACHE_MODES, DEFAULT_MAX_BYTES, DEFAULT_TTL
+from bench_history import BenchmarkHistory, HISTORY_DB, DEFAULT_WINDOW, DEFAULT_REGRESSION, tweak_hash, system_fingerprint
+from tweak_bandit import TweakBandit, BANDIT_DB, iteration_gain
+from batch_shell import (PersistentShell, BatchCommand, DIALECTS, summarize, DEFAULT_START_TIMEOUT,
+                         DEFAULT_TIMEOUT as DEFAULT_COMMAND_TIMEOUT)
 
 logging.basicConfig(
     filename='optimizer.log',
@@ -25,113 +43,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-console = Console()
+# Консоль rich создаётся при первом выводе, чтобы не импортировать rich
+# при запуске с --help и в режимах, где вывод не нужен
+class LazyConsole:
+    def __init__(self):
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            self._console = lazy_import('rich.console').Console()
+        return getattr(self._console, name)
+
+console = LazyConsole()
+
+# Определение типа диска (SSD/HDD): кэш, нативный запрос и параллельные пробы
+disk_probe = DiskProbe()
 
-# Улучшенная функция для определения типа диска (SSD/HDD)
 def get_disk_type(drive_letter):
     try:
-        # Метод 1: PowerShell Get-PhysicalDisk (самый точный)
-        import subprocess
-        try:
-            cmd = f'powershell "Get-WmiObject -Class Win32_LogicalDisk | Where-Object {{$_.DeviceID -eq \'{drive_letter}:\'}} | ForEach-Object {{ Get-WmiObject -Class Win32_DiskPartition | Where-Object {{$_.DriveLetter -eq \'{drive_letter}\'}} | ForEach-Object {{ Get-WmiObject -Class Win32_DiskDrive | Where-Object {{$_.Index -eq $_.Index}} | Select-Object MediaType,Model }}}}"'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            logger.info(f"PowerShell результат для диска {drive_letter}: {result.stdout}")
-            if 'SSD' in result.stdout.upper() or 'SOLID' in result.stdout.upper():
-                return 'SSD'
-            elif 'HDD' in result.stdout.upper():
-                return 'HDD'
-        except Exception as e:
-            logger.warning(f"Ошибка PowerShell для диска {drive_letter}: {e}")
-            pass
-        
-        # Метод 2: Альтернативная PowerShell команда
-        try:
-            cmd = f'powershell "Get-PhysicalDisk | Get-Disk | Get-Partition | Where-Object {{$_.DriveLetter -eq \'{drive_letter}\'}} | Get-Disk | Get-PhysicalDisk | Select-Object MediaType"'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            logger.info(f"PowerShell альтернативный результат для диска {drive_letter}: {result.stdout}")
-            if 'SSD' in result.stdout.upper():
-                return 'SSD'
-            elif 'HDD' in result.stdout.upper():
-                return 'HDD'
-        except Exception as e:
-            logger.warning(f"Ошибка PowerShell альтернативный для диска {drive_letter}: {e}")
-            pass
-        
-        # Метод 3: WMI (если доступен)
-        try:
-            import wmi
-            c = wmi.WMI()
-            for disk in c.Win32_LogicalDisk():
-                if disk.DeviceID.startswith(drive_letter.upper()):
-                    for partition in c.Win32_DiskPartition():
-                        if partition.DriveLetter == drive_letter.upper():
-                            for physical_disk in c.Win32_DiskDrive():
-                                if physical_disk.Index == partition.DiskIndex:
-                                    logger.info(f"WMI данные для диска {drive_letter}: Model={getattr(physical_disk, 'Model', 'N/A')}, MediaType={getattr(physical_disk, 'MediaType', 'N/A')}, InterfaceType={getattr(physical_disk, 'InterfaceType', 'N/A')}")
-                                    # Проверяем MediaType
-                                    if hasattr(physical_disk, 'MediaType') and physical_disk.MediaType:
-                                        media_type = physical_disk.MediaType.lower()
-                                        if 'ssd' in media_type or 'solid' in media_type:
-                                            return 'SSD'
-                                    # Проверяем модель
-                                    if hasattr(physical_disk, 'Model') and physical_disk.Model:
-                                        model = physical_disk.Model.lower()
-                                        if 'ssd' in model or 'solid' in model or 'nvme' in model:
-                                            return 'SSD'
-                                    # Проверяем интерфейс
-                                    if hasattr(physical_disk, 'InterfaceType') and physical_disk.InterfaceType:
-                                        interface = physical_disk.InterfaceType.lower()
-                                        if 'nvme' in interface or 'ssd' in interface:
-                                            return 'SSD'
-                                    return 'HDD'
-        except ImportError:
-            logger.warning(f"WMI не установлен для диска {drive_letter}")
-            pass
-        except Exception as e:
-            logger.warning(f"Ошибка WMI при определении типа диска {drive_letter}: {e}")
-        
-        # Метод 4: WMIC (fallback)
-        try:
-            cmd = f'wmic diskdrive get model,mediatype,interfacetype /format:csv'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            logger.info(f"WMIC результат для диска {drive_letter}: {result.stdout}")
-            if 'ssd' in result.stdout.lower() or 'nvme' in result.stdout.lower():
-                return 'SSD'
-            elif 'hdd' in result.stdout.lower() or 'ata' in result.stdout.lower():
-                return 'HDD'
-        except Exception as e:
-            logger.warning(f"Ошибка WMIC для диска {drive_letter}: {e}")
-            pass
-        
-        # Метод 5: Проверка по имени модели (последний fallback)
-        try:
-            cmd = f'wmic diskdrive get model /format:csv'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            logger.info(f"WMIC модель для диска {drive_letter}: {result.stdout}")
-            model_output = result.stdout.lower()
-            if any(keyword in model_output for keyword in ['ssd', 'nvme', 'solid', 'samsung', 'crucial', 'kingston']):
-                return 'SSD'
-        except Exception as e:
-            logger.warning(f"Ошибка WMIC модель для диска {drive_letter}: {e}")
-            pass
-        
-        logger.warning(f"Не удалось определить тип диска {drive_letter}, возвращаю UNKNOWN")
-        return 'UNKNOWN'
+        return disk_probe.disk_type(drive_letter)
     except Exception as e:
         logger.warning(f"Ошибка при определении типа диска {drive_letter}: {e}")
         return 'UNKNOWN'
 
 # Функция для выбора оптимального диска для операций
 def get_optimal_drive():
-    c_type = get_disk_type('C')
     # Проверяем, существует ли диск D
     d_exists = os.path.exists('D:\\')
     logger.info(f"Диск D существует: {d_exists}")
     
     if d_exists:
-        d_type = get_disk_type('D')
+        # Оба диска опрашиваются одновременно
+        try:
+            disk_types = disk_probe.disk_types(['C', 'D'])
+        except Exception as e:
+            logger.warning(f"Ошибка при определении типов дисков: {e}")
+            disk_types = {}
+        c_type = disk_types.get('C', 'UNKNOWN')
+        d_type = disk_types.get('D', 'UNKNOWN')
         logger.info(f"Тип диска D: {d_type}")
     else:
+        c_type = get_disk_type('C')
         d_type = 'UNKNOWN'
         logger.info("Диск D не существует")
     
@@ -150,65 +102,100 @@ def get_optimal_drive():
         logger.info("Выбран диск C (HDD) для операций")
         return 'C'
 
-# Функция для создания полного бэкапа реестра
+# Функция для создания полного бэкапа реестра.
+# Экспорт regedit сохраняется в хранилище с дедупликацией, поэтому на диск
+# записываются только изменившиеся с прошлого бэкапа чанки.
 def backup_registry(backup_path=None):
-    backup_dir = f'{optimal_drive}:\\Backup'
-    os.makedirs(backup_dir, exist_ok=True)
+    runtime = get_runtime()
+    dt = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    snapshot_id = f'registry_backup_{dt}'
     if backup_path is None:
-        dt = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        backup_path = os.path.join(backup_dir, f'registry_backup_{dt}.reg')
+        os.makedirs(runtime.temp_dir, exist_ok=True)
+        backup_path = os.path.join(runtime.temp_dir, f'{snapshot_id}.reg')
     console.print(f"[yellow]Создаю полный бэкап реестра...[/yellow]")
     logger.info(f"Создаю полный бэкап реестра: {backup_path}")
     result = os.system(f'launcher.exe regedit /e "{backup_path}"')
-    if result == 0:
-        console.print(f"[green]Бэкап реестра успешно сохранён: {backup_path}[/green]")
-        logger.info(f"Бэкап реестра успешно сохранён: {backup_path}")
-    else:
+    if result != 0 or not os.path.exists(backup_path):
         console.print(f"[red]Ошибка при создании бэкапа реестра![/red]")
         logger.error(f"Ошибка при создании бэкапа реестра: {backup_path}")
         sys.exit(1)
+    manifest = runtime.backup_store.add(backup_path, snapshot_id)
+    os.remove(backup_path)
+    console.print(f"[green]Бэкап реестра успешно сохранён: {snapshot_id} "
+                  f"(новых данных {manifest['stored_bytes'] // 1024} КБ из {manifest['size'] // 1024} КБ)[/green]")
+    logger.info(f"Бэкап реестра успешно сохранён: {snapshot_id}")
+    return snapshot_id
 
-# Копируем случайный бэкап реестра в C:\temp\backup_0
-# Определяем оптимальный диск для операций
-optimal_drive = get_optimal_drive()
-backup_files = glob.glob(f'{optimal_drive}:\\Backup\\*.reg')
-if backup_files:
-    random_backup = random.choice(backup_files)
-    temp_dir = f'{optimal_drive}:\\temp'
-    os.makedirs(temp_dir, exist_ok=True)
-    shutil.copy2(random_backup, f'{temp_dir}\\backup_0.reg')
-    logger.info(f"Скопирован случайный бэкап реестра: {random_backup} -> {temp_dir}\\backup_0.reg")
-else:
-    logger.warning("Не найдено бэкапов реестра для копирования. Создаю новый бэкап...")
-    console.print("[yellow]Бэкапы реестра не найдены. Создаю новый бэкап...[/yellow]")
-    # Создаём новый бэкап
-    backup_registry()
-    # Проверяем, создался ли бэкап
-    backup_files = glob.glob(f'{optimal_drive}:\\Backup\\*.reg')
-    if backup_files:
-        random_backup = random.choice(backup_files)
-        temp_dir = f'{optimal_drive}:\\temp'
-        os.makedirs(temp_dir, exist_ok=True)
-        shutil.copy2(random_backup, f'{temp_dir}\\backup_0.reg')
-        logger.info(f"Скопирован новый бэкап реестра: {random_backup} -> {temp_dir}\\backup_0.reg")
-        console.print(f"[green]Новый бэкап создан и скопирован: {random_backup}[/green]")
-    else:
-        logger.error("Не удалось создать бэкап реестра!")
-        console.print("[red]Ошибка: не удалось создать бэкап реестра![/red]")
-        sys.exit(1)
+# Окружение программы: диск для операций и рабочая копия бэкапа реестра.
+# Всё определяется лениво при первом обращении, а не при импорте модуля.
+class RuntimeContext:
+    def __init__(self):
+        self._optimal_drive = None
+        self._backup_store = None
+        self._backup_prepared = False
+
+    @property
+    def optimal_drive(self):
+        if self._optimal_drive is None:
+            with profiler.step("Определение оптимального диска"):
+                self._optimal_drive = get_optimal_drive()
+        return self._optimal_drive
+
+    @property
+    def backup_dir(self):
+        return f'{self.optimal_drive}:\\Backup'
+
+    @property
+    def temp_dir(self):
+        return f'{self.optimal_drive}:\\temp'
+
+    @property
+    def backup_copy(self):
+        return f'{self.temp_dir}\\backup_0.reg'
+
+    # Хранилище бэкапов; старые полные .reg из папки Backup копируются в него.
+    # Сами файлы не удаляются: это делает только --backup-migrate с подтверждением
+    @property
+    def backup_store(self):
+        if self._backup_store is None:
+            self._backup_store = BackupStore(f'{self.backup_dir}\\store')
+            if os.path.isdir(self.backup_dir):
+                with profiler.step("Копирование старых бэкапов в хранилище"):
+                    self._backup_store.import_legacy(self.backup_dir)
+        return self._backup_store
+
+    # Восстанавливаем случайный бэкап реестра в <диск>:\temp\backup_0.reg
+    def prepare_backup_copy(self):
+        if self._backup_prepared:
+            return
+        with profiler.step("Подготовка рабочей копии бэкапа"):
+            snapshot = self.backup_store.random_snapshot()
+            if snapshot:
+                self.backup_store.restore(snapshot['id'], self.backup_copy)
+                logger.info(f"Восстановлен случайный бэкап реестра: {snapshot['id']} -> {self.backup_copy}")
+            else:
+                logger.warning("Не найдено бэкапов реестра для копирования. Создаю новый бэкап...")
+                console.print("[yellow]Бэкапы реестра не найдены. Создаю новый бэкап...[/yellow]")
+                # Создаём новый бэкап
+                snapshot_id = backup_registry()
+                self.backup_store.restore(snapshot_id, self.backup_copy)
+                logger.info(f"Восстановлен новый бэкап реестра: {snapshot_id} -> {self.backup_copy}")
+                console.print(f"[green]Новый бэкап создан и скопирован: {snapshot_id}[/green]")
+        self._backup_prepared = True
+
+_runtime = None
+
+def get_runtime():
+    global _runtime
+    if _runtime is None:
+        _runtime = RuntimeContext()
+    return _runtime
 
 # Безопасное чтение строк файла с определением кодировки
+# (кодировка определяется один раз по BOM и первым байтам)
 def safe_readlines(path):
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return f.readlines()
-    except UnicodeDecodeError:
-        try:
-            with open(path, 'r', encoding='utf-16') as f:
-                return f.readlines()
-        except UnicodeDecodeError:
-            with open(path, 'r', encoding='cp1251') as f:
-                return f.readlines()
+    with open_text(path) as f:
+        return f.readlines()
 
 # Функция для отображения прогресс-бара rich
 class RichProgressBar:
@@ -217,6 +204,8 @@ class RichProgressBar:
         self.running = True
 
     def start(self):
+        rich_progress = lazy_import('rich.progress')
+        Progress, SpinnerColumn, TextColumn = rich_progress.Progress, rich_progress.SpinnerColumn, rich_progress.TextColumn
         with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), transient=True) as progress:
             task = progress.add_task(self.message, start=False)
             while self.running:
@@ -226,122 +215,379 @@ class RichProgressBar:
     def stop(self):
         self.running = False
 
-# Получить список .reg-файлов с кратким описанием
-def get_tweak_files_with_descriptions(folder):
-    files = [f for f in os.listdir(folder) if f.lower().endswith(('.reg', '.bat', '.cmd'))]
-    result = []
-    for fname in files:
-        path = os.path.join(folder, fname)
-        desc = fname
-        try:
-            # Для .reg используем safe_readlines, для .bat/.cmd — utf-8 или cp1251
-            if fname.lower().endswith('.reg'):
-                lines = safe_readlines(path)
-            else:
-                try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                except UnicodeDecodeError:
-                    with open(path, 'r', encoding='cp1251') as f:
-                        lines = f.readlines()
-            for line in lines[:10]:
-                if line.strip().startswith((';', '::', 'REM')) and len(line.strip()) > 1:
-                    desc = line.strip().lstrip(';:/').replace('REM', '').strip()
-                    break
-        except Exception:
-            pass
-        result.append({'name': fname, 'path': path, 'desc': desc})
-    return result
-
-# Объединить выбранные .reg-файлы
-def merge_tweak_files(files):
-    merged = ''
-    for f in files:
-        if f['name'].lower().endswith('.reg'):
-            lines = safe_readlines(f['path'])
-            if lines and lines[0].strip().startswith('Windows Registry Editor'):
-                lines = lines[1:]
-            merged += f'\n; --- {f["name"]} ---\n'
-            merged += ''.join(lines)
-        else:
-            try:
-                with open(f['path'], 'r', encoding='utf-8') as inp:
-                    lines = inp.readlines()
-            except UnicodeDecodeError:
-                with open(f['path'], 'r', encoding='cp1251') as inp:
-                    lines = inp.readlines()
-            merged += f'\n:: --- {f["name"]} ---\n'
-            merged += ''.join(lines)
-    return merged
+# Где искать твики: распакованная папка Brian или индексированный архив
+# tweaks.bundle, который читается напрямую без распаковки. Если нет ни
+# того, ни другого, архив один раз создаётся из tweaks.7z.
+TWEAKS_FOLDER = 'Brian'
+TWEAKS_ARCHIVE = 'tweaks.7z'
+
+def get_tweaks_location():
+    if os.path.isdir(TWEAKS_FOLDER):
+        return TWEAKS_FOLDER
+    if not os.path.exists(BUNDLE_FILE) and os.path.exists(TWEAKS_ARCHIVE):
+        console.print(f"[yellow]Создаю архив твиков {BUNDLE_FILE} из {TWEAKS_ARCHIVE}...[/yellow]")
+        with profiler.step(f"Конвертация {TWEAKS_ARCHIVE} -> {BUNDLE_FILE}"):
+            build_bundle(TWEAKS_ARCHIVE, BUNDLE_FILE)
+    return BUNDLE_FILE
+
+# Получить список .reg-файлов с кратким описанием.
+# Описания берутся из постоянного индекса: файлы перечитываются, только
+# если изменились, а список для каждой итерации отдаётся из памяти.
+_catalogs = {}
+
+def get_tweak_catalog(location):
+    if location not in _catalogs:
+        with profiler.step(f"Индекс твиков {location}"):
+            _catalogs[location] = TweakCatalog(location)
+    return _catalogs[location]
+
+def get_tweak_files_with_descriptions(location):
+    return get_tweak_catalog(location).entries()
+
+# Объединить выбранные файлы в примеры для промпта с учётом бюджета.
+# Если передан каталог, файлы читаются через него (в том числе из архива).
+def merge_tweak_files(files, catalog=None, max_tokens=DEFAULT_MAX_TOKENS, max_bytes=0):
+    open_file = catalog.open if catalog else None
+    text, report = build_examples(files, open_file, max_tokens, max_bytes)
+    console.print(f"[cyan]Примеры твиков: оставлено {report['kept']} из {report['units']} "
+                  f"(дубликатов {report['duplicates']}, конфликтов {report['conflicts']}, "
+                  f"не вошло в бюджет {report['dropped']}), ~{report['tokens']} токенов[/cyan]")
+    return text
+
+# --- Промпты для модели ---
+def build_select_prompt(tweak_files, ranked=False):
+    file_list_str = '\n'.join([f"{f['name']}: {f['desc']}" for f in tweak_files])
+    order = ("Файлы перечислены от тех, что чаще давали ускорение на этой системе, к остальным, отдавай предпочтение первым. "
+             if ranked else "")
+    return (
+        "Дельай очень быстро!!! Вот список .reg, .bat и .cmd файлов с описаниями. Выбери только те, которые лучше всего подходят для полной и агрессивной оптимизации Windows 11 (максимальная производительность, отключение всей телеметрии, удаление UWP-приложений, отключение всех служб, антивируса, firewall, обновлений, оптимизация nvidia, directx, windows 11 и т.д.). "
+        + order +
+        "Ответь только списком имён файлов, по одному на строку, без лишнего текста.\n\n" + file_list_str
+    )
+
+def build_generation_prompt(examples):
+    return (
+        "Дельай очень быстро!!! Делай очень много твиков, чтобы Windows 11 был максимально оптимизирован. Вот примеры твиков для Windows 11 (.reg, .bat, .cmd), используй их как основу, а также придумай свои твики. Не в коем случае не пиши команду pause. "
+        "Сгенерируй .reg файл и .bat/.cmd скрипт для максимально агрессивной оптимизации Windows 11. "
+        "ОБЯЗАТЕЛЬНО: отключи всю телеметрию, удали все UWP-приложения, отключи все возможные службы, антивирус, firewall, обновления, оптимизируй nvidia, directx, windows 11 и т.д. "
+        "Внеси в реестр целую кучу глобальных твиков. .bat файл должен получиться очень огромным. "
+        "Добавь комментарии к каждому твик-ключу и каждой команде.\n\n"
+        f"Примеры твиков, дрбавь их в свои твики:\n{examples}"
+    )
+
+def plan_iteration(pipeline, iteration, tweaks_location, prompt_max_tokens, prompt_max_bytes, bandit=None,
+                   candidates=0):
+    """Ставит в очередь конвейера все запросы к модели для одной итерации.
+
+    Блоки reg и bat/cmd из ответа пишутся во временные файлы прямо во время
+    генерации и становятся win11_optimized_N.* только после проверки
+    (finish_spooled). Откат модель не пишет: его строит write_undo.
+    Если передан бандит, список файлов для выбора ранжируется по их прошлой
+    пользе и, при candidates > 0, сокращается до первых candidates.
+    """
+    # Каталог читается здесь, в основном потоке: SQLite привязан к потоку
+    tweak_files = get_tweak_files_with_descriptions(tweaks_location)
+    catalog = get_tweak_catalog(tweaks_location)
+    files_by_name = {f['name']: f for f in tweak_files}
+    if bandit is not None:
+        ranked = bandit.rank(list(files_by_name))
+        tweak_files = [files_by_name[name] for name in ranked[:candidates or None]]
+
+    def choose(response):
+        # Порядок выбора модели сохраняется: он определяет приоритет примеров
+        selected_names = [line.strip() for line in response.splitlines() if line.strip() in files_by_name]
+        return [files_by_name[name] for name in dict.fromkeys(selected_names)]
+
+    def build_prompt(selected_files):
+        return build_generation_prompt(merge_tweak_files(selected_files, catalog, prompt_max_tokens, prompt_max_bytes))
+
+    generation_sink = BlockSpooler({'reg': f"win11_optimized_{iteration}.reg", 'bat': f"win11_optimized_{iteration}.bat"})
+    return pipeline.submit(pipeline.plan_iteration(build_select_prompt(tweak_files, bandit is not None), choose, build_prompt,
+                                                   generation_sink=generation_sink, validate_generation=has_tweaks))
+
+def wait_for_plan(future, message):
+    """Ждёт ответов модели для итерации, показывая спиннер, если они ещё не готовы"""
+    if future.done():
+        return future.result()
+    import threading
+    progress = RichProgressBar(message)
+    thread = threading.Thread(target=progress.start)
+    thread.start()
+    try:
+        return future.result()
+    finally:
+        progress.stop()
+        thread.join()
 
 # --- Бенчмарк функции ---
-def copy_benchmark(src, dst):
-    logger.info(f"Бенчмарк: копирование {src} -> {dst}")
-    start = time.perf_counter()
-    if os.path.exists(dst):
-        os.remove(dst)
-    shutil.copy2(src, dst)
-    end = time.perf_counter()
-    logger.info(f"Время копирования {src} -> {dst}: {end - start:.2f} сек")
-    return end - start
+BENCHMARK_URLS = [
+    "https://shre.su/WXFN",
+    "https://shre.su/CFST",
+    "https://shre.su/4A56",
+    "https://shre.su/CL39",
+    "https://shre.su/3SIN",
+    "https://shre.su/UEO7",
+    "https://shre.su/HHN2",
+    "https://shre.su/WX89",
+    "https://shre.su/WX89",
+    "https://shre.su/0KO3",
+    "https://shre.su/L7VO",
+    "https://shre.su/NSBL",
+    "https://shre.su/UU41",
+    "https://shre.su/H9FB",
+    "https://shre.su/4ON2",
+    "https://shre.su/KC77",
+    "https://shre.su/84W8",
+    "https://shre.su/DHBU",
+    "https://shre.su/JXFN",
+    "https://shre.su/WH7K",
+    "https://shre.su/2JXF",
+    "https://shre.su/SRCL",
+    "https://shre.su/MICD",
+    "https://shre.su/VH89"
+]
+
+BENCHMARK_LABELS = {
+    'disk': 'Время дискового бенчмарка',
+    'browser': 'Время открытия браузера',
+    'notepad': 'Время открытия бэкапа реестра в notepad',
+    'cpu': 'Время целочисленного и плавающего ядер CPU',
+    'memory': 'Время теста полосы и задержки памяти',
+    'cpu_parallel': 'Время ядра CPU на всех процессах',
+}
+# Заголовки и цвет столбцов метрики в итоговой таблице
+BENCHMARK_COLUMNS = {
+    'disk': ('Диск', 'magenta'),
+    'browser': ('Браузер', 'green'),
+    'notepad': ('Отк. notepad', 'blue'),
+    'cpu': ('CPU', 'red'),
+    'memory': ('Память', 'red'),
+    'cpu_parallel': ('CPU все ядра', 'red'),
+}
+VERDICT_LABELS = {'better': 'быстрее', 'worse': 'медленнее', 'same': 'без значимой разницы'}
+
+def create_benchmark_harness(settings):
+    return BenchmarkHarness(
+        settings.getint('Benchmark', 'warmup', fallback=DEFAULT_WARMUP),
+        settings.getint('Benchmark', 'repetitions', fallback=DEFAULT_REPETITIONS),
+        settings.getint('Benchmark', 'max_repetitions', fallback=DEFAULT_MAX_REPETITIONS),
+        settings.getfloat('Benchmark', 'alpha', fallback=DEFAULT_ALPHA),
+    )
+
+def format_seconds(value):
+    return '—' if value is None else f"{value:.2f}"
+
+def format_delta(before, after):
+    if before is None or after is None:
+        return '—'
+    return f"{before - after:.2f}"
+
+def print_benchmark_status(name, status, suffix=''):
+    if name != 'notepad' or status is None:
+        console.print(f"[red]{BENCHMARK_LABELS[name]}{suffix}: нет успешных замеров ({status})[/red]")
+    elif status == "NO_FILES":
+        store_dir = f'{get_runtime().backup_dir}\\store'
+        console.print(f"[yellow]В хранилище бэкапов {store_dir} нет снимков реестра для notepad-бенчмарка{suffix}[/yellow]")
+        logger.warning(f"В хранилище бэкапов {store_dir} нет снимков реестра для notepad-бенчмарка{suffix}")
+    elif status == "FAILED_TO_LOAD":
+        console.print(f"[red]Ошибка: не удалось открыть или прочитать .reg файл в Notepad для бенчмарка{suffix}[/red]")
+        logger.error(f"Ошибка: не удалось открыть или прочитать .reg файл в Notepad для бенчмарка{suffix}")
+
+def print_summary(summary):
+    if summary.median is None:
+        print_benchmark_status(summary.name, summary.status)
+        return
+    console.print(f"[green]{BENCHMARK_LABELS[summary.name]}:[/green] {summary.median:.2f} сек "
+                  f"(медиана {len(summary.samples)} замеров, MAD {summary.mad:.2f}, "
+                  f"95% ДИ {summary.ci_low:.2f}–{summary.ci_high:.2f})")
+
+def print_comparison(comparison):
+    if comparison.after.median is None:
+        print_benchmark_status(comparison.name, comparison.after.status, ' после твика')
+        return
+    if comparison.p_value is None:
+        console.print(f"[green]{BENCHMARK_LABELS[comparison.name]} после твика:[/green] {comparison.after.median:.2f} сек")
+        return
+    color = {'better': 'green', 'worse': 'red', 'same': 'yellow'}[comparison.verdict]
+    console.print(f"[{color}]{BENCHMARK_LABELS[comparison.name]} после твика:[/{color}] "
+                  f"{comparison.before.median:.2f} -> {comparison.after.median:.2f} сек "
+                  f"(замеров {len(comparison.after.samples)}, p = {comparison.p_value:.3f}, "
+                  f"{VERDICT_LABELS[comparison.verdict]})")
+
+# Дисковый бенчмарк: задания чтения и записи на одном тестовом файле
+# в папке temp оптимального диска (файл переиспользуется между запусками)
+def create_disk_benchmark(settings, runtime):
+    jobs = []
+    for line in settings.get('DiskBenchmark', 'jobs', fallback='').strip().split('\n'):
+        line = line.strip()
+        if line and not line.startswith(('#', ';')):
+            try:
+                jobs.append(parse_job(line))
+            except ValueError as e:
+                logger.warning(f"Ошибка в задании дискового бенчмарка: {e}")
+    path = settings.get('DiskBenchmark', 'path', fallback='').strip() or f'{runtime.temp_dir}\\{TEST_FILE}'
+    try:
+        return DiskBenchmark(
+            path,
+            int(settings.getfloat('DiskBenchmark', 'file_size_mb', fallback=DEFAULT_FILE_SIZE / 1024 / 1024) * 1024 * 1024),
+            jobs,
+            settings.getboolean('DiskBenchmark', 'direct', fallback=True),
+            settings.get('DiskBenchmark', 'fsync', fallback='end').strip().lower(),
+        )
+    except ValueError as e:
+        logger.warning(f"Ошибка в настройках дискового бенчмарка, используются значения по умолчанию: {e}")
+        return DiskBenchmark(path)
+
+# Микробенчмарки процессора и памяти; None, если отключены в settings.ini
+def create_cpu_benchmark(settings):
+    if not settings.getboolean('CpuBenchmark', 'enabled', fallback=True):
+        return None
+    use_numpy = settings.get('CpuBenchmark', 'numpy', fallback='auto').strip().lower()
+    return CpuBenchmark(
+        settings.getint('CpuBenchmark', 'target_ms', fallback=int(DEFAULT_TARGET * 1000)) / 1000,
+        int(settings.getfloat('CpuBenchmark', 'memory_mb', fallback=DEFAULT_MEMORY_BYTES / 1024 / 1024) * 1024 * 1024),
+        settings.getint('CpuBenchmark', 'workers', fallback=0),
+        None if use_numpy == 'auto' else use_numpy in ('1', 'yes', 'true', 'on'),
+    )
+
+# Ожидание тишины в системе перед каждым замером; None, если отключено
+def create_quiet_gate(settings):
+    if not settings.getboolean('Quiet', 'enabled', fallback=True):
+        return None
+    return QuietGate(
+        settings.getfloat('Quiet', 'cpu_percent', fallback=DEFAULT_CPU_PERCENT),
+        settings.getfloat('Quiet', 'disk_mb_s', fallback=DEFAULT_DISK_MB),
+        settings.getint('Quiet', 'new_processes', fallback=DEFAULT_NEW_PROCESSES),
+        settings.getint('Quiet', 'interval_ms', fallback=int(DEFAULT_INTERVAL * 1000)) / 1000,
+        settings.getint('Quiet', 'quiet_samples', fallback=DEFAULT_QUIET_SAMPLES),
+        settings.getfloat('Quiet', 'timeout', fallback=DEFAULT_TIMEOUT),
+    )
+
+# Долгоживущая оболочка для применения твиков; None — запускать их
+# по-старому через os.system (оболочка выключена или не запустилась)
+def create_shell(settings):
+    if not settings.getboolean('Shell', 'enabled', fallback=True):
+        return None
+    dialect = settings.get('Shell', 'dialect', fallback='cmd')
+    if dialect not in DIALECTS:
+        raise ValueError(f"Неизвестная оболочка {dialect}, доступны: {', '.join(DIALECTS)}")
+    shell = PersistentShell(
+        dialect,
+        settings.get('Shell', 'command', fallback='').split() or None,
+        settings.getfloat('Shell', 'timeout', fallback=DEFAULT_COMMAND_TIMEOUT),
+        settings.getfloat('Shell', 'start_timeout', fallback=DEFAULT_START_TIMEOUT),
+        settings.get('Shell', 'log', fallback='tweaker.log') or None,
+    )
+    try:
+        shell.start()
+    except (OSError, RuntimeError) as e:
+        console.print(f"[yellow]Оболочка для твиков не запустилась ({e}), .bat выполняются целиком[/yellow]")
+        logger.warning(f"Оболочка для твиков не запустилась: {e}")
+        shell.close()
+        return None
+    return shell
+
+def print_batch_results(results, title, slowest=5):
+    if not results:
+        return
+    seconds, count, failed, broken = summarize(results)
+    color = 'yellow' if failed or broken else 'cyan'
+    console.print(f"[{color}]{title}: {count} команд за {seconds:.2f} сек, с ошибкой {failed}, "
+                  f"прервано {broken}[/{color}]")
+    shown = [r for r in results if r.status != 'OK']
+    shown += [r for r in sorted(results, key=lambda r: r.seconds, reverse=True)[:slowest] if r.status == 'OK']
+    Table = lazy_import('rich.table').Table
+    table = Table(title=f"{title}: ошибки и самые долгие команды")
+    table.add_column("Строка", style="cyan", justify="right")
+    table.add_column("Команда")
+    table.add_column("Статус")
+    table.add_column("Код", justify="right")
+    table.add_column("Время (сек)", style="green", justify="right")
+    for result in shown:
+        table.add_row(str(result.line), result.text, result.status,
+                      '' if result.returncode is None else str(result.returncode), f"{result.seconds:.3f}")
+    console.print(table)
+
+def print_quiet_summary(gate, since, title):
+    if gate is None:
+        return
+    waited, count, noisy = gate.summary(since)
+    color = 'yellow' if noisy else 'cyan'
+    console.print(f"[{color}]{title}: ожидание тишины перед {count} замерами — {waited:.1f} сек, "
+                  f"не дождались: {noisy}[/{color}]")
+
+def print_scaling(points):
+    Table = lazy_import('rich.table').Table
+    table = Table(title="Масштабирование по ядрам (одинаковая задача на каждом процессе)")
+    table.add_column("Процессов", style="cyan", justify="right")
+    table.add_column("Время (сек)", justify="right")
+    table.add_column("Млн итераций/с", style="green", justify="right")
+    table.add_column("Ускорение", style="yellow", justify="right")
+    table.add_column("Эффективность", justify="right")
+    for point in points:
+        table.add_row(str(point.workers), f"{point.seconds:.3f}", f"{point.throughput / 1e6:.2f}",
+                      f"{point.speedup:.2f}", f"{point.efficiency * 100:.0f}%")
+    console.print(table)
+
+def print_disk_results(disk, title):
+    if not disk.last_results:
+        return
+    Table = lazy_import('rich.table').Table
+    table = Table(title=title)
+    table.add_column("Задание", style="cyan")
+    table.add_column("МБ/с", style="green", justify="right")
+    table.add_column("IOPS", style="green", justify="right")
+    table.add_column("Очередь", justify="right")
+    table.add_column("p50, мс", justify="right")
+    table.add_column("p95, мс", justify="right")
+    table.add_column("p99, мс", justify="right")
+    table.add_column("Прямой I/O", justify="center")
+    for r in disk.last_results:
+        table.add_row(r.name, f"{r.mb_per_s:.1f}", f"{r.iops:.0f}", str(r.queue_depth), f"{r.p50:.3f}",
+                      f"{r.p95:.3f}", f"{r.p99:.3f}", 'да' if r.direct else 'нет')
+    console.print(table)
+
+BROWSER_NAMES = ['chrome', 'firefox', 'msedge', 'opera', 'brave', 'yandex', 'browser', 'iexplore']
 
 def open_browser_benchmark(url):
     logger.info(f"Бенчмарк: открытие браузера {url}")
-    import subprocess
-    import psutil
     start = time.perf_counter()
-    # Запускаем браузер через start
-    subprocess.Popen(f'start {url}', shell=True)
-    # Ждём появления процесса браузера
-    browser_proc = None
-    browser_names = ['chrome', 'firefox', 'msedge', 'opera', 'brave', 'yandex', 'browser', 'iexplore']
-    browser_started = False
-    while not browser_started:
-        for proc in psutil.process_iter(['name', 'cmdline']):
-            if any(browser in (proc.info['name'] or '').lower() for browser in browser_names):
-                browser_proc = proc
-                browser_started = True
-                break
-        if time.perf_counter() - start > 30:
-            break
-        time.sleep(0.1)
-    end = time.perf_counter()
-    # Закрываем браузер, если удалось найти процесс
-    if browser_proc:
-        try:
-            browser_proc.terminate()
-        except Exception:
-            pass
-    logger.info(f"Время открытия браузера: {end - start:.2f} сек")
+    # Запускаем браузер через start и следим только за деревом этого процесса
+    process = subprocess.Popen(f'start {url}', shell=True)
+    watcher = ProcessWatcher(process, ready=any_process(*BROWSER_NAMES), spawn_time=start)
+    launch = watcher.wait(timeout=30)
+    if launch.ready is not None:
+        end = start + launch.ready
+    elif launch.exited is not None:
+        end = start + launch.exited
+    else:
+        end = time.perf_counter()
+    if launch.status != 'ready':
+        # Ссылка могла уйти в уже запущенный браузер: нового процесса тогда нет
+        logger.warning(f"Новый процесс браузера не найден ({launch.status}), процессы: {', '.join(launch.processes)}")
+    # Закрываем запущенный браузер
+    watcher.terminate()
+    logger.info(f"Время открытия браузера: {end - start:.2f} сек (первый дочерний процесс: "
+                f"{launch.first_child if launch.first_child is not None else '—'})")
     return end - start
 
 def open_notepad_benchmark():
-    import glob
-    import time
-    import psutil
-    backup_files = glob.glob(f'{optimal_drive}:\\Backup\\*.reg')
-    logger.info(f"Бенчмарк: открытие случайного .reg файла в notepad. Найдено файлов: {len(backup_files)}")
-    # print("[DEBUG] Найдено .reg файлов:", backup_files)
-    if not backup_files:
-        print(f"[ERROR] Не найдено ни одного .reg файла в {optimal_drive}:\\Backup\\. Проверьте путь и наличие файлов.")
-        logger.warning("Не найдено ни одного .reg файла в C:\\Backup для notepad-бенчмарка")
+    # Открываем рабочую копию случайного бэкапа, восстановленную из хранилища
+    reg_file = get_runtime().backup_copy
+    logger.info(f"Бенчмарк: открытие .reg файла в notepad: {reg_file}")
+    if not os.path.exists(reg_file):
+        print(f"[ERROR] Не найден файл {reg_file}. Проверьте наличие бэкапов реестра.")
+        logger.warning(f"Не найден файл {reg_file} для notepad-бенчмарка")
         return "NO_FILES"
-    reg_file = random.choice(backup_files)
     start = time.perf_counter()
     # Открываем notepad в обычном (видимом) режиме
     p = subprocess.Popen(["notepad.exe", reg_file])
-    # Ждём появления процесса и окна
-    notepad_proc = None
+    # Ждём появления процесса notepad в дереве запущенного процесса
+    watcher = ProcessWatcher(p, ready=any_process('notepad'), spawn_time=start)
+    launch = watcher.wait(timeout=5)
+    logger.info(f"Notepad: процесс готов через {launch.ready if launch.ready is not None else '—'} сек ({launch.status})")
     window_loaded = False
     hwnd = None
-    for _ in range(100):
-        for proc in psutil.process_iter(['name', 'cmdline']):
-            if proc.info['name'] and 'notepad' in proc.info['name'].lower():
-                notepad_proc = proc
-                break
-        if notepad_proc:
-            break
-        time.sleep(0.05)
     # Ждём появления окна и загрузки текста
     try:
         try:
@@ -372,11 +618,7 @@ def open_notepad_benchmark():
         window_loaded = True
     end = time.perf_counter()
     # Закрываем notepad
-    if notepad_proc:
-        try:
-            notepad_proc.terminate()
-        except Exception:
-            pass
+    watcher.terminate()
     if window_loaded:
         logger.info(f"Время открытия и загрузки .reg файла в notepad: {end - start:.2f} сек ({reg_file})")
     else:
@@ -387,14 +629,95 @@ def open_notepad_benchmark():
         print("[ERROR] Окно Notepad не загрузилось или не удалось прочитать текст из файла.")
         return "FAILED_TO_LOAD"
 
-def apply_tweaks(reg_path, bat_path):
+# Откат твика строится по модели реестра, а не запрашивается у модели:
+# затронутые твиком поддеревья экспортируются до применения, твик
+# применяется к их копии в памяти, и win11_undo_N.reg — точная разница
+# состояний. Команды .bat, кроме reg add/delete и sc config start=,
+# через реестр не откатываются и только выводятся предупреждением.
+def write_undo(iteration, reg_code, bat_code):
+    runtime = get_runtime()
+    directory = os.path.join(runtime.temp_dir, 'undo_export')
+    plan = derive_undo(reg_code, bat_code, lambda scopes: export_scopes(scopes, directory))
+    for command in plan.skipped:
+        console.print(f"[yellow]Не откатывается автоматически: {command}[/yellow]")
+        logger.warning(f"Итерация {iteration}: команда не откатывается автоматически: {command}")
+    if not plan.text:
+        logger.info(f"Итерация {iteration}: твик не меняет реестр, откат не нужен")
+        return None
+    path = f"win11_undo_{iteration}.reg"
+    # UTF-16 с BOM, как экспорт regedit: в восстановленных строках бывает не ASCII
+    with open(path, 'w', encoding='utf-16', newline='') as f:
+        f.write(plan.text)
+    logger.info(f"Откат итерации {iteration}: {path}, изменений реестра {len(plan.changes)}")
+    return path
+
+# Атрибуция выигрыша по единицам твика (--attribute): каждое проверяемое
+# подмножество записывается в win11_attr_N.*, применяется, сравнивается с
+# эталоном и откатывается по модели реестра. Сравнения пишутся в историю
+# под хэшем подмножества, поэтому видны и в --history-effects.
+def attribute_tweak(iteration, reg_code, bat_code, full, baseline, benchmarks, harness, shell, history, run_id,
+                    max_trials):
+    units = split_units(reg_code, bat_code)
+    console.print(f"[cyan]Атрибуция итерации {iteration}: {len(units)} единиц, не больше {max_trials} замеров[/cyan]")
+
+    def evaluate(subset):
+        reg, bat = build_scripts(subset)
+        paths = {}
+        for kind, text in (('reg', reg), ('bat', bat)):
+            if text:
+                paths[kind] = f"win11_attr_{iteration}.{kind}"
+                with open(paths[kind], 'w', encoding='utf-8', newline='') as f:
+                    f.write(text)
+        undo = write_undo(f"attr_{iteration}", reg, bat)
+        apply_tweaks(paths.get('reg'), paths.get('bat'), shell)
+        try:
+            comparisons = holm({name: harness.compare(baseline[name], func) for name, func in benchmarks.items()},
+                               harness.alpha)
+        finally:
+            apply_tweaks(undo, None, shell)
+        accepted = keeps_gain(comparisons)
+        tweak = tweak_hash(reg, bat)
+        for comparison in comparisons.values():
+            history.record_comparison(run_id, iteration, comparison, tweak, accepted)
+        return comparisons
+
+    return DeltaDebugger(units, evaluate, max_trials=max_trials, full=full).run()
+
+def print_attribution(attribution, iteration, total):
+    Table = lazy_import('rich.table').Table
+    table = Table(title=f"Итерация {iteration}: выигрыш дают {len(attribution.minimal)} из {total} единиц "
+                        f"(замеров {attribution.trials}, из кэша {attribution.cached})")
+    table.add_column("Единица", style="cyan")
+    names = list(attribution.effects[0].deltas) if attribution.effects else []
+    for name in names:
+        table.add_column(f"{BENCHMARK_LABELS.get(name, name)}: вклад, сек", justify="right")
+    for effect in attribution.effects:
+        table.add_row(effect.unit.label, *('—' if effect.deltas[name] is None else f"{effect.deltas[name]:+.3f}"
+                                           for name in names))
+    console.print(table)
+    if not attribution.complete:
+        console.print("[yellow]Поиск остановлен по пределу замеров: набор может быть не минимальным[/yellow]")
+
+def apply_tweaks(reg_path, bat_path, shell=None):
     logger.info(f"Применение твиков: {reg_path}, {bat_path}")
-    # Импортируем .reg
-    os.system(f'launcher.exe regedit /s "{reg_path}" >> tweaker.log')
+    if shell is not None:
+        # Команды .bat идут по одной в общей оболочке: время и код каждой видны в логе
+        results = []
+        if reg_path:
+            results += shell.run_commands([BatchCommand(0, f'launcher.exe regedit /s "{reg_path}"')])
+        if bat_path:
+            results += shell.run_file(bat_path)
+        print_batch_results(results, f"Применение {bat_path or reg_path}")
+        return
+    # Импортируем .reg (None — годного .reg нет)
+    if reg_path:
+        os.system(f'launcher.exe regedit /s "{reg_path}" >> tweaker.log')
     # Запускаем .bat/.cmd
-    os.system(f'launcher.exe cmd /c "{bat_path}" >> tweaker.log')
+    if bat_path:
+        os.system(f'launcher.exe cmd /c "{bat_path}" >> tweaker.log')
 
 def get_system_info():
+    psutil = lazy_import('psutil')
     info = {
         'OS': platform.platform(),
         'CPU': platform.processor(),
@@ -425,66 +748,56 @@ def load_settings():
     return config
 
 # Функция для выполнения бенчмарка программы
-def program_benchmark(program_name, program_path, args=""):
+def program_benchmark(program_name, program_path, args="", timeout=10):
     logger.info(f"Бенчмарк программы: {program_name} ({program_path})")
-    start = time.perf_counter()
     try:
-        if args:
-            process = subprocess.Popen([program_path] + args.split(), 
-                                     stdout=subprocess.DEVNULL, 
-                                     stderr=subprocess.DEVNULL)
-        else:
-            process = subprocess.Popen([program_path], 
-                                     stdout=subprocess.DEVNULL, 
-                                     stderr=subprocess.DEVNULL)
-        
-        # Ждём появления процесса
-        for _ in range(50):  # 5 секунд максимум
-            for proc in psutil.process_iter(['name']):
-                if proc.info['name'] and program_name.lower() in proc.info['name'].lower():
-                    process.terminate()
-                    end = time.perf_counter()
-                    logger.info(f"Время запуска программы {program_name}: {end - start:.2f} сек")
-                    return end - start
-            time.sleep(0.1)
-        
-        process.terminate()
-        end = time.perf_counter()
-        logger.info(f"Время запуска программы {program_name}: {end - start:.2f} сек")
-        return end - start
+        # Программа считается запущенной, когда в дереве процесса появился процесс с её именем
+        phases = run_phases([program_path] + args.split(), timeout=timeout, ready=any_process(program_name))
     except Exception as e:
         logger.error(f"Ошибка при запуске программы {program_name}: {e}")
         return None
+    log_phases(f"Запуск программы {program_name}", phases)
+    return phases
 
 # Функция для выполнения бенчмарка команды
-def command_benchmark(command_name, command, args=""):
+def command_benchmark(command_name, command, args="", timeout=5):
     logger.info(f"Бенчмарк команды: {command_name} ({command})")
-    start = time.perf_counter()
     try:
-        if args:
-            result = subprocess.run([command] + args.split(), 
-                                  shell=True, 
-                                  capture_output=True, 
-                                  timeout=10)
-        else:
-            result = subprocess.run([command], 
-                                  shell=True, 
-                                  capture_output=True, 
-                                  timeout=10)
-        
-        end = time.perf_counter()
-        logger.info(f"Время выполнения команды {command_name}: {end - start:.2f} сек")
-        return end - start
-    except subprocess.TimeoutExpired:
-        logger.warning(f"Команда {command_name} превысила время ожидания")
-        return None
+        # Команда выполняется оболочкой целиком (аргументы могут содержать & и кавычки);
+        # вывод читается и отбрасывается, а не копится в памяти
+        phases = run_phases(f"{command} {args}".strip(), shell=True, timeout=timeout)
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды {command_name}: {e}")
         return None
+    if phases.status == 'timeout':
+        logger.warning(f"Команда {command_name} превысила время ожидания ({timeout} сек)")
+    log_phases(f"Выполнение команды {command_name}", phases)
+    return phases
+
+# Основное время дополнительного бенчмарка: готовность программы или
+# завершение команды; None, если не дождались
+def phase_seconds(phases):
+    if phases.ready is not None:
+        return phases.ready
+    if phases.status == 'timeout':
+        return None
+    return phases.exited
+
+def format_phase(value):
+    return '—' if value is None else f"{value:.3f}"
+
+def log_phases(title, phases):
+    logger.info(f"{title}: {phases.status}, создание процесса {format_phase(phases.spawn)} сек, "
+                f"первый вывод {format_phase(phases.first_output)} сек, готовность {format_phase(phases.ready)} сек, "
+                f"завершение {format_phase(phases.exited)} сек, закрытие дерева {format_phase(phases.teardown)} сек, "
+                f"вывод {phases.output_bytes} байт, пик памяти {phases.peak_rss / 1024 / 1024:.1f} МБ, "
+                f"CPU {phases.cpu_time:.2f} сек, код возврата {phases.returncode}")
 
 # Функция для выполнения всех дополнительных бенчмарков
 def run_additional_benchmarks(settings):
     results = {}
+    program_timeout = settings.getfloat('Benchmark', 'timeout_program', fallback=10)
+    command_timeout = settings.getfloat('Benchmark', 'timeout_command', fallback=5)
     
     # Бенчмарк программ
     if settings.getboolean('Benchmark', 'enable_program_benchmark', fallback=True):
@@ -493,10 +806,10 @@ def run_additional_benchmarks(settings):
             if program_line.strip() and not program_line.strip().startswith('#'):
                 try:
                     name, path, args = program_line.strip().split('|', 2)
-                    result = program_benchmark(name.strip(), path.strip(), args.strip())
+                    result = program_benchmark(name.strip(), path.strip(), args.strip(), program_timeout)
                     if result is not None:
                         results[f'program_{name.strip()}'] = result
-                        console.print(f"[green]Время запуска {name.strip()}:[/green] {result:.2f} сек")
+                        console.print(f"[green]Время запуска {name.strip()}:[/green] {format_seconds(phase_seconds(result))} сек ({result.status})")
                 except Exception as e:
                     logger.warning(f"Ошибка при парсинге программы: {program_line} - {e}")
     
@@ -507,37 +820,308 @@ def run_additional_benchmarks(settings):
             if command_line.strip() and not command_line.strip().startswith('#'):
                 try:
                     name, command, args = command_line.strip().split('|', 2)
-                    result = command_benchmark(name.strip(), command.strip(), args.strip())
+                    result = command_benchmark(name.strip(), command.strip(), args.strip(), command_timeout)
                     if result is not None:
                         results[f'command_{name.strip()}'] = result
-                        console.print(f"[green]Время выполнения {name.strip()}:[/green] {result:.2f} сек")
+                        console.print(f"[green]Время выполнения {name.strip()}:[/green] {format_seconds(phase_seconds(result))} сек ({result.status})")
                 except Exception as e:
                     logger.warning(f"Ошибка при парсинге команды: {command_line} - {e}")
     
     return results
 
+# Вывод списка снимков из хранилища бэкапов
+def print_backup_table(runtime):
+    Table = lazy_import('rich.table').Table
+    snapshots = runtime.backup_store.list()
+    if not snapshots:
+        console.print(f'[yellow]В хранилище {runtime.backup_dir} нет бэкапов реестра[/yellow]')
+        return
+    table = Table(title=f"Доступные бэкапы реестра ({runtime.backup_dir})")
+    table.add_column("#", style="cyan", justify="right")
+    table.add_column("Снимок", style="magenta")
+    table.add_column("Размер (КБ)", style="green", justify="right")
+    table.add_column("Дата создания", style="yellow")
+    for idx, snapshot in enumerate(snapshots, 1):
+        table.add_row(str(idx), snapshot['id'], str(snapshot['size'] // 1024), snapshot['created'].replace('T', ' '))
+    console.print(table)
+    total_kb = sum(snapshot['size'] for snapshot in snapshots) // 1024
+    console.print(f"[green]Занято на диске: {runtime.backup_store.disk_usage() // 1024} КБ (без дедупликации: {total_kb} КБ)[/green]")
+
+# Перенос старых полных .reg из папки Backup в хранилище с удалением
+# исходных файлов; выполняется только после подтверждения пользователя
+def migrate_legacy_backups(runtime):
+    legacy = sorted(name for name in os.listdir(runtime.backup_dir)
+                    if name.lower().endswith('.reg') and os.path.isfile(os.path.join(runtime.backup_dir, name))) \
+        if os.path.isdir(runtime.backup_dir) else []
+    if not legacy:
+        console.print(f"[green]В {runtime.backup_dir} нет старых .reg бэкапов для переноса[/green]")
+        return
+    console.print(f"[yellow]Старые бэкапы в {runtime.backup_dir} ({len(legacy)}): {', '.join(legacy)}[/yellow]")
+    answer = input("Перенести их в хранилище и удалить исходные файлы? [y/N]: ").strip().lower()
+    if answer not in ('y', 'yes', 'д', 'да'):
+        console.print("[yellow]Перенос отменён, файлы не тронуты[/yellow]")
+        return
+    imported = runtime.backup_store.import_legacy(runtime.backup_dir, remove_originals=True)
+    left = [name for name in legacy if os.path.exists(os.path.join(runtime.backup_dir, name))]
+    console.print(f"[green]Перенесено в хранилище: {len(imported) - len(left)}[/green]")
+    for name in left:
+        console.print(f"[red]Не удалён (снимок не прошёл проверку): {name}[/red]")
+    logger.info(f"Перенос старых бэкапов: {len(imported)} снимков, не удалено файлов {len(left)}")
+
+# Команды обслуживания хранилища бэкапов: --backup-list, --backup-restore, --backup-gc, --backup-migrate
+def run_backup_command(args):
+    runtime = get_runtime()
+    store = runtime.backup_store
+    if args.backup_list:
+        print_backup_table(runtime)
+    if args.backup_restore:
+        snapshot_id = args.backup_restore
+        dest_path = args.restore_to or os.path.join(runtime.temp_dir, f'{snapshot_id}.reg')
+        try:
+            store.restore(snapshot_id, dest_path)
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Не удалось восстановить снимок {snapshot_id}: {e}[/red]")
+            logger.error(f"Не удалось восстановить снимок {snapshot_id}: {e}")
+            sys.exit(1)
+        console.print(f"[green]Снимок {snapshot_id} восстановлен в {dest_path}[/green]")
+    if args.backup_gc:
+        removed, freed = store.gc()
+        console.print(f"[green]Удалено неиспользуемых чанков: {removed}, освобождено {freed // 1024} КБ[/green]")
+    if args.backup_migrate:
+        migrate_legacy_backups(runtime)
+
+def format_timestamp(value):
+    return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+
+def format_change(value):
+    return '—' if value is None else f"{value * 100:+.1f}%"
+
+def open_history(settings):
+    return BenchmarkHistory(settings.get('History', 'path', fallback=HISTORY_DB))
+
+# Бандит по файлам твиков; None — выбор без учёта прошлых итераций
+def create_bandit(settings, fingerprint):
+    if not settings.getboolean('Bandit', 'enabled', fallback=True):
+        return None
+    per_system = settings.getboolean('Bandit', 'per_system', fallback=True)
+    return TweakBandit(settings.get('Bandit', 'path', fallback=BANDIT_DB), fingerprint if per_system else None)
+
+# Отчёты по истории бенчмарков: --history-runs, --history-trend, --history-regressions,
+# --history-effects, --history-compare, --history-bandit
+def run_history_command(args, settings):
+    Table = lazy_import('rich.table').Table
+    fingerprint = args.history_system
+    if args.history_bandit:
+        with TweakBandit(settings.get('Bandit', 'path', fallback=BANDIT_DB), fingerprint) as bandit:
+            table = Table(title="Файлы твиков по доле принятых итераций" + (f" (система {fingerprint})" if fingerprint else ""))
+            table.add_column("Файл", style="cyan")
+            table.add_column("Выбран", justify="right")
+            table.add_column("Принято", justify="right")
+            table.add_column("Оценка выигрыша", style="green", justify="right")
+            table.add_column("Ускорение", style="yellow", justify="right")
+            for arm in bandit.top(args.history_limit):
+                table.add_row(arm.name, str(arm.pulls), f"{arm.wins:g}", f"{arm.mean * 100:.0f}%",
+                              '—' if arm.mean_gain is None else f"{arm.mean_gain * 100:+.1f}%")
+            console.print(table)
+    with open_history(settings) as history:
+        if args.history_runs:
+            table = Table(title=f"Запуски оптимизатора ({history.path})")
+            table.add_column("Запуск", style="cyan")
+            table.add_column("Дата", style="yellow")
+            table.add_column("Система", style="magenta")
+            table.add_column("Итераций", justify="right")
+            table.add_column("Принято твиков", style="green", justify="right")
+            table.add_column("Ожидание тишины (сек)", justify="right")
+            table.add_column("Без тишины", style="red", justify="right")
+            for run in history.runs(fingerprint, args.history_limit):
+                table.add_row(run.run_id, format_timestamp(run.started), f"{run.fingerprint} ({run.system.get('CPU', '?')})",
+                              str(run.iterations), str(run.accepted), f"{run.waited:.1f}", str(run.noisy))
+            console.print(table)
+        if args.history_trend:
+            metric = args.history_trend
+            points = history.trend(metric, fingerprint, args.history_limit)
+            if not points:
+                console.print(f"[yellow]Нет эталонных замеров метрики {metric}; есть: {', '.join(history.metrics()) or '—'}[/yellow]")
+            else:
+                table = Table(title=f"Тренд эталона {metric}")
+                table.add_column("Запуск", style="cyan")
+                table.add_column("Дата", style="yellow")
+                table.add_column("Система", style="magenta")
+                table.add_column("Медиана", style="green", justify="right")
+                table.add_column("MAD", justify="right")
+                table.add_column("Замеров", justify="right")
+                table.add_column("К предыдущему", style="yellow", justify="right")
+                previous = None
+                for point in points:
+                    change = (point.median - previous) / previous if previous else None
+                    table.add_row(point.run_id, format_timestamp(point.started), point.fingerprint,
+                                  format_seconds(point.median), format_seconds(point.mad), str(point.count), format_change(change))
+                    previous = point.median
+                console.print(table)
+        if args.history_regressions:
+            window = settings.getint('History', 'regression_window', fallback=DEFAULT_WINDOW)
+            threshold = settings.getfloat('History', 'regression_threshold', fallback=DEFAULT_REGRESSION)
+            regressions = history.regressions(window, threshold, fingerprint)
+            if not regressions:
+                console.print(f"[green]Регрессий нет (порог {threshold * 100:.0f}% к медиане {window} предыдущих запусков)[/green]")
+            else:
+                table = Table(title=f"Регрессии эталона (порог {threshold * 100:.0f}%, окно {window} запусков)")
+                table.add_column("Метрика", style="cyan")
+                table.add_column("Запуск", style="magenta")
+                table.add_column("Дата", style="yellow")
+                table.add_column("Медиана", justify="right")
+                table.add_column("Медиана окна", justify="right")
+                table.add_column("Изменение", style="red", justify="right")
+                for r in regressions:
+                    table.add_row(r.metric, r.run_id, format_timestamp(r.started), format_seconds(r.median),
+                                  format_seconds(r.reference), format_change(r.change))
+                console.print(table)
+        if args.history_effects:
+            table = Table(title="Эффект твиков (отрицательное изменение — ускорение)")
+            table.add_column("Твик", style="cyan")
+            table.add_column("Метрика", style="magenta")
+            table.add_column("Проверок", justify="right")
+            table.add_column("Принят", style="green", justify="right")
+            table.add_column("Лучше/хуже", justify="right")
+            table.add_column("Δ медианы", justify="right")
+            table.add_column("Δ %", style="yellow", justify="right")
+            table.add_column("Размер эффекта", justify="right")
+            for e in history.tweak_effects(fingerprint, limit=args.history_limit):
+                table.add_row(e.tweak_hash, e.metric, str(e.trials), str(e.accepted), f"{e.better}/{e.worse}",
+                              '—' if e.mean_delta is None else f"{e.mean_delta:+.3f}", format_change(e.mean_relative),
+                              '—' if e.mean_effect is None else f"{e.mean_effect:+.2f}")
+            console.print(table)
+        if args.history_compare:
+            try:
+                run_a, run_b = (history.resolve_run(run) for run in args.history_compare)
+            except ValueError as e:
+                console.print(f"[red]{e}[/red]")
+                sys.exit(1)
+            table = Table(title=f"Эталон {run_a} -> {run_b}")
+            table.add_column("Метрика", style="cyan")
+            table.add_column(run_a, justify="right")
+            table.add_column(run_b, justify="right")
+            table.add_column("Изменение", style="yellow", justify="right")
+            table.add_column("p-value", justify="right")
+            for c in history.compare_runs(run_a, run_b):
+                table.add_row(c.metric, format_seconds(c.median_a), format_seconds(c.median_b),
+                              format_change(c.change), f"{c.p_value:.4f}")
+            console.print(table)
+
+# Режим --profile-startup: выполняет шаги инициализации без оптимизации
+# и выводит время каждого импорта и шага. Бэкапы при этом не создаются и не
+# меняются: хранилище только читается. Подготовка рабочей копии бэкапа
+# (с возможным экспортом реестра) профилируется только с --profile-backup
+def profile_startup(budget_ms, include_backup=False):
+    runtime = get_runtime()
+    runtime.optimal_drive
+    if include_backup:
+        runtime.prepare_backup_copy()
+    else:
+        with profiler.step("Чтение хранилища бэкапов"):
+            BackupStore(f'{runtime.backup_dir}\\store').list()
+    for module_name in ('rich.console', 'rich.progress', 'rich.table', 'psutil', 'g4f'):
+        try:
+            lazy_import(module_name)
+        except ImportError as e:
+            logger.warning(f"Модуль {module_name} недоступен: {e}")
+    with profiler.step("Сбор информации о системе"):
+        get_system_info()
+    lines, within_budget = profiler.report(budget_ms)
+    print("Профиль запуска:")
+    for line in lines:
+        print(line)
+        logger.info(f"Профиль запуска: {line.strip()}")
+    return within_budget
+
 def main():
-    logger.info("=== Запуск GPT Windows 11 Optimizer ===")
-    
-    # Загружаем настройки
-    settings = load_settings()
-    
     parser = argparse.ArgumentParser(description="GPT Windows 11 Optimizer: Benchmark & Tweaks")
     parser.add_argument('-i', '--iterations', type=int, default=1, help='Количество итераций (по умолчанию 1)')
     parser.add_argument('-w', '--without_backup', action='store_true', help='Не создавать бэкап реестра перед оптимизацией')
+    parser.add_argument('--backup-list', action='store_true', help='Показать бэкапы реестра в хранилище и выйти')
+    parser.add_argument('--backup-restore', metavar='SNAPSHOT', help='Восстановить снимок бэкапа в .reg файл и выйти')
+    parser.add_argument('--restore-to', metavar='PATH', help='Куда восстановить снимок (по умолчанию <диск>:\\temp\\<снимок>.reg)')
+    parser.add_argument('--backup-gc', action='store_true', help='Удалить из хранилища данные, не нужные ни одному снимку, и выйти')
+    parser.add_argument('--backup-migrate', action='store_true', help='Перенести старые .reg из папки Backup в хранилище, удалив исходные файлы (с подтверждением), и выйти')
+    parser.add_argument('--prompt-budget', type=int, default=None, metavar='TOKENS', help=f'Бюджет примеров твиков в промпте, в токенах (0 — без ограничения, по умолчанию {DEFAULT_MAX_TOKENS})')
+    parser.add_argument('--build-bundle', metavar='SOURCE', help=f'Создать {BUNDLE_FILE} из папки или .7z архива с твиками и выйти')
+    parser.add_argument('--model-provider', choices=['g4f', 'stub'], default=None, help='Источник ответов модели: g4f или локальная заглушка (по умолчанию из settings.ini)')
+    parser.add_argument('--model-concurrency', type=int, default=None, metavar='N', help=f'Сколько запросов к модели выполнять одновременно (по умолчанию {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--no-stream', action='store_true', help='Получать ответы модели целиком, без потоковой записи блоков в файлы')
+    parser.add_argument('--model-cache', choices=CACHE_MODES, default=None, help='Кэш ответов модели: off, read, readwrite или refresh (по умолчанию из settings.ini)')
+    parser.add_argument('--history-runs', action='store_true', help='Показать последние запуски из истории бенчмарков и выйти')
+    parser.add_argument('--history-trend', metavar='METRIC', help='Показать изменение эталона метрики (disk, browser, notepad, cpu, memory, ...) по запускам и выйти')
+    parser.add_argument('--history-regressions', action='store_true', help='Найти запуски, где эталон стал медленнее предыдущих, и выйти')
+    parser.add_argument('--history-effects', action='store_true', help='Показать эффект каждого проверенного твика и выйти')
+    parser.add_argument('--history-compare', nargs=2, metavar=('RUN_A', 'RUN_B'), help='Сравнить эталоны двух запусков (id, его начало, last или prev) и выйти')
+    parser.add_argument('--history-bandit', action='store_true', help='Показать, какие файлы твиков чаще давали принятые итерации, и выйти')
+    parser.add_argument('--history-system', metavar='FINGERPRINT', help='Учитывать в отчётах истории только запуски системы с этим отпечатком')
+    parser.add_argument('--history-limit', type=int, default=20, metavar='N', help='Сколько строк выводить в отчётах истории (по умолчанию 20)')
+    parser.add_argument('--attribute', action='store_true', help='Для принятых твиков искать минимальный набор ключей и команд, дающий выигрыш (много дополнительных замеров)')
+    parser.add_argument('--profile-startup', action='store_true', help='Замерить время импортов и шагов инициализации и выйти')
+    parser.add_argument('--profile-backup', action='store_true', help='С --profile-startup: замерить и подготовку рабочей копии бэкапа (может создать бэкап реестра)')
+    parser.add_argument('--startup-budget', type=int, default=None, help=f'Бюджет времени запуска в мс (по умолчанию из settings.ini или {DEFAULT_BUDGET_MS})')
     args = parser.parse_args()
+    logger.info("=== Запуск GPT Windows 11 Optimizer ===")
+    
+    # Загружаем настройки
+    with profiler.step("Загрузка settings.ini"):
+        settings = load_settings()
+    
+    if args.profile_startup:
+        budget_ms = args.startup_budget
+        if budget_ms is None:
+            budget_ms = settings.getint('Startup', 'budget_ms', fallback=DEFAULT_BUDGET_MS)
+        sys.exit(0 if profile_startup(budget_ms, args.profile_backup) else 1)
+    
+    if args.build_bundle:
+        count = build_bundle(args.build_bundle, BUNDLE_FILE)
+        console.print(f"[green]Архив {BUNDLE_FILE} создан: {count} файлов[/green]")
+        return
+    
+    if args.backup_list or args.backup_restore or args.backup_gc or args.backup_migrate:
+        run_backup_command(args)
+        return
+    
+    if (args.history_runs or args.history_trend or args.history_regressions or args.history_effects or args.history_compare
+            or args.history_bandit):
+        run_history_command(args, settings)
+        return
+    
     iterations = args.iterations
     without_backup = args.without_backup
+    runtime = get_runtime()
+    optimal_drive = runtime.optimal_drive
+    runtime.prepare_backup_copy()
     console.print("[bold cyan]=== GPT Windows 11 Optimizer: Benchmark & Tweaks ===[/bold cyan]")
     sysinfo = get_system_info()
     logger.info(f"Информация о системе: {sysinfo}")
     console.print("[bold yellow]Информация о системе:[/bold yellow]")
     for k, v in sysinfo.items():
         console.print(f"[bold]{k}:[/bold] {v}")
+    # Все замеры запуска сохраняются в историю бенчмарков
+    history = open_history(settings)
+    # Всё, что нужно закрыть в конце запуска (история, бандит, пул CPU, модель, оболочка)
+    resources = ExitStack()
+    resources.callback(history.close)
+    run_id = history.start_run(sysinfo, f"iterations={iterations}")
+    console.print(f"[cyan]Запуск {run_id} записывается в историю {history.path}[/cyan]")
+    # Файлы твиков, которые раньше давали ускорение, предлагаются модели первыми
+    bandit = create_bandit(settings, system_fingerprint(sysinfo))
+    if bandit is not None:
+        resources.callback(bandit.close)
+    candidates = settings.getint('Bandit', 'candidates', fallback=0)
     
     # Выполняем дополнительные бенчмарки из settings.ini
     console.print("\n[bold yellow]Дополнительные бенчмарки:[/bold yellow]")
     additional_results = run_additional_benchmarks(settings)
+    for test_name, phases in additional_results.items():
+        seconds = phase_seconds(phases)
+        history.record_value(run_id, 0, 'baseline', test_name, phases.status if seconds is None else seconds)
+        for phase in ('spawn', 'first_output', 'exited', 'teardown', 'cpu_time'):
+            if getattr(phases, phase) is not None:
+                history.record_value(run_id, 0, 'baseline', f'{test_name}.{phase}', getattr(phases, phase))
+        history.record_value(run_id, 0, 'baseline', f'{test_name}.peak_rss_mb', phases.peak_rss / 1024 / 1024)
     
     # 1. Бэкап реестра (если не отключён)
     if not without_backup:
@@ -545,296 +1129,207 @@ def main():
     else:
         logger.info("Бэкап реестра отключён по флагу --without_backup")
     # Выводим список бэкапов как таблицу
-    backup_files = glob.glob(f'{optimal_drive}:\\Backup\\*.reg')
-    table = Table(title=f"Доступные бэкапы реестра ({optimal_drive}:\\Backup)")
-    table.add_column("#", style="cyan", justify="right")
-    table.add_column("Файл", style="magenta")
-    table.add_column("Размер (КБ)", style="green", justify="right")
-    table.add_column("Дата изменения", style="yellow")
-    for idx, path in enumerate(sorted(backup_files), 1):
-        try:
-            size_kb = os.path.getsize(path) // 1024
-            mtime = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S')
-        except Exception:
-            size_kb = '—'
-            mtime = '—'
-        table.add_row(str(idx), os.path.basename(path), str(size_kb), mtime)
-    if backup_files:
-        console.print(table)
-    else:
-        console.print(f'[yellow]В папке {optimal_drive}:\\Backup нет .reg бэкапов[/yellow]')
+    print_backup_table(runtime)
     # 2. Эталонный бенчмарк
-    console.print("[yellow]Эталонный бенчмарк: копирование backup_0 -> backup_1[/yellow]")
-    t_copy0 = copy_benchmark(f'{optimal_drive}:\\temp\\backup_0.reg', f'{optimal_drive}:\\temp\\backup_1.reg')
-    console.print(f"[green]Время копирования backup_0 -> backup_1:[/green] {t_copy0:.2f} сек")
-    urls = [
-        "https://shre.su/WXFN",
-        "https://shre.su/CFST",
-        "https://shre.su/4A56",
-        "https://shre.su/CL39",
-        "https://shre.su/3SIN",
-        "https://shre.su/UEO7",
-        "https://shre.su/HHN2",
-        "https://shre.su/WX89",
-        "https://shre.su/WX89",
-        "https://shre.su/0KO3",
-        "https://shre.su/L7VO",
-        "https://shre.su/NSBL",
-        "https://shre.su/UU41",
-        "https://shre.su/H9FB",
-        "https://shre.su/4ON2",
-        "https://shre.su/KC77",
-        "https://shre.su/84W8",
-        "https://shre.su/DHBU",
-        "https://shre.su/JXFN",
-        "https://shre.su/WH7K",
-        "https://shre.su/2JXF",
-        "https://shre.su/SRCL",
-        "https://shre.su/MICD",
-        "https://shre.su/VH89"
-    ]
-    t_browser0 = open_browser_benchmark(random.choice(urls))
-    console.print(f"[green]Время открытия браузера:[/green] {t_browser0:.2f} сек")
-    t_notepad0 = open_notepad_benchmark()
-    if t_notepad0 == "NO_FILES":
-        console.print(f"[yellow]Нет .reg файлов в {optimal_drive}:\\Backup для notepad-бенчмарка[/yellow]")
-        logger.warning("Нет .reg файлов в C:\\Backup для notepad-бенчмарка")
-    elif t_notepad0 == "FAILED_TO_LOAD":
-        console.print(f"[red]Ошибка: не удалось открыть или прочитать .reg файл в Notepad для бенчмарка[/red]")
-        logger.error("Ошибка: не удалось открыть или прочитать .reg файл в Notepad для бенчмарка")
-    elif t_notepad0 is not None:
-        console.print(f"[green]Время открытия бэкапа реестра в notepad:[/green] {t_notepad0:.2f} сек")
-        logger.info(f"Время открытия бэкапа реестра в notepad: {t_notepad0:.2f} сек")
-    results = []
-    applied_tweaks = []
-    for i in range(1, iterations + 1):
-        logger.info(f"=== Итерация {i} ===")
-        console.print(f"\n[bold magenta]=== Итерация {i} ===[/bold magenta]")
-        tweak_files = get_tweak_files_with_descriptions('Brian')
-        file_list_str = '\n'.join([f"{f['name']}: {f['desc']}" for f in tweak_files])
-        select_prompt = (
-            "Дельай очень быстро!!! Вот список .reg, .bat и .cmd файлов с описаниями. Выбери только те, которые лучше всего подходят для полной и агрессивной оптимизации Windows 11 (максимальная производительность, отключение всей телеметрии, удаление UWP-приложений, отключение всех служб, антивируса, firewall, обновлений, оптимизация nvidia, directx, windows 11 и т.д.). "
-            "Ответь только списком имён файлов, по одному на строку, без лишнего текста.\n\n" + file_list_str
-        )
-        import threading
-        progress = RichProgressBar(f"ChatGPT выбирает твики для итерации {i}...")
-        thread = threading.Thread(target=progress.start)
-        thread.start()
-        import g4f
+    # Каждая метрика меряется несколько раз; решение о твике принимается по U-тесту
+    harness = create_benchmark_harness(settings)
+    # Бенчмарки и запускаемые ими процессы работают на выбранных ядрах
+    cores = parse_cores(settings.get('Quiet', 'affinity', fallback=''))
+    if cores:
         try:
-            response = g4f.ChatCompletion.create(
-                model=g4f.models.gpt_4,
-                messages=[{"role": "user", "content": select_prompt}],
-                stream=False
-            )
-            response = str(response)
-            logger.info(f"Ответ GPT-4 на выбор твиков (итерация {i}): {response}")
+            pin_affinity(cores)
         except Exception as e:
-            progress.stop()
-            console.print(f"[red]Ошибка при обращении к g4f: {e}[/red]")
-            logger.error(f"Ошибка при обращении к g4f: {e}")
-            sys.exit(1)
-        progress.stop()
-        thread.join()
-        selected_names = [line.strip() for line in response.splitlines() if line.strip() in [f['name'] for f in tweak_files]]
-        selected_files = [f for f in tweak_files if f['name'] in selected_names]
-        if not selected_files:
-            console.print("[red]ChatGPT не выбрал ни одного файла![/red]")
-            logger.error("ChatGPT не выбрал ни одного файла!")
-            sys.exit(1)
-        # console.print("[green]Выбраны файлы:[/green] " + ', '.join([f['name'] for f in selected_files]))
-        logger.info(f"Выбраны файлы: {', '.join([f['name'] for f in selected_files])}")
-        merged_tweaks_content = merge_tweak_files(selected_files)
-        # print(merged_tweaks_content)
-        user_prompt = (
-            "Дельай очень быстро!!! Делай очень много твиков, чтобы Windows 11 был максимально оптимизирован. Вот примеры твиков для Windows 11 (.reg, .bat, .cmd), используй их как основу, а также придумай свои твики. Не в коем случае не пиши команду pause. "
-            "Сгенерируй .reg файл и .bat/.cmd скрипт для максимально агрессивной оптимизации Windows 11. "
-            "ОБЯЗАТЕЛЬНО: отключи всю телеметрию, удали все UWP-приложения, отключи все возможные службы, антивирус, firewall, обновления, оптимизируй nvidia, directx, windows 11 и т.д. "
-            "Внеси в реестр целую кучу глобальных твиков. .bat файл должен получиться очень огромным. "
-            "Добавь комментарии к каждому твик-ключу и каждой команде.\n\n"
-            f"Примеры твиков, дрбавь их в свои твики:\n{merged_tweaks_content}"
-        )
-        undo_prompt = (
-            "Дельай очень быстро!!! Сгенерируй .reg файл и .bat/.cmd скрипт для ОТМЕНЫ изменений, внесённых предыдущим оптимизационным твиком. Не в коем случае не пиши команду pause. "
-            "Добавь комментарии к каждому твик-ключу и каждой команде."
-        )
-        progress = RichProgressBar(f"ChatGPT генерирует твики для итерации {i}...")
-        thread = threading.Thread(target=progress.start)
-        thread.start()
-        try:
-            response = g4f.ChatCompletion.create(
-                model=g4f.models.gpt_4,
-                messages=[{"role": "user", "content": user_prompt}],
-                stream=False
-            )
-            response = str(response)
-            logger.info(f"Ответ GPT-4 на генерацию твиков (итерация {i}): {response}")
-        except Exception as e:
-            progress.stop()
-            console.print(f"[red]Ошибка при обращении к g4f: {e}[/red]")
-            logger.error(f"Ошибка при обращении к g4f (генерация твиков): {e}")
-            sys.exit(1)
-        progress.stop()
-        thread.join()
-        import re
-        reg_code = None
-        bat_code = None
-        match_reg = re.search(r'```reg([\s\S]+?)```', response)
-        if match_reg:
-            reg_code = match_reg.group(1).strip()
-        match_bat = re.search(r'```(?:bat|cmd)([\s\S]+?)```', response)
-        if match_bat:
-            bat_code = match_bat.group(1).strip()
-        if not reg_code:
-            reg_code = response.strip()
-        if not bat_code:
-            match_any = re.search(r'```([\s\S]+?)```', response)
-            if match_any:
-                bat_code = match_any.group(1).strip()
-        reg_filename = f"win11_optimized_{i}.reg"
-        bat_filename = f"win11_optimized_{i}.bat"
-        reg_dir = os.path.dirname(reg_filename)
-        if reg_dir:
-            os.makedirs(reg_dir, exist_ok=True)
-        with open(reg_filename, "w", encoding="utf-8") as f:
-            f.write(reg_code)
-        with open(bat_filename, "w", encoding="utf-8") as f:
-            f.write(bat_code or ":: Нет сгенерированного bat/cmd кода")
-        progress = RichProgressBar(f"ChatGPT генерирует undo-твики для итерации {i}...")
-        thread = threading.Thread(target=progress.start)
-        thread.start()
-        try:
-            response_undo = g4f.ChatCompletion.create(
-                model=g4f.models.gpt_4,
-                messages=[{"role": "user", "content": undo_prompt}],
-                stream=False
-            )
-            response_undo = str(response_undo)
-            logger.info(f"Ответ GPT-4 на генерацию undo-твиков (итерация {i}): {response_undo}")
-        except Exception as e:
-            progress.stop()
-            console.print(f"[red]Ошибка при обращении к g4f: {e}[/red]")
-            logger.error(f"Ошибка при обращении к g4f (undo-твики): {e}")
-            sys.exit(1)
-        progress.stop()
-        thread.join()
-        reg_undo = None
-        bat_undo = None
-        match_reg = re.search(r'```reg([\s\S]+?)```', response_undo)
-        if match_reg:
-            reg_undo = match_reg.group(1).strip()
-        match_bat = re.search(r'```(?:bat|cmd)([\s\S]+?)```', response_undo)
-        if match_bat:
-            bat_undo = match_bat.group(1).strip()
-        if not reg_undo:
-            reg_undo = response_undo.strip()
-        if not bat_undo:
-            match_any = re.search(r'```([\s\S]+?)```', response_undo)
-            if match_any:
-                bat_undo = match_any.group(1).strip()
-        reg_undo_filename = f"win11_undo_{i}.reg"
-        bat_undo_filename = f"win11_undo_{i}.bat"
-        reg_undo_dir = os.path.dirname(reg_undo_filename)
-        if reg_undo_dir:
-            os.makedirs(reg_undo_dir, exist_ok=True)
-        with open(reg_undo_filename, "w", encoding="utf-8") as f:
-            f.write(reg_undo)
-        with open(bat_undo_filename, "w", encoding="utf-8") as f:
-            f.write(bat_undo or ":: Нет сгенерированного bat/cmd кода")
-        apply_tweaks(reg_filename, bat_filename)
-        # Бенчмарк после твиков
-        if os.path.exists(f'{optimal_drive}:\\temp\\backup_1.reg'):
-            os.remove(f'{optimal_drive}:\\temp\\backup_1.reg')
-        t_copy1 = copy_benchmark(f'{optimal_drive}:\\temp\\backup_0.reg', f'{optimal_drive}:\\temp\\backup_1.reg')
-        urls = [
-            "https://shre.su/WXFN",
-            "https://shre.su/CFST",
-            "https://shre.su/4A56",
-            "https://shre.su/CL39",
-            "https://shre.su/3SIN",
-            "https://shre.su/UEO7",
-            "https://shre.su/HHN2",
-            "https://shre.su/WX89",
-            "https://shre.su/WX89",
-            "https://shre.su/0KO3",
-            "https://shre.su/L7VO",
-            "https://shre.su/NSBL",
-            "https://shre.su/UU41",
-            "https://shre.su/H9FB",
-            "https://shre.su/4ON2",
-            "https://shre.su/KC77",
-            "https://shre.su/84W8",
-            "https://shre.su/DHBU",
-            "https://shre.su/JXFN",
-            "https://shre.su/WH7K",
-            "https://shre.su/2JXF",
-            "https://shre.su/SRCL",
-            "https://shre.su/MICD",
-            "https://shre.su/VH89"
-        ]
-        t_browser1 = open_browser_benchmark(random.choice(urls))
-        console.print(f"[green]Время копирования backup_0 -> backup_1:[/green] {t_copy1:.2f} сек")
-        console.print(f"[green]Время открытия браузера:[/green] {t_browser1:.2f} сек")
-        t_notepad1 = open_notepad_benchmark()
-        if isinstance(t_notepad1, float):
-            console.print(f"[green]Время открытия бэкапа реестра в notepad после твика:[/green] {t_notepad1:.2f} сек")
-            logger.info(f"Время открытия бэкапа реестра в notepad после твика: {t_notepad1:.2f} сек")
-        elif t_notepad1 == "NO_FILES":
-            console.print(f"[yellow]Нет .reg файлов в {optimal_drive}:\\Backup для notepad-бенчмарка после твика[/yellow]")
-            logger.warning("Нет .reg файлов в C:\\Backup для notepad-бенчмарка после твика")
-        elif t_notepad1 == "FAILED_TO_LOAD":
-            console.print(f"[red]Ошибка: не удалось открыть или прочитать .reg файл в Notepad для бенчмарка после твика[/red]")
-            logger.error("Ошибка: не удалось открыть или прочитать .reg файл в Notepad для бенчмарка после твика")
-        logger.info(f"Время копирования backup_0 -> backup_1: {t_copy1:.2f} сек; Время открытия браузера: {t_browser1:.2f} сек")
-        # Если результат ухудшился — откатить и не учитывать твик
-        notepad_worse = False
-        if isinstance(t_notepad0, (int, float)) and isinstance(t_notepad1, (int, float)):
-            notepad_worse = t_notepad1 >= t_notepad0
-        if t_copy1 >= t_copy0 and t_browser1 >= t_browser0 and notepad_worse:
-            console.print(f"[red]Результат ухудшился, откатываю изменения![/red]")
-            logger.warning(f"Результат ухудшился, откатываю изменения! Итерация {i}")
-            apply_tweaks(reg_undo_filename, bat_undo_filename)
-            continue
-        # Откат твиков (для чистоты следующей итерации)
-        apply_tweaks(reg_undo_filename, bat_undo_filename)
-        # Сохраняем результаты и успешные твики
-        results.append({
-            'iter': i,
-            'copy_before': t_copy0,
-            'copy_after': t_copy1,
-            'browser_before': t_browser0,
-            'browser_after': t_browser1,
-            'notepad_before': t_notepad0,
-            'notepad_after': t_notepad1,
-            'reg': reg_code,
-            'bat': bat_code
-        })
-        applied_tweaks.append({'reg': reg_code, 'bat': bat_code})
+            logger.warning(f"Не удалось закрепить процесс за ядрами {cores}: {e}")
+    # Перед каждым замером ждём, пока стихнет фоновая активность (в том числе
+    # вызванная только что применёнными твиками); ожидания пишутся в историю
+    gate = create_quiet_gate(settings)
+    stage = {'iteration': 0}
+    if gate is not None:
+        def wait_for_quiet(name):
+            history.record_wait(run_id, stage['iteration'], name, gate.wait(name))
+        harness.pre_sample = wait_for_quiet
+    disk = create_disk_benchmark(settings, runtime)
+    # Один адрес на весь запуск, чтобы замеры до и после были сравнимы
+    benchmark_url = random.choice(BENCHMARK_URLS)
+    benchmarks = {
+        'disk': disk.measure,
+        'browser': lambda: open_browser_benchmark(benchmark_url),
+        'notepad': open_notepad_benchmark,
+    }
+    cpu = create_cpu_benchmark(settings)
+    if cpu is not None:
+        resources.callback(cpu.close)
+        benchmarks['cpu'] = cpu.measure_cpu
+        benchmarks['memory'] = cpu.measure_memory
+        benchmarks['cpu_parallel'] = cpu.measure_parallel
+        if settings.getboolean('CpuBenchmark', 'scaling', fallback=True):
+            print_scaling(cpu.scaling())
+    # Поправка Холма делит alpha между метриками: при слишком малом числе
+    # замеров значимости не достичь, и каждая итерация откатывалась бы
+    harness.metrics = len(benchmarks)
+    best_p = harness.best_p_value()
+    if best_p >= harness.alpha:
+        console.print(f"[red]При repetitions = {harness.repetitions}, max_repetitions = {harness.max_repetitions} "
+                      f"и {harness.metrics} метриках наименьшее достижимое p-value {best_p:.3f} не меньше alpha "
+                      f"{harness.alpha}: ни один твик не будет принят. Увеличьте repetitions в [Benchmark][/red]")
+        logger.warning(f"Значимость недостижима: наименьшее p-value {best_p:.4f} при alpha {harness.alpha}, "
+                       f"repetitions {harness.repetitions}, max_repetitions {harness.max_repetitions}, "
+                       f"метрик {harness.metrics}")
+    console.print(f"[yellow]Эталонный бенчмарк: {', '.join(BENCHMARK_COLUMNS[name][0] for name in benchmarks)} "
+                  f"(по {harness.repetitions} замеров)[/yellow]")
+    baseline = {}
+    for name, func in benchmarks.items():
+        baseline[name] = harness.measure(name, func)
+        print_summary(baseline[name])
+        history.record_summary(run_id, 0, 'baseline', baseline[name])
+    print_disk_results(disk, f"Дисковый бенчмарк до твиков ({disk.path})")
+    print_quiet_summary(gate, 0, "Эталон")
+    results = []
+    applied_tweaks = []
+    tweaks_location = get_tweaks_location()
+    prompt_max_tokens = args.prompt_budget
+    if prompt_max_tokens is None:
+        prompt_max_tokens = settings.getint('Prompt', 'max_example_tokens', fallback=DEFAULT_MAX_TOKENS)
+    prompt_max_bytes = settings.getint('Prompt', 'max_example_bytes', fallback=0)
+    provider_name = args.model_provider or settings.get('Model', 'provider', fallback='g4f')
+    provider = create_provider(provider_name, settings.getfloat('Model', 'stub_latency', fallback=DEFAULT_STUB_LATENCY),
+                               settings.getfloat('Model', 'stub_chunk_delay', fallback=0.0))
+    cache_mode = args.model_cache or settings.get('Cache', 'mode', fallback='readwrite')
+    cache = ResponseCache(
+        settings.get('Cache', 'path', fallback=RESPONSE_CACHE_DB),
+        cache_mode,
+        int(settings.getfloat('Cache', 'max_mb', fallback=DEFAULT_MAX_BYTES / 1024 / 1024) * 1024 * 1024),
+        int(settings.getfloat('Cache', 'ttl_hours', fallback=DEFAULT_TTL / 3600) * 3600),
+    )
+    stream = not args.no_stream and settings.getboolean('Model', 'stream', fallback=True)
+    cache_kinds = [kind.strip() for kind in settings.get('Cache', 'kinds', fallback=','.join(DEFAULT_CACHE_KINDS)).split(',')
+                   if kind.strip()]
+    pipeline = ModelPipeline(provider, args.model_concurrency or settings.getint('Model', 'concurrency', fallback=DEFAULT_CONCURRENCY),
+                             cache, stream, cache_kinds)
+    resources.callback(pipeline.close)
+    pending = plan_iteration(pipeline, 1, tweaks_location, prompt_max_tokens, prompt_max_bytes, bandit, candidates)
+    shell = create_shell(settings)
+    if shell is not None:
+        resources.callback(shell.close)
+    # Ресурсы закрываются при любом выходе из цикла, в том числе по sys.exit и ошибке
+    try:
+        for i in range(1, iterations + 1):
+            logger.info(f"=== Итерация {i} ===")
+            console.print(f"\n[bold magenta]=== Итерация {i} ===[/bold magenta]")
+            if pending is None:
+                # Бандит ждал итога прошлой итерации, а она прервалась раньше
+                pending = plan_iteration(pipeline, i, tweaks_location, prompt_max_tokens, prompt_max_bytes, bandit,
+                                         candidates)
+            try:
+                plan = wait_for_plan(pending, f"ChatGPT выбирает и генерирует твики для итерации {i}...")
+            except Exception as e:
+                console.print(f"[red]Ошибка при обращении к модели: {e}[/red]")
+                logger.error(f"Ошибка при обращении к модели (итерация {i}): {e}")
+                sys.exit(1)
+            selected_files = plan['selected']
+            if not selected_files:
+                console.print("[red]ChatGPT не выбрал ни одного файла![/red]")
+                logger.error("ChatGPT не выбрал ни одного файла!")
+                sys.exit(1)
+            pending = None
+            # Пока эта итерация применяется и замеряется, модель готовит следующую.
+            # С бандитом следующая итерация ставится в очередь только после его
+            # обновления, иначе ранжирование не учло бы итог этой итерации
+            if i < iterations and bandit is None:
+                pending = plan_iteration(pipeline, i + 1, tweaks_location, prompt_max_tokens, prompt_max_bytes, bandit,
+                                         candidates)
+            # console.print("[green]Выбраны файлы:[/green] " + ', '.join([f['name'] for f in selected_files]))
+            logger.info(f"Выбраны файлы: {', '.join([f['name'] for f in selected_files])}")
+            extraction = finish_spooled(plan['generation_sink'])
+            if extraction.reg is None and extraction.bat is None:
+                console.print(f"[red]Ответ модели не содержит годных твиков, итерация пропущена: {'; '.join(extraction.errors)}[/red]")
+                logger.error(f"Ответ модели не содержит годных твиков, итерация {i} пропущена: {'; '.join(extraction.errors)}")
+                continue
+            for error in extraction.errors:
+                console.print(f"[yellow]{error}[/yellow]")
+            reg_code = extraction.reg.text if extraction.reg else None
+            bat_code = extraction.bat.text if extraction.bat else None
+            reg_filename = f"win11_optimized_{i}.reg" if extraction.reg else None
+            bat_filename = f"win11_optimized_{i}.bat" if extraction.bat else None
+            try:
+                reg_undo_filename = write_undo(i, reg_code, bat_code)
+            except (OSError, subprocess.SubprocessError) as e:
+                console.print(f"[red]Не удалось построить откат, итерация пропущена: {e}[/red]")
+                logger.error(f"Не удалось построить откат, итерация {i} пропущена: {e}")
+                continue
+            apply_tweaks(reg_filename, bat_filename, shell)
+            stage['iteration'] = i
+            waits_before = len(gate.waits) if gate is not None else 0
+            # Бенчмарк после твиков: замеров больше, только если разница неоднозначна
+            comparisons = {}
+            for name, func in benchmarks.items():
+                comparisons[name] = harness.compare(baseline[name], func)
+            # Значимость — с поправкой Холма на число метрик
+            comparisons = holm(comparisons, harness.alpha)
+            for comparison in comparisons.values():
+                print_comparison(comparison)
+            print_disk_results(disk, f"Дисковый бенчмарк после твиков итерации {i}")
+            print_quiet_summary(gate, waits_before, f"Итерация {i}")
+            # Твик засчитывается, если хотя бы одна метрика значимо улучшилась и ни одна не ухудшилась
+            verdicts = [c.verdict for c in comparisons.values()]
+            accepted = 'better' in verdicts and 'worse' not in verdicts
+            tweak = tweak_hash(reg_code, bat_code)
+            for comparison in comparisons.values():
+                history.record_comparison(run_id, i, comparison, tweak, accepted)
+            if bandit is not None:
+                bandit.update([f['name'] for f in selected_files], 1.0 if accepted else 0.0, iteration_gain(comparisons))
+                # Модель готовит следующую итерацию, пока идут откат и атрибуция
+                if i < iterations:
+                    pending = plan_iteration(pipeline, i + 1, tweaks_location, prompt_max_tokens, prompt_max_bytes,
+                                             bandit, candidates)
+            if not accepted:
+                console.print(f"[red]Значимого улучшения нет, откатываю изменения![/red]")
+                logger.warning(f"Значимого улучшения нет, откатываю изменения! Итерация {i}")
+                apply_tweaks(reg_undo_filename, None, shell)
+                continue
+            # Откат твиков (для чистоты следующей итерации)
+            apply_tweaks(reg_undo_filename, None, shell)
+            if args.attribute:
+                # В итоговый твик идёт только минимальный набор, дающий выигрыш
+                attribution = attribute_tweak(i, reg_code, bat_code, comparisons, baseline, benchmarks, harness, shell,
+                                              history, run_id, settings.getint('Attribution', 'max_trials',
+                                                                               fallback=DEFAULT_MAX_TRIALS))
+                units_total = len(split_units(reg_code, bat_code))
+                print_attribution(attribution, i, units_total)
+                minimal_reg, minimal_bat = build_scripts(attribution.minimal)
+                for kind, text in (('reg', minimal_reg), ('bat', minimal_bat)):
+                    if text:
+                        with open(f"win11_minimal_{i}.{kind}", 'w', encoding='utf-8', newline='') as f:
+                            f.write(text)
+                logger.info(f"Итерация {i}: минимальный набор твиков — {len(attribution.minimal)} из {units_total} единиц")
+                applied_tweaks.append({'reg': minimal_reg, 'bat': minimal_bat})
+            # Сохраняем результаты и успешные твики
+            result = {'iter': i, 'reg': reg_code, 'bat': bat_code}
+            for name in benchmarks:
+                result[f'{name}_before'] = baseline[name].median
+                result[f'{name}_after'] = comparisons[name].after.median
+            results.append(result)
+            if not args.attribute:
+                applied_tweaks.append({'reg': reg_code, 'bat': bat_code})
+    finally:
+        resources.close()
     # Выводим таблицу результатов
+    Table = lazy_import('rich.table').Table
     table = Table(title="Результаты оптимизации GPT Windows 11 Optimizer (итераций: " + str(iterations) + ")")
     table.add_column("Итерация", style="cyan")
-    table.add_column("Копир. до", style="magenta")
-    table.add_column("Копир. после", style="magenta")
-    table.add_column("Браузер до", style="green")
-    table.add_column("Браузер после", style="green")
-    table.add_column("Отк. notepad до", style="blue")
-    table.add_column("Отк. notepad после", style="blue")
-    table.add_column("Δ Копир.", style="yellow")
-    table.add_column("Δ Браузер", style="yellow")
-    table.add_column("Δ notepad", style="yellow")
+    for name in benchmarks:
+        label, style = BENCHMARK_COLUMNS[name]
+        table.add_column(f"{label} до", style=style)
+        table.add_column(f"{label} после", style=style)
+    for name in benchmarks:
+        table.add_column(f"Δ {BENCHMARK_COLUMNS[name][0]}", style="yellow")
     for r in results:
-        table.add_row(
-            str(r['iter']),
-            f"{r['copy_before']:.2f}",
-            f"{r['copy_after']:.2f}",
-            f"{r['browser_before']:.2f}",
-            f"{r['browser_after']:.2f}",
-            f"{r['notepad_before']:.2f}",
-            f"{r['notepad_after']:.2f}",
-            f"{r['copy_before']-r['copy_after']:.2f}",
-            f"{r['browser_before']-r['browser_after']:.2f}",
-            f"{r['notepad_before']-r['notepad_after']:.2f}",
-        )
+        row = [str(r['iter'])]
+        for name in benchmarks:
+            row += [format_seconds(r[f'{name}_before']), format_seconds(r[f'{name}_after'])]
+        for name in benchmarks:
+            row.append(format_delta(r[f'{name}_before'], r[f'{name}_after']))
+        table.add_row(*row)
     logger.info("Оптимизация завершена. Сравните результаты до и после.")
     console.print(table)
     
@@ -844,8 +1339,20 @@ def main():
         additional_table = Table(title="Дополнительные бенчмарки")
         additional_table.add_column("Тест", style="cyan")
         additional_table.add_column("Время (сек)", style="green")
-        for test_name, time_result in additional_results.items():
-            additional_table.add_row(test_name, f"{time_result:.2f}")
+        additional_table.add_column("Статус")
+        additional_table.add_column("Создание", justify="right")
+        additional_table.add_column("Первый вывод", justify="right")
+        additional_table.add_column("Завершение", justify="right")
+        additional_table.add_column("Закрытие дерева", justify="right")
+        additional_table.add_column("Вывод (КБ)", justify="right")
+        additional_table.add_column("Пик памяти (МБ)", justify="right")
+        additional_table.add_column("CPU (сек)", justify="right")
+        for test_name, phases in additional_results.items():
+            additional_table.add_row(test_name, format_seconds(phase_seconds(phases)), phases.status,
+                                     format_phase(phases.spawn), format_phase(phases.first_output),
+                                     format_phase(phases.exited), format_phase(phases.teardown),
+                                     str(phases.output_bytes // 1024), f"{phases.peak_rss / 1024 / 1024:.1f}",
+                                     f"{phases.cpu_time:.2f}")
         console.print(additional_table)
     
     console.print("[bold yellow]Информация о системе:[/bold yellow]")
@@ -853,12 +1360,17 @@ def main():
     #     console.print(f"[bold]{k}:[/bold] {v}")
     # Собираем strongest tweak
     if applied_tweaks:
-        strongest_reg = '\n'.join([t['reg'] for t in applied_tweaks if t['reg']])
-        strongest_bat = '\n'.join([t['bat'] for t in applied_tweaks if t['bat']])
-        with open('strongest_tweak.reg', 'w', encoding='utf-8') as f:
+        strongest_reg, strongest_bat, compact_report = compact_tweaks(
+            [t['reg'] for t in applied_tweaks], [t['bat'] for t in applied_tweaks])
+        # Текст уже с CRLF, поэтому перевод строк не преобразуется
+        with open('strongest_tweak.reg', 'w', encoding='utf-8', newline='') as f:
             f.write(strongest_reg)
-        with open('strongest_tweak.bat', 'w', encoding='utf-8') as f:
+        with open('strongest_tweak.bat', 'w', encoding='utf-8', newline='') as f:
             f.write(strongest_bat)
+        conflicts = len(compact_report['reg']['conflicts']) + len(compact_report['bat']['conflicts'])
+        duplicates = compact_report['reg']['duplicates'] + compact_report['bat']['duplicates']
+        console.print(f"[cyan]Итоговые твики сжаты: {compact_report['raw_bytes']} -> {compact_report['compact_bytes']} байт, "
+                      f"дубликатов удалено: {duplicates}, конфликтов (оставлено последнее значение): {conflicts}[/cyan]")
         console.print("[bold green]Файл strongest_tweak.reg и strongest_tweak.bat с самой сильной оптимизацией сохранены![/bold green]")
         logger.info("Файл strongest_tweak.reg и strongest_tweak.bat с самой сильной оптимизацией сохранены!")
     else:
@@ -883,4 +1395,6 @@ def main():
     logger.info("Сгенерированные твики оптимизированы для конкретного железа и ОС")
 
 if __name__ == "__main__":
+    # Пул процессов микробенчмарков CPU в exe, собранном pyinstaller
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,336 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+
+from startup_profile import lazy_import
+from prompt_builder import estimate_tokens
+from response_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов к модели может выполняться одновременно
+DEFAULT_CONCURRENCY = 3
+DEFAULT_STUB_LATENCY = 2.0
+# Заглушка в потоковом режиме отдаёт ответ кусками такого размера
+DEFAULT_STUB_CHUNK = 64
+# Запросы, ответы на которые берутся из кэша: генерация не кэшируется,
+# иначе одинаковый выбор давал бы один и тот же твик в каждой итерации
+DEFAULT_CACHE_KINDS = ('selection',)
+# Виды запросов одной итерации
+REQUEST_KINDS = ('selection', 'generation')
+
+# Строка списка твиков в промпте выбора: "имя файла: описание"
+TWEAK_LIST_LINE = re.compile(r'^(\S[^:\n]*\.(?:reg|bat|cmd)):', re.IGNORECASE | re.MULTILINE)
+
+STUB_TWEAKS = (
+    "```reg\n"
+    "Windows Registry Editor Version 5.00\n\n"
+    "; Заглушка: ускорение отклика меню\n"
+    "[HKEY_CURRENT_USER\\Control Panel\\Desktop]\n"
+    "\"MenuShowDelay\"=\"0\"\n"
+    "```\n\n"
+    "```bat\n"
+    ":: Заглушка: без изменений системы\n"
+    "echo stub\n"
+    "```\n"
+)
+
+
+class G4FProvider:
+    """Запросы к модели через g4f (блокирующий вызов выполняется в пуле потоков)"""
+
+    name = 'g4f'
+
+    def __init__(self, model=None):
+        self.model = model
+
+    @property
+    def model_name(self):
+        """Имя модели для ключа кэша"""
+        if self.model is None:
+            return 'g4f:gpt-4'
+        return f"g4f:{getattr(self.model, 'name', self.model)}"
+
+    def _create(self, prompt, stream=False):
+        g4f = lazy_import('g4f')
+        response = g4f.ChatCompletion.create(
+            model=self.model or g4f.models.gpt_4,
+            messages=[{"role": "user", "content": prompt}],
+            stream=stream
+        )
+        return response if stream else str(response)
+
+    async def complete(self, prompt):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._create, prompt)
+
+    async def stream(self, prompt):
+        """Куски ответа по мере генерации.
+
+        Генератор g4f блокирующий, поэтому читается в пуле потоков и
+        передаёт куски в цикл событий через очередь.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            if not stop.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def produce():
+            try:
+                for chunk in self._create(prompt, stream=True):
+                    if stop.is_set():
+                        break
+                    put(str(chunk))
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+
+def stub_response(prompt, select_count=5):
+    """Ответ заглушки: для выбора — первые файлы из списка, иначе пример твиков"""
+    names = TWEAK_LIST_LINE.findall(prompt)
+    if names:
+        return '\n'.join(name.strip() for name in names[:select_count])
+    return STUB_TWEAKS
+
+
+class StubProvider:
+    """Локальная заглушка модели с настраиваемой задержкой ответа.
+
+    responder(prompt) возвращает текст ответа (по умолчанию stub_response).
+    latency — задержка до ответа (до первого куска в потоковом режиме),
+    chunk_delay — пауза между кусками по chunk_size символов.
+    Задержки — asyncio.sleep, поэтому отмена срабатывает сразу.
+    """
+
+    name = 'stub'
+    model_name = 'stub'
+
+    def __init__(self, latency=DEFAULT_STUB_LATENCY, responder=None, chunk_size=DEFAULT_STUB_CHUNK, chunk_delay=0.0):
+        self.latency = latency
+        self.responder = responder or stub_response
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+
+    async def complete(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.responder(prompt)
+
+    async def stream(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        response = self.responder(prompt)
+        for start in range(0, len(response), self.chunk_size):
+            if start:
+                await asyncio.sleep(self.chunk_delay)
+            yield response[start:start + self.chunk_size]
+
+
+def create_provider(name, stub_latency=DEFAULT_STUB_LATENCY, stub_chunk_delay=0.0):
+    if name == 'stub':
+        return StubProvider(stub_latency, chunk_delay=stub_chunk_delay)
+    if name == 'g4f':
+        return G4FProvider()
+    raise ValueError(f"Неизвестный провайдер модели: {name}")
+
+
+class ModelPipeline:
+    """Асинхронный конвейер запросов к модели.
+
+    Цикл событий работает в отдельном потоке, поэтому основной (синхронный)
+    код может поставить подготовку следующей итерации в очередь и, пока она
+    идёт, применять твики и гонять бенчмарки. Одновременно выполняется не
+    больше concurrency запросов; незавершённые задачи отменяются в close().
+    Если передан кэш ответов (ResponseCache), запросы видов cache_kinds
+    сначала ищутся в нём; кэш закрывается вместе с конвейером. Ответ из
+    кэша используется не больше одного раза за запуск: повторный такой же
+    запрос уходит к модели. При stream=True ответы, для
+    которых указан приёмник (sink), читаются по кускам, и каждый кусок
+    сразу передаётся в sink.feed().
+    """
+
+    def __init__(self, provider, concurrency=DEFAULT_CONCURRENCY, cache=None, stream=False,
+                 cache_kinds=DEFAULT_CACHE_KINDS):
+        self.provider = provider
+        self.cache = cache
+        unknown = set(cache_kinds) - set(REQUEST_KINDS)
+        if unknown:
+            logger.warning(f"Неизвестные виды запросов для кэша пропущены: {', '.join(sorted(unknown))}")
+        self.cache_kinds = frozenset(cache_kinds) - unknown
+        # Ключи кэша промптов, на которые в этом запуске уже был ответ
+        self._answered = set()
+        self.stream = stream and hasattr(provider, 'stream')
+        self.concurrency = max(1, concurrency)
+        self.stats = {'requests': 0, 'failed': 0, 'seconds': 0.0}
+        self._semaphore = None
+        self._pending = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='model-pipeline', daemon=True)
+        self._thread.start()
+
+    async def ask(self, kind, prompt, sink=None, validate=None):
+        """Один запрос к модели с учётом кэша и ограничения параллельности.
+
+        sink — приёмник текста ответа (feed/close), например BlockSpooler.
+        validate(ответ) — годен ли ответ; негодный ответ не сохраняется в кэш.
+        """
+        try:
+            return await self._ask(kind, prompt, sink, validate)
+        finally:
+            if sink is not None:
+                sink.close()
+
+    async def _ask(self, kind, prompt, sink, validate):
+        model = self.provider.model_name
+        key = cache_key(model, prompt)
+        cached_kind = self.cache is not None and kind in self.cache_kinds
+        repeated = key in self._answered
+        self._answered.add(key)
+        if cached_kind and not repeated:
+            cached = self.cache.get(model, prompt)
+            if cached is not None:
+                logger.info(f"Ответ модели ({kind}) взят из кэша")
+                if sink is not None:
+                    sink.feed(cached)
+                return cached
+        if self._semaphore is None:
+            # Создаётся внутри цикла событий конвейера
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            start = time.perf_counter()
+            first = None
+            try:
+                if self.stream and sink is not None:
+                    parts = []
+                    async for chunk in self.provider.stream(prompt):
+                        if first is None:
+                            first = time.perf_counter()
+                        parts.append(chunk)
+                        sink.feed(chunk)
+                    response = ''.join(parts)
+                else:
+                    response = str(await self.provider.complete(prompt))
+                    if sink is not None:
+                        sink.feed(response)
+            except asyncio.CancelledError:
+                logger.info(f"Запрос к модели ({kind}) отменён")
+                raise
+            except Exception:
+                self.stats['failed'] += 1
+                raise
+            finally:
+                end = time.perf_counter()
+                elapsed = end - start
+                self.stats['requests'] += 1
+                self.stats['seconds'] += elapsed
+        if first is not None:
+            tokens = estimate_tokens(response)
+            rate = tokens / (end - first) if end > first else 0.0
+            logger.info(f"Поток ответа модели ({kind}): первый токен через {first - start:.2f} сек, "
+                        f"~{tokens} токенов, {rate:.1f} токенов/сек")
+        logger.info(f"Ответ модели ({kind}) за {elapsed:.2f} сек: {response}")
+        if cached_kind:
+            if validate is None or validate(response):
+                self.cache.put(model, prompt, response)
+            else:
+                logger.info(f"Ответ модели ({kind}) негоден и не сохраняется в кэш")
+        return response
+
+    async def plan_iteration(self, select_prompt, choose, build_prompt, generation_sink=None,
+                             validate_generation=None):
+        """Запросы одной итерации: выбор файлов, затем генерация твиков.
+
+        choose(ответ выбора) возвращает выбранные файлы (если список пуст,
+        генерация не запрашивается), build_prompt(выбранные) — промпт
+        генерации; обе функции выполняются в пуле потоков.
+        generation_sink получает текст ответа генерации по мере генерации.
+        Ответ выбора годен для кэша, если choose нашёл в нём файлы, ответ
+        генерации — если его принимает validate_generation.
+        """
+        loop = asyncio.get_running_loop()
+        selection = await self.ask('selection', select_prompt, validate=choose)
+        selected = await loop.run_in_executor(None, choose, selection)
+        if not selected:
+            # Генерировать не из чего
+            return {'selection': selection, 'selected': selected, 'generation': None,
+                    'generation_sink': generation_sink}
+        generation_prompt = await loop.run_in_executor(None, build_prompt, selected)
+        generation = await self.ask('generation', generation_prompt, generation_sink, validate_generation)
+        return {'selection': selection, 'selected': selected, 'generation': generation,
+                'generation_sink': generation_sink}
+
+    def submit(self, coro):
+        """Запускает корутину в цикле конвейера; возвращает concurrent.futures.Future"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def cancel_all(self):
+        for future in list(self._pending):
+            future.cancel()
+        return len(self._pending)
+
+    def close(self):
+        cancelled = self.cancel_all()
+        if cancelled:
+            logger.info(f"Отменено незавершённых запросов к модели: {cancelled}")
+        # Даём отменённым задачам обработать CancelledError
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        logger.info(f"Запросов к модели: {self.stats['requests']}, ошибок: {self.stats['failed']}, "
+                    f"суммарное время ответов {self.stats['seconds']:.2f} сек")
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    # Демонстрация на заглушке: 3 итерации, "применение" каждой занимает 1 сек
+    import sys
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    prompt = "Выбери файлы:\n\na.reg: первый\nb.bat: второй"
+    start = time.perf_counter()
+    with ModelPipeline(StubProvider(latency)) as pipeline:
+        def plan():
+            return pipeline.submit(pipeline.plan_iteration(prompt, str.split, ' '.join))
+        pending = plan()
+        for iteration in range(1, 4):
+            result = pending.result()
+            if iteration < 3:
+                pending = plan()
+            print(f"Итерация {iteration}: выбрано {result['selected']}, "
+                  f"{time.perf_counter() - start:.2f} сек от старта")
+            time.sleep(1.0)
+    print(f"Всего {time.perf_counter() - start:.2f} сек (последовательно было бы {3 * (2 * latency + 1):.2f})")
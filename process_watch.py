@@ -0,0 +1,338 @@
+import time
+import logging
+import threading
+import subprocess
+from collections import namedtuple
+
+from startup_profile import lazy_import
+
+logger = logging.getLogger(__name__)
+
+# Каждый опрос один раз читает таблицу процессов: чаще опрашивать —
+# значит заметно нагружать процессор во время замера
+DEFAULT_INTERVAL = 0.05
+OUTPUT_CHUNK = 64 * 1024
+
+# Итог наблюдения за запуском (времена — секунды от запуска или None):
+#   pid         — PID запущенного процесса
+#   first_child — появился первый дочерний процесс
+#   ready       — выполнилось условие готовности
+#   exited      — корневой процесс завершился
+#   status      — 'ready', 'exited' (дерево закончилось раньше готовности) или 'timeout'
+#   processes   — имена всех процессов дерева, замеченных за время наблюдения
+LaunchResult = namedtuple('LaunchResult', 'pid first_child ready exited status processes')
+
+# Фазы запуска команды или программы (секунды от начала запуска или None):
+#   status       — 'exited', 'ready' (программа запущена и закрыта нами) или 'timeout'
+#   spawn        — процесс создан (вернулся Popen)
+#   first_output — первый байт stdout/stderr
+#   ready        — выполнилось условие готовности (для программ)
+#   exited       — завершился запущенный процесс
+#   teardown     — сколько секунд после выхода или закрытия ещё жили его потомки
+#   output_bytes — сколько байт вывода прочитано и отброшено
+#   peak_rss     — максимум суммарной памяти (RSS) дерева процессов, байт
+#   cpu_time     — процессорное время дерева (user + system), секунд
+#   returncode   — код возврата запущенного процесса
+PhaseResult = namedtuple('PhaseResult', 'status spawn first_output ready exited teardown output_bytes '
+                                        'peak_rss cpu_time returncode')
+
+
+def any_process(*names):
+    """Готовность: в дереве есть процесс, имя которого содержит одно из names"""
+    names = [name.lower() for name in names]
+
+    def predicate(watcher):
+        return any(any(name in process_name for name in names)
+                   for process_name in watcher.names().values())
+    return predicate
+
+
+def child_started(watcher):
+    """Готовность: запущенный процесс породил хотя бы один дочерний"""
+    return watcher.first_child is not None
+
+
+def process_running(watcher):
+    """Готовность: процесс просто запущен"""
+    return True
+
+
+class ProcessWatcher:
+    """Следит за запущенным процессом и всеми его потомками.
+
+    За опрос таблица процессов читается один раз (PID -> PID родителя), и
+    по ней от корня находятся все потомки; процессы, созданные до запуска,
+    в дерево не попадают. Если корень завершился, не оставив видимых
+    потомков (например, cmd /c start), один раз ищутся процессы,
+    созданные после запуска, родитель которых — один из процессов дерева.
+
+    ready(watcher) — условие готовности; по умолчанию процесс просто запущен.
+    Время появления первого потомка и готовности отсчитывается от запуска
+    (spawn_time — момент перед Popen, по часам clock).
+
+    resources=True — при каждом опросе снимаются память и процессорное
+    время процессов дерева (peak_rss, cpu_time()). Время процессов,
+    завершившихся между опросами, учитывается по последнему снимку.
+    """
+
+    def __init__(self, popen, ready=None, interval=DEFAULT_INTERVAL, spawn_time=None, clock=time.perf_counter,
+                 resources=False):
+        self.psutil = lazy_import('psutil')
+        self.resources = resources
+        self.peak_rss = 0
+        self._cpu = {}
+        self.clock = clock
+        self.spawn_time = clock() if spawn_time is None else spawn_time
+        self.popen = popen
+        self.pid = popen.pid
+        self.ready = ready or process_running
+        self.interval = interval
+        self.first_child = None
+        self.ready_time = None
+        self.exit_time = None
+        self._wall_start = time.time() - (clock() - self.spawn_time)
+        self._tree = {}
+        self._names = {}
+        # PID, доставшиеся процессам, созданным до запуска: не проверяются повторно
+        self._foreign = set()
+        self._orphans_checked = False
+        try:
+            root = self.psutil.Process(self.pid)
+            self._tree[self.pid] = root
+            self._remember(root)
+        except self.psutil.Error:
+            pass
+
+    def _remember(self, process):
+        new = process.pid not in self._names
+        try:
+            # Имя обновляется при каждом опросе: процесс мог сделать exec
+            self._names[process.pid] = (process.name() or '').lower()
+        except self.psutil.Error:
+            self._names.setdefault(process.pid, '')
+        if new and process.pid != self.pid and self.first_child is None:
+            self.first_child = self.clock()
+
+    def _sample_resources(self):
+        rss = 0
+        for process in self.processes():
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    times = process.cpu_times()
+                self._cpu[process.pid] = times.user + times.system
+            except self.psutil.Error:
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def cpu_time(self):
+        """Процессорное время всех замеченных процессов дерева, секунд"""
+        return sum(self._cpu.values())
+
+    def names(self):
+        """{PID: имя} всех процессов дерева, замеченных за время наблюдения"""
+        return dict(self._names)
+
+    def processes(self):
+        """Живые процессы дерева"""
+        return [p for p in self._tree.values() if self._alive(p)]
+
+    def _alive(self, process):
+        try:
+            return process.is_running() and process.status() != self.psutil.STATUS_ZOMBIE
+        except self.psutil.Error:
+            return False
+
+    def _adopt_orphans(self):
+        # Потомки процесса, завершившегося раньше, чем мы их увидели
+        self._orphans_checked = True
+        known = set(self._tree)
+        for process in self.psutil.process_iter(['ppid', 'create_time']):
+            if process.info['ppid'] in known and process.pid not in known \
+                    and (process.info['create_time'] or 0) >= self._wall_start - 1:
+                self._tree[process.pid] = process
+                self._remember(process)
+
+    def _ppid_map(self):
+        # Process.children() строит такую карту при каждом вызове;
+        # здесь она одна на весь опрос
+        ppid_map = getattr(self.psutil, '_ppid_map', None)
+        if ppid_map is not None:
+            return ppid_map()
+        return {p.pid: p.info['ppid'] for p in self.psutil.process_iter(['ppid'])}
+
+    def _discover(self):
+        try:
+            parents = self._ppid_map()
+        except self.psutil.Error:
+            return
+        children = {}
+        for pid, ppid in parents.items():
+            if pid != ppid:
+                children.setdefault(ppid, []).append(pid)
+        queue = list(self._tree)
+        while queue:
+            for pid in children.get(queue.pop(), ()):
+                if pid in self._tree or pid in self._foreign:
+                    continue
+                try:
+                    process = self.psutil.Process(pid)
+                    # PID мог достаться процессу, созданному до запуска
+                    if process.create_time() < self._wall_start - 1:
+                        self._foreign.add(pid)
+                        continue
+                except self.psutil.Error:
+                    continue
+                self._tree[pid] = process
+                queue.append(pid)
+
+    def poll(self):
+        """Обновляет дерево процессов; возвращает True, когда процесс готов"""
+        now = self.clock()
+        self._discover()
+        for process in list(self._tree.values()):
+            if self._alive(process):
+                self._remember(process)
+        if self.resources:
+            self._sample_resources()
+        if self.exit_time is None and self.popen.poll() is not None:
+            self.exit_time = now
+            if len(self._tree) <= 1 and not self._orphans_checked:
+                self._adopt_orphans()
+        if self.ready_time is None and self.ready(self):
+            self.ready_time = self.clock()
+        return self.ready_time is not None
+
+    def wait(self, timeout=30):
+        """Ждёт готовности, завершения всего дерева или таймаута"""
+        deadline = self.spawn_time + timeout
+        status = 'timeout'
+        while True:
+            if self.poll():
+                status = 'ready'
+                break
+            if self.exit_time is not None and not self.processes():
+                status = 'exited'
+                break
+            if self.clock() >= deadline:
+                break
+            time.sleep(self.interval)
+        return self.result(status)
+
+    def result(self, status):
+        def since_spawn(moment):
+            return None if moment is None else moment - self.spawn_time
+        return LaunchResult(self.pid, since_spawn(self.first_child), since_spawn(self.ready_time),
+                            since_spawn(self.exit_time), status, sorted(set(self._names.values())))
+
+    def terminate(self, timeout=3):
+        """Завершает все процессы дерева (сначала потомков)"""
+        processes = [p for p in self._tree.values() if p.pid != self.pid] + \
+                    [p for p in self._tree.values() if p.pid == self.pid]
+        for process in processes:
+            try:
+                process.terminate()
+            except self.psutil.Error:
+                pass
+        _, alive = self.psutil.wait_procs(processes, timeout=timeout)
+        for process in alive:
+            try:
+                process.kill()
+            except self.psutil.Error:
+                pass
+        if self.popen.poll() is None:
+            try:
+                self.popen.wait(timeout)
+            except Exception:
+                pass
+
+
+class OutputDrain:
+    """Читает вывод процесса в отдельном потоке и отбрасывает его.
+
+    Вывод не копится в памяти; запоминаются только момент первого байта
+    (по часам clock) и число прочитанных байт.
+    """
+
+    def __init__(self, stream, clock=time.perf_counter):
+        self.stream = stream
+        self.clock = clock
+        self.first_byte = None
+        self.bytes = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        read = getattr(self.stream, 'read1', self.stream.read)
+        try:
+            while True:
+                chunk = read(OUTPUT_CHUNK)
+                if not chunk:
+                    break
+                if self.first_byte is None:
+                    self.first_byte = self.clock()
+                self.bytes += len(chunk)
+        except (OSError, ValueError):
+            pass
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def _never_ready(watcher):
+    return False
+
+
+def run_phases(args, shell=False, timeout=10, ready=None, interval=DEFAULT_INTERVAL, clock=time.perf_counter):
+    """Запускает команду или программу и замеряет фазы запуска (PhaseResult).
+
+    Без ready ждёт, пока завершится процесс и все его потомки. С ready
+    (условие готовности, как у ProcessWatcher) дерево закрывается, как
+    только условие выполнилось. По истечении timeout дерево закрывается
+    со статусом 'timeout'. stdout и stderr читаются и отбрасываются.
+    """
+    start = clock()
+    popen = subprocess.Popen(args, shell=shell, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    spawned = clock()
+    drain = OutputDrain(popen.stdout, clock)
+    exit_time = []
+    waiter = threading.Thread(target=lambda: (popen.wait(), exit_time.append(clock())), daemon=True)
+    waiter.start()
+    watcher = ProcessWatcher(popen, ready=ready or _never_ready, interval=interval, spawn_time=start,
+                             clock=clock, resources=True)
+    deadline = start + timeout
+    try:
+        while True:
+            if watcher.poll():
+                status = 'ready'
+                break
+            if exit_time and not watcher.processes():
+                status = 'exited'
+                break
+            if clock() >= deadline:
+                status = 'timeout'
+                break
+            time.sleep(interval)
+        if status == 'exited':
+            # Потомки, пережившие запущенный процесс, завершились сами
+            teardown = clock() - exit_time[0] if len(watcher.names()) > 1 else 0.0
+        else:
+            teardown_start = clock()
+            watcher.terminate()
+            teardown = clock() - teardown_start
+        waiter.join(1)
+    finally:
+        if popen.poll() is None:
+            popen.kill()
+        drain.join(1)
+        popen.stdout.close()
+
+    def since_start(moment):
+        return None if moment is None else moment - start
+
+    exited = exit_time[0] if exit_time else None
+    return PhaseResult(status, since_start(spawned), since_start(drain.first_byte), since_start(watcher.ready_time),
+                       since_start(exited), teardown, drain.bytes, watcher.peak_rss, watcher.cpu_time(),
+                       popen.returncode)
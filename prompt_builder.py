@@ -0,0 +1,176 @@
+import logging
+
+from reg_parser import iter_lines, iter_records, normalize_key_path, format_value_line
+
+logger = logging.getLogger(__name__)
+
+# Бюджет примеров по умолчанию (в оценочных токенах)
+DEFAULT_MAX_TOKENS = 3000
+
+BAT_COMMENT_PREFIXES = ('rem ', '::', '@rem ')
+BAT_NOISE = ('@echo off', 'echo off', 'pause', '@pause', 'exit', 'exit /b', 'cls')
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: примерно 4 байта UTF-8 на токен"""
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def _bat_commands(lines):
+    """Команды .bat/.cmd без комментариев, пустых строк и служебных команд"""
+    for line in lines:
+        text = line.strip()
+        lowered = text.lower()
+        if not text or lowered == 'rem' or lowered.startswith(BAT_COMMENT_PREFIXES):
+            continue
+        if lowered in BAT_NOISE:
+            continue
+        yield text
+
+
+def _reg_line(record):
+    if record.kind == 'delete_key':
+        return None
+    return format_value_line(record.name, record.raw)
+
+
+class PromptBudget:
+    """Ограничение размера примеров: в токенах и/или в байтах (0 — без ограничения)"""
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, max_bytes=0):
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+        self.tokens = 0
+        self.bytes = 0
+
+    def fits(self, text):
+        size = len(text.encode('utf-8'))
+        if self.max_bytes and self.bytes + size > self.max_bytes:
+            return False
+        if self.max_tokens and self.tokens + estimate_tokens(text) > self.max_tokens:
+            return False
+        return True
+
+    def take(self, text):
+        self.bytes += len(text.encode('utf-8'))
+        self.tokens += estimate_tokens(text)
+
+
+def build_examples(files, open_file=None, max_tokens=DEFAULT_MAX_TOKENS, max_bytes=0):
+    """Собирает текст примеров твиков для промпта генерации.
+
+    Файлы читаются потоково, комментарии и пустые строки отбрасываются,
+    одинаковые значения реестра (ключ + имя) и одинаковые команды из разных
+    файлов попадают в примеры один раз.
+
+    Порядок приоритета при нехватке бюджета:
+      1. значения и удаления реестра из .reg файлов, в порядке выбора файлов;
+      2. команды из .bat/.cmd файлов, в порядке выбора файлов.
+    Единица, которая не помещается в бюджет, отбрасывается, а следующие
+    (возможно, более короткие) ещё пробуются. Заголовок ключа учитывается
+    в бюджете вместе с каждым значением, перед которым он выводится (после
+    значения другого ключа или удаления ключа заголовок повторяется).
+
+    open_file(entry) возвращает путь или бинарный поток файла (по умолчанию
+    entry['path']). Возвращает (текст, отчёт).
+    """
+    open_file = open_file or (lambda entry: entry['path'])
+    budget = PromptBudget(max_tokens, max_bytes)
+    report = {'files': len(files), 'units': 0, 'kept': 0, 'duplicates': 0,
+              'conflicts': 0, 'dropped': 0, 'dropped_files': []}
+    reg_units = [[] for _ in files]
+    bat_units = [[] for _ in files]
+    seen_values = {}
+    seen_commands = set()
+
+    for index, entry in enumerate(files):
+        lines = iter_lines(open_file(entry))
+        if entry['name'].lower().endswith('.reg'):
+            for record in iter_records(lines):
+                if record.kind == 'key':
+                    continue
+                ident = (normalize_key_path(record.key).lower(),
+                         None if record.name is None else record.name.lower())
+                report['units'] += 1
+                if ident in seen_values:
+                    if seen_values[ident] == record.raw:
+                        report['duplicates'] += 1
+                    else:
+                        report['conflicts'] += 1
+                    continue
+                seen_values[ident] = record.raw
+                reg_units[index].append(record)
+        else:
+            for command in _bat_commands(lines):
+                report['units'] += 1
+                normalized = ' '.join(command.lower().split())
+                if normalized in seen_commands:
+                    report['duplicates'] += 1
+                    continue
+                seen_commands.add(normalized)
+                bat_units[index].append(command)
+
+    # Отбор по приоритету с учётом бюджета
+    # (разделитель с именем файла учитывается вместе с первой единицей файла)
+    kept_reg = [[] for _ in files]
+    kept_bat = [[] for _ in files]
+    for index, records in enumerate(reg_units):
+        # Ключ последнего оставленного значения: как и при сборке текста,
+        # заголовок не повторяется только для значений подряд того же ключа
+        current_key = None
+        for record in records:
+            line = _reg_line(record)
+            if line is None:
+                text = f'[-{record.key}]\n'
+            elif record.key == current_key:
+                text = line + '\n'
+            else:
+                text = f'[{record.key}]\n{line}\n'
+            if not kept_reg[index]:
+                text = f'\n; --- {files[index]["name"]} ---\n' + text
+            if budget.fits(text):
+                budget.take(text)
+                kept_reg[index].append(record)
+                current_key = None if line is None else record.key
+            else:
+                report['dropped'] += 1
+    for index, commands in enumerate(bat_units):
+        for command in commands:
+            text = command + '\n'
+            if not kept_bat[index]:
+                text = f'\n:: --- {files[index]["name"]} ---\n' + text
+            if budget.fits(text):
+                budget.take(text)
+                kept_bat[index].append(command)
+            else:
+                report['dropped'] += 1
+
+    # Сборка текста в порядке файлов
+    parts = []
+    for index, entry in enumerate(files):
+        if kept_reg[index]:
+            parts.append(f'\n; --- {entry["name"]} ---\n')
+            current_key = None
+            for record in kept_reg[index]:
+                line = _reg_line(record)
+                if line is None:
+                    parts.append(f'[-{record.key}]\n')
+                    current_key = None
+                    continue
+                if record.key != current_key:
+                    parts.append(f'[{record.key}]\n')
+                    current_key = record.key
+                parts.append(line + '\n')
+        elif kept_bat[index]:
+            parts.append(f'\n:: --- {entry["name"]} ---\n')
+            parts.extend(command + '\n' for command in kept_bat[index])
+        elif reg_units[index] or bat_units[index]:
+            report['dropped_files'].append(entry['name'])
+    text = ''.join(parts)
+    report['kept'] = sum(map(len, kept_reg)) + sum(map(len, kept_bat))
+    report['bytes'] = len(text.encode('utf-8'))
+    report['tokens'] = estimate_tokens(text)
+    logger.info(f"Примеры для промпта: файлов {report['files']}, единиц {report['units']}, оставлено {report['kept']}, "
+                f"дубликатов {report['duplicates']}, конфликтов {report['conflicts']}, отброшено по бюджету {report['dropped']}, "
+                f"~{report['tokens']} токенов ({report['bytes']} байт)")
+    return text, report
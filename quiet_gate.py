@@ -0,0 +1,160 @@
+import os
+import time
+import logging
+from collections import namedtuple
+
+from startup_profile import lazy_import
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CPU_PERCENT = 10.0
+DEFAULT_DISK_MB = 5.0
+DEFAULT_NEW_PROCESSES = 2
+DEFAULT_INTERVAL = 0.25
+DEFAULT_QUIET_SAMPLES = 3
+DEFAULT_TIMEOUT = 30.0
+
+# Состояние системы за один интервал опроса:
+#   cpu           — загрузка всех ядер, %
+#   disk_mb       — чтение и запись дисков, МБ/с
+#   new_processes — сколько процессов появилось (кроме наших потомков)
+QuietSample = namedtuple('QuietSample', 'cpu disk_mb new_processes')
+
+# Итог ожидания перед замером:
+#   waited  — сколько секунд ждали
+#   quiet   — True, если дождались тишины, False — вышли по таймауту
+#   samples — сколько раз опрашивали систему
+#   last    — последний QuietSample (условия, при которых начат замер)
+#   peak    — максимумы каждого показателя за время ожидания (QuietSample)
+QuietWait = namedtuple('QuietWait', 'waited quiet samples last peak')
+
+
+def parse_cores(text):
+    """Список ядер из строки вида '2,3' или '0-3,6'; пустая строка — None"""
+    cores = []
+    for part in (text or '').replace(' ', '').split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(cores)) or None
+
+
+def pin_affinity(cores, process=None):
+    """Закрепляет процесс (по умолчанию текущий) за ядрами cores.
+
+    Дочерние процессы наследуют привязку при запуске. Возвращает прежний
+    список ядер или None, если привязка не поддерживается.
+    """
+    psutil = lazy_import('psutil')
+    process = process or psutil.Process()
+    if not hasattr(process, 'cpu_affinity'):
+        logger.warning("Привязка к ядрам не поддерживается в этой ОС")
+        return None
+    available = list(range(psutil.cpu_count(logical=True) or 1))
+    cores = [core for core in cores if core in available]
+    if not cores:
+        logger.warning(f"Нет ни одного из указанных ядер (доступны {available[0]}–{available[-1]})")
+        return None
+    previous = process.cpu_affinity()
+    process.cpu_affinity(cores)
+    logger.info(f"Процесс {process.pid} закреплён за ядрами {cores} (было {previous})")
+    return previous
+
+
+class QuietGate:
+    """Ждёт, пока система успокоится, перед каждым замером.
+
+    Каждые interval секунд снимаются загрузка процессора, поток
+    ввода-вывода дисков и число новых процессов. Система считается
+    спокойной, когда quiet_samples опросов подряд все показатели ниже
+    порогов. Если за timeout секунд этого не случилось, замер всё равно
+    начинается, но в QuietWait это отмечено (quiet=False).
+    """
+
+    def __init__(self, cpu_percent=DEFAULT_CPU_PERCENT, disk_mb=DEFAULT_DISK_MB,
+                 new_processes=DEFAULT_NEW_PROCESSES, interval=DEFAULT_INTERVAL,
+                 quiet_samples=DEFAULT_QUIET_SAMPLES, timeout=DEFAULT_TIMEOUT,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.psutil = lazy_import('psutil')
+        self.cpu_percent = cpu_percent
+        self.disk_mb = disk_mb
+        self.new_processes = new_processes
+        self.interval = interval
+        self.quiet_samples = max(1, quiet_samples)
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.waits = []
+        self._pids = None
+        self._disk = None
+        self._time = None
+
+    def _disk_bytes(self):
+        counters = self.psutil.disk_io_counters()
+        return (counters.read_bytes + counters.write_bytes) if counters else 0
+
+    def _own_tree(self):
+        try:
+            me = self.psutil.Process(os.getpid())
+            return {me.pid} | {child.pid for child in me.children(recursive=True)}
+        except self.psutil.Error:
+            return {os.getpid()}
+
+    def _start(self):
+        # Точка отсчёта: следующий sample() покажет средние за интервал
+        self.psutil.cpu_percent(interval=None)
+        self._pids = set(self.psutil.pids())
+        self._disk = self._disk_bytes()
+        self._time = self.clock()
+
+    def sample(self):
+        """Показатели с прошлого опроса"""
+        now = self.clock()
+        cpu = self.psutil.cpu_percent(interval=None)
+        disk = self._disk_bytes()
+        pids = set(self.psutil.pids())
+        elapsed = max(now - self._time, 1e-6)
+        new = len(pids - self._pids - self._own_tree())
+        result = QuietSample(cpu, (disk - self._disk) / elapsed / (1024 * 1024), new)
+        self._pids, self._disk, self._time = pids, disk, now
+        return result
+
+    def is_quiet(self, sample):
+        return (sample.cpu <= self.cpu_percent and sample.disk_mb <= self.disk_mb
+                and sample.new_processes <= self.new_processes)
+
+    def wait(self, label=''):
+        """Блокирует до тишины или таймаута; возвращает QuietWait"""
+        start = self.clock()
+        self._start()
+        streak = 0
+        count = 0
+        last = peak = QuietSample(0.0, 0.0, 0)
+        while True:
+            self.sleep(self.interval)
+            last = self.sample()
+            count += 1
+            peak = QuietSample(*(max(a, b) for a, b in zip(peak, last)))
+            streak = streak + 1 if self.is_quiet(last) else 0
+            if streak >= self.quiet_samples:
+                quiet = True
+                break
+            if self.clock() - start >= self.timeout:
+                quiet = False
+                break
+        result = QuietWait(self.clock() - start, quiet, count, last, peak)
+        self.waits.append(result)
+        conditions = (f"CPU {last.cpu:.0f}%, диск {last.disk_mb:.1f} МБ/с, новых процессов {last.new_processes}; "
+                      f"максимум CPU {peak.cpu:.0f}%, диск {peak.disk_mb:.1f} МБ/с, процессов {peak.new_processes}")
+        if quiet:
+            logger.info(f"Система спокойна{' перед ' + label if label else ''} через {result.waited:.1f} сек: {conditions}")
+        else:
+            logger.warning(f"Система не успокоилась за {self.timeout:.0f} сек"
+                           f"{' перед ' + label if label else ''}, замер начат: {conditions}")
+        return result
+
+    def summary(self, since=0):
+        """(всего секунд ожидания, число ожиданий, из них по таймауту) начиная с waits[since]"""
+        waits = self.waits[since:]
+        return sum(w.waited for w in waits), len(waits), sum(1 for w in waits if not w.quiet)
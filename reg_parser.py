@@ -0,0 +1,250 @@
+import io
+import os
+import codecs
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько байт читается для определения кодировки
+SNIFF_SIZE = 64 * 1024
+
+REG_HEADERS = ('Windows Registry Editor', 'REGEDIT4')
+
+# Запись .reg файла:
+#   kind  — 'key' (заголовок ключа), 'delete_key' ([-ключ]), 'value' или 'delete_value' ("имя"=-)
+#   key   — полный путь ключа
+#   name  — имя значения ('' для значения по умолчанию @), None для записей ключа
+#   type  — REG_SZ, REG_DWORD, REG_BINARY, REG_QWORD, REG_EXPAND_SZ, REG_MULTI_SZ, REG_NONE или hex(N)
+#   data  — str для REG_SZ, int для REG_DWORD, bytes для hex-типов
+#   raw   — текст после '=' с объединёнными строками продолжения
+#   line  — номер первой строки записи
+RegRecord = namedtuple('RegRecord', 'kind key name type data raw line')
+
+HEX_TYPES = {
+    None: 'REG_BINARY',
+    '0': 'REG_NONE',
+    '2': 'REG_EXPAND_SZ',
+    '7': 'REG_MULTI_SZ',
+    'b': 'REG_QWORD',
+}
+
+
+def sniff_encoding(head):
+    """Определяет кодировку по BOM и первым байтам файла"""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith(codecs.BOM_UTF16_LE):
+        return 'utf-16'
+    if head.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    # UTF-16 без BOM: у ASCII-текста каждый второй байт нулевой
+    if len(head) >= 4 and head[1::2].count(0) > len(head) // 4:
+        return 'utf-16-le'
+    if len(head) >= 4 and head[0::2].count(0) > len(head) // 4:
+        return 'utf-16-be'
+    try:
+        # Последний символ мог быть обрезан границей блока
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+def detect_encoding(path):
+    with open(path, 'rb') as f:
+        return sniff_encoding(f.read(SNIFF_SIZE))
+
+
+def open_text(source, encoding=None):
+    """Открывает файл или бинарный поток как текст с определённой кодировкой.
+
+    Кодировка определяется один раз по началу файла. Если дальше встретится
+    некорректный байт, он заменяется, а не приводит к повторному чтению.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        stream = open(source, 'rb')
+    else:
+        stream = source
+    if encoding is None:
+        if hasattr(stream, 'peek'):
+            head = stream.peek(SNIFF_SIZE)[:SNIFF_SIZE]
+        else:
+            position = stream.tell()
+            head = stream.read(SNIFF_SIZE)
+            stream.seek(position)
+        encoding = sniff_encoding(head)
+    return io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline=None)
+
+
+def iter_lines(source, encoding=None):
+    """Построчно читает файл без загрузки его целиком в память"""
+    with open_text(source, encoding) as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def read_head(source, count=10):
+    """Возвращает первые count строк файла"""
+    lines = []
+    for line in iter_lines(source):
+        lines.append(line)
+        if len(lines) >= count:
+            break
+    return lines
+
+
+def _parse_quoted(text, start):
+    """Разбирает строку в кавычках, начиная с позиции открывающей кавычки.
+
+    Возвращает (значение, позиция после закрывающей кавычки) или (None, start).
+    """
+    chars = []
+    i = start + 1
+    while i < len(text):
+        ch = text[i]
+        if ch == '\\' and i + 1 < len(text):
+            chars.append(text[i + 1])
+            i += 2
+            continue
+        if ch == '"':
+            return ''.join(chars), i + 1
+        chars.append(ch)
+        i += 1
+    return None, start
+
+
+def _parse_hex_bytes(text):
+    text = text.replace(' ', '').replace('\t', '').strip(',')
+    if not text:
+        return b''
+    return bytes(int(part, 16) for part in text.split(','))
+
+
+def parse_value(raw):
+    """Разбирает текст значения после '=' и возвращает (тип, данные)"""
+    raw = raw.strip()
+    if raw == '-':
+        return 'DELETE', None
+    if raw.startswith('"'):
+        value, end = _parse_quoted(raw, 0)
+        if value is None:
+            raise ValueError(f"Незакрытая строка: {raw}")
+        return 'REG_SZ', value
+    lowered = raw.lower()
+    if lowered.startswith('dword:'):
+        return 'REG_DWORD', int(raw[len('dword:'):].strip(), 16)
+    if lowered.startswith('hex'):
+        prefix, _, data = raw.partition(':')
+        kind = None
+        if prefix.lower().startswith('hex(') and prefix.endswith(')'):
+            kind = prefix[4:-1].lower()
+        reg_type = HEX_TYPES.get(kind, f'hex({kind})')
+        return reg_type, _parse_hex_bytes(data)
+    raise ValueError(f"Неизвестный формат значения: {raw}")
+
+
+def _logical_lines(lines):
+    """Объединяет строки продолжения (оканчивающиеся на '\\') в одну"""
+    buffer = None
+    start_line = 0
+    for number, line in enumerate(lines, 1):
+        stripped = line.rstrip('\r')
+        if buffer is not None:
+            buffer += stripped.strip()
+        else:
+            buffer = stripped
+            start_line = number
+        if buffer.endswith('\\') and not buffer.lstrip().startswith(';'):
+            buffer = buffer[:-1]
+            continue
+        yield start_line, buffer
+        buffer = None
+    if buffer is not None:
+        yield start_line, buffer
+
+
+def iter_records(lines, strict=False):
+    """Генератор записей RegRecord из строк .reg файла.
+
+    Память ограничена одной логической строкой, поэтому подходит для
+    многосотмегабайтных экспортов. Некорректные строки пропускаются
+    (или вызывают ValueError при strict=True).
+    """
+    key = None
+    for number, line in _logical_lines(lines):
+        text = line.strip()
+        if not text or text.startswith(';'):
+            continue
+        if text.startswith(REG_HEADERS):
+            continue
+        if text.startswith('['):
+            if not text.endswith(']'):
+                if strict:
+                    raise ValueError(f"Строка {number}: некорректный ключ {text}")
+                continue
+            path = text[1:-1].strip()
+            if path.startswith('-'):
+                key = None
+                yield RegRecord('delete_key', path[1:].strip(), None, None, None, None, number)
+            else:
+                key = path
+                yield RegRecord('key', key, None, None, None, None, number)
+            continue
+        if key is None:
+            if strict:
+                raise ValueError(f"Строка {number}: значение вне ключа")
+            continue
+        try:
+            if text.startswith('@'):
+                name, rest = '', text[1:]
+            elif text.startswith('"'):
+                name, end = _parse_quoted(text, 0)
+                if name is None:
+                    raise ValueError("незакрытое имя значения")
+                rest = text[end:]
+            else:
+                raise ValueError("ожидалось имя значения")
+            rest = rest.lstrip()
+            if not rest.startswith('='):
+                raise ValueError("ожидался '='")
+            raw = rest[1:].strip()
+            reg_type, data = parse_value(raw)
+        except ValueError as e:
+            if strict:
+                raise ValueError(f"Строка {number}: {e}")
+            logger.debug(f"Пропущена строка {number}: {e}")
+            continue
+        kind = 'delete_value' if reg_type == 'DELETE' else 'value'
+        yield RegRecord(kind, key, name, reg_type, data, raw, number)
+
+
+def iter_file_records(source, strict=False):
+    """Потоково разбирает .reg файл (путь или бинарный поток)"""
+    return iter_records(iter_lines(source), strict)
+
+
+# Сокращённые имена корневых разделов (как в reg.exe)
+ROOT_ALIASES = {
+    'HKLM': 'HKEY_LOCAL_MACHINE',
+    'HKCU': 'HKEY_CURRENT_USER',
+    'HKCR': 'HKEY_CLASSES_ROOT',
+    'HKU': 'HKEY_USERS',
+    'HKCC': 'HKEY_CURRENT_CONFIG',
+}
+
+
+def normalize_key_path(path):
+    """Приводит путь ключа к полному виду: HKLM\\X -> HKEY_LOCAL_MACHINE\\X"""
+    path = path.strip().strip('\\')
+    root, sep, rest = path.partition('\\')
+    root = ROOT_ALIASES.get(root.upper(), root.upper())
+    return f'{root}{sep}{rest}'
+
+
+def format_value_line(name, raw):
+    """Строка значения .reg: "имя"=данные или @=данные для значения по умолчанию"""
+    if name == '':
+        return f'@={raw}'
+    escaped = name.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"={raw}'
@@ -0,0 +1,399 @@
+import os
+import re
+import struct
+import logging
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from reg_parser import RegRecord, iter_records, iter_file_records, normalize_key_path, format_value_line, parse_value
+
+logger = logging.getLogger(__name__)
+
+REG_HEADER = 'Windows Registry Editor Version 5.00'
+EXPORT_WORKERS = 8
+EXPORT_TIMEOUT = 60
+SERVICES_KEY = 'HKEY_LOCAL_MACHINE\\SYSTEM\\CurrentControlSet\\Services'
+
+# Тип запуска службы (sc config start=) -> значение Start в ключе службы
+SERVICE_START = {'boot': 0, 'system': 1, 'auto': 2, 'demand': 3, 'disabled': 4, 'delayed-auto': 2}
+
+BAT_TOKEN = re.compile(r'"[^"]*"|\S+')
+
+# Значение ключа: name — имя как в файле ('' для @), type/data — как в RegRecord
+RegValue = namedtuple('RegValue', 'name type data raw')
+
+# Изменение реестра после твика:
+#   kind   — 'create_key', 'delete_key', 'set_value' или 'delete_value'
+#   key    — путь ключа
+#   name   — имя значения (None для изменений ключа)
+#   before — RegValue до твика или None; after — после твика или None
+RegChange = namedtuple('RegChange', 'kind key name before after')
+
+# Результат построения отката:
+#   text    — .reg, возвращающий реестр к состоянию до твика ('' если менять нечего)
+#   changes — список RegChange
+#   skipped — команды .bat, действие которых по реестру не откатить
+UndoPlan = namedtuple('UndoPlan', 'text changes skipped')
+
+
+def _ident(path):
+    return normalize_key_path(path).lower()
+
+
+def _parent(ident):
+    return ident.rpartition('\\')[0]
+
+
+def _within(ident, scope):
+    return ident == scope or ident.startswith(scope + '\\')
+
+
+class VirtualRegistry:
+    """Модель части реестра в памяти.
+
+    Хранит ключи только внутри загруженных областей (scopes) — поддеревьев,
+    которые затрагивает твик. Внутри области отсутствие ключа означает,
+    что его нет; о ключах вне областей модель ничего не знает и считает,
+    что они существуют, поэтому откат никогда не удаляет такие ключи.
+    Имена ключей и значений, как и в Windows, не различают регистр.
+    """
+
+    def __init__(self, scopes=()):
+        self.keys = {}      # идентификатор ключа -> {'path', 'values': {имя в нижнем регистре -> RegValue}}
+        self.scopes = {}    # идентификатор области -> путь
+        for scope in scopes:
+            self.scopes[_ident(scope)] = normalize_key_path(scope)
+
+    def in_scope(self, ident):
+        return any(_within(ident, scope) for scope in self.scopes)
+
+    def exists(self, ident):
+        if ident in self.keys:
+            return True
+        return not self.in_scope(ident)
+
+    def load(self, records):
+        """Загружает экспорт реестра; записи вне областей пропускаются"""
+        count = 0
+        for record in records:
+            ident = _ident(record.key)
+            if not self.in_scope(ident):
+                continue
+            if record.kind == 'key':
+                self._ensure(record.key)
+            elif record.kind == 'value':
+                self._ensure(record.key)['values'][record.name.lower()] = \
+                    RegValue(record.name, record.type, record.data, record.raw)
+                count += 1
+        logger.info(f"Модель реестра: загружено ключей {len(self.keys)}, значений {count} "
+                    f"в {len(self.scopes)} областях")
+        return self
+
+    def _ensure(self, path):
+        path = normalize_key_path(path)
+        ident = path.lower()
+        key = self.keys.get(ident)
+        if key is None:
+            key = self.keys[ident] = {'path': path, 'values': {}}
+            # Как regedit, создаём и недостающих предков (внутри областей)
+            parent = _parent(ident)
+            if parent and self.in_scope(parent) and parent not in self.keys:
+                self._ensure(path.rpartition('\\')[0])
+        return key
+
+    def apply(self, records):
+        """Применяет записи .reg (или переведённые команды .bat) по порядку"""
+        for record in records:
+            ident = _ident(record.key)
+            if record.kind == 'delete_key':
+                for other in [k for k in self.keys if _within(k, ident)]:
+                    del self.keys[other]
+            elif record.kind == 'key':
+                self._ensure(record.key)
+            elif record.kind == 'value':
+                self._ensure(record.key)['values'][record.name.lower()] = \
+                    RegValue(record.name, record.type, record.data, record.raw)
+            elif record.kind == 'delete_value':
+                key = self.keys.get(ident)
+                if key is not None:
+                    key['values'].pop(record.name.lower(), None)
+            elif record.kind == 'delete_all_values':
+                key = self.keys.get(ident)
+                if key is not None:
+                    key['values'].clear()
+        return self
+
+    def copy(self):
+        other = VirtualRegistry()
+        other.scopes = dict(self.scopes)
+        other.keys = {ident: {'path': key['path'], 'values': dict(key['values'])} for ident, key in self.keys.items()}
+        return other
+
+    def diff(self, after):
+        """Изменения от этого состояния (до твика) к after"""
+        changes = []
+        for ident in sorted(set(self.keys) | set(after.keys)):
+            old = self.keys.get(ident)
+            new = after.keys.get(ident)
+            if old is None:
+                changes.append(RegChange('create_key', new['path'], None, None, None))
+                for value in new['values'].values():
+                    changes.append(RegChange('set_value', new['path'], value.name, None, value))
+                continue
+            if new is None:
+                changes.append(RegChange('delete_key', old['path'], None, None, None))
+                continue
+            for name in sorted(set(old['values']) | set(new['values'])):
+                before = old['values'].get(name)
+                value = new['values'].get(name)
+                if value is None:
+                    changes.append(RegChange('delete_value', old['path'], before.name, before, None))
+                elif before is None or (before.type, before.data) != (value.type, value.data):
+                    changes.append(RegChange('set_value', old['path'], value.name, before, value))
+        return changes
+
+    def undo_text(self, after):
+        """.reg, который возвращает реестр из состояния after к этому"""
+        deletes = []
+        restores = {}
+        for ident in sorted(set(self.keys) | set(after.keys)):
+            old = self.keys.get(ident)
+            new = after.keys.get(ident)
+            if old is None:
+                # Удаляем только самый верхний созданный ключ
+                parent = _parent(ident)
+                if self.exists(parent) or not parent:
+                    deletes.append(new['path'])
+                continue
+            lines = restores.setdefault(ident, (old['path'], []))[1]
+            if new is None:
+                lines.extend(format_value_line(v.name, v.raw) for v in old['values'].values())
+                continue
+            for name in sorted(set(old['values']) | set(new['values'])):
+                before = old['values'].get(name)
+                value = new['values'].get(name)
+                if before is None:
+                    lines.append(format_value_line(value.name, '-'))
+                elif value is None or (before.type, before.data) != (value.type, value.data):
+                    lines.append(format_value_line(before.name, before.raw))
+        blocks = [f'[-{path}]' for path in deletes]
+        for ident, (path, lines) in restores.items():
+            # Ключ, удалённый твиком, восстанавливается даже без значений
+            if lines or ident not in after.keys:
+                blocks.append('\r\n'.join([f'[{path}]'] + lines))
+        if not blocks:
+            return ''
+        return '\r\n\r\n'.join([REG_HEADER] + blocks) + '\r\n'
+
+
+def scopes_for(records):
+    """Поддеревья, которые затрагивают записи, без вложенных друг в друга"""
+    scopes = {}
+    for record in records:
+        scopes.setdefault(_ident(record.key), normalize_key_path(record.key))
+    result = []
+    for ident in sorted(scopes):
+        if result and _within(ident, result[-1][0]):
+            continue
+        result.append((ident, scopes[ident]))
+    return [path for _, path in result]
+
+
+def _unquote(token):
+    return token[1:-1] if len(token) >= 2 and token[0] == token[-1] == '"' else token
+
+
+def _bat_value(reg_type, data):
+    """(тип, данные, raw) для reg add /t тип /d данные в формате .reg"""
+    reg_type = (reg_type or 'REG_SZ').upper()
+    if reg_type == 'REG_DWORD':
+        value = int(data or '0', 0) & 0xFFFFFFFF
+        return reg_type, value, f'dword:{value:08x}'
+    if reg_type == 'REG_SZ':
+        raw = '"' + (data or '').replace('\\', '\\\\').replace('"', '\\"') + '"'
+        return parse_value(raw) + (raw,)
+    if reg_type == 'REG_QWORD':
+        payload, prefix = struct.pack('<Q', int(data or '0', 0) & 0xFFFFFFFFFFFFFFFF), 'hex(b):'
+    elif reg_type == 'REG_EXPAND_SZ':
+        payload, prefix = ((data or '') + '\0').encode('utf-16-le'), 'hex(2):'
+    elif reg_type == 'REG_MULTI_SZ':
+        parts = (data or '').split('\\0')
+        payload, prefix = ('\0'.join(parts) + '\0\0').encode('utf-16-le'), 'hex(7):'
+    elif reg_type == 'REG_BINARY':
+        text = data or ''
+        payload, prefix = bytes.fromhex(text), 'hex:'
+    elif reg_type == 'REG_NONE':
+        payload, prefix = b'', 'hex(0):'
+    else:
+        raise ValueError(f"неизвестный тип {reg_type}")
+    raw = prefix + ','.join(f'{b:02x}' for b in payload)
+    return parse_value(raw) + (raw,)
+
+
+def _parse_bat_command(command, number):
+    """Записи RegRecord, которые делает команда reg add/delete или sc config start=; None — не реестр"""
+    tokens = BAT_TOKEN.findall(command.lstrip('@'))
+    if len(tokens) < 3:
+        return None
+    program = tokens[0].lower()
+    action = tokens[1].lower()
+    if program in ('sc', 'sc.exe') and action == 'config':
+        start = None
+        for i, token in enumerate(tokens[3:], 3):
+            lowered = token.lower()
+            if lowered == 'start=' and i + 1 < len(tokens):
+                start = tokens[i + 1].lower()
+            elif lowered.startswith('start=') and len(lowered) > len('start='):
+                start = lowered[len('start='):]
+        if start is None:
+            return None
+        if start not in SERVICE_START:
+            raise ValueError(f"неизвестный тип запуска {start}")
+        key = f'{SERVICES_KEY}\\{_unquote(tokens[2])}'
+        value = SERVICE_START[start]
+        records = [RegRecord('value', key, 'Start', 'REG_DWORD', value, f'dword:{value:08x}', number)]
+        delayed = 1 if start == 'delayed-auto' else 0
+        records.append(RegRecord('value', key, 'DelayedAutostart', 'REG_DWORD', delayed, f'dword:{delayed:08x}', number))
+        return records
+    if program not in ('reg', 'reg.exe') or action not in ('add', 'delete'):
+        return None
+    key = _unquote(tokens[2])
+    name = reg_type = data = None
+    all_values = False
+    i = 3
+    while i < len(tokens):
+        option = tokens[i].lower()
+        argument = _unquote(tokens[i + 1]) if i + 1 < len(tokens) else None
+        if option == '/v':
+            name, i = argument, i + 2
+        elif option == '/ve':
+            name, i = '', i + 1
+        elif option == '/va':
+            all_values, i = True, i + 1
+        elif option == '/t':
+            reg_type, i = argument, i + 2
+        elif option == '/d':
+            data, i = argument, i + 2
+        elif option in ('/s', '/reg:32', '/reg:64') or option.startswith('/f'):
+            i += 2 if option == '/s' else 1
+        else:
+            raise ValueError(f"неизвестный параметр {tokens[i]}")
+    if action == 'delete':
+        if all_values:
+            return [RegRecord('delete_all_values', key, None, None, None, None, number)]
+        if name is None:
+            return [RegRecord('delete_key', key, None, None, None, None, number)]
+        return [RegRecord('delete_value', key, name, 'DELETE', None, '-', number)]
+    if name is None:
+        return [RegRecord('key', key, None, None, None, None, number)]
+    value_type, value, raw = _bat_value(reg_type, data)
+    return [RegRecord('key', key, None, None, None, None, number),
+            RegRecord('value', key, name, value_type, value, raw, number)]
+
+
+def bat_records(text):
+    """Переводит reg add/delete и sc config start= из .bat в записи реестра.
+
+    Возвращает (записи, пропущенные команды): прочие команды (schtasks,
+    powercfg, удаление файлов и т. п.) через реестр не откатить.
+    """
+    records = []
+    skipped = []
+    for number, line in enumerate((text or '').splitlines(), 1):
+        command = line.strip()
+        lowered = command.lower()
+        if not command or lowered in ('@echo off', 'echo off', 'rem') or lowered.startswith(('rem ', '::', '@rem ', 'echo ')):
+            continue
+        try:
+            parsed = _parse_bat_command(command, number)
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Строка {number} .bat не разобрана для отката: {e}")
+            parsed = None
+        if parsed is None:
+            skipped.append(command)
+        else:
+            records.extend(parsed)
+    return records, skipped
+
+
+def key_exists(key):
+    """Есть ли ключ в реестре (64-битное представление, как у reg.exe).
+
+    Ключ без прав на чтение тоже существует: считать его отсутствующим
+    нельзя, иначе откат удалил бы его целиком.
+    """
+    import winreg
+    root, _, subkey = normalize_key_path(key).partition('\\')
+    try:
+        handle = winreg.OpenKey(getattr(winreg, root), subkey, 0, winreg.KEY_READ | winreg.KEY_WOW64_64KEY)
+    except FileNotFoundError:
+        return False
+    except PermissionError:
+        return True
+    winreg.CloseKey(handle)
+    return True
+
+
+def run_reg_export(key, path, exists=key_exists):
+    """Экспорт ключа с подключами через reg.exe; False, если ключа нет.
+
+    Любая другая ошибка экспорта (нет доступа, неверный путь) —
+    CalledProcessError: без состояния ключа откат строить нельзя.
+    """
+    command = ['reg', 'export', key, path, '/y']
+    result = subprocess.run(command, capture_output=True, timeout=EXPORT_TIMEOUT)
+    if result.returncode == 0 and os.path.exists(path):
+        return True
+    # Сообщение reg.exe зависит от языка системы, поэтому отсутствие ключа
+    # проверяется отдельно, а не по тексту ошибки
+    if result.returncode != 0 and not exists(key):
+        return False
+    raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+
+
+def export_scopes(scopes, directory, exporter=run_reg_export):
+    """Экспортирует области параллельно и по очереди отдаёт их записи.
+
+    Временные файлы экспорта удаляются после чтения. Ошибка экспорта
+    любой области (кроме отсутствия ключа) прерывает выгрузку целиком.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f'scope_{i}.reg') for i in range(len(scopes))]
+    try:
+        with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+            exported = list(pool.map(exporter, scopes, paths))
+    except Exception:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    for scope, path, ok in zip(scopes, paths, exported):
+        if not ok:
+            logger.info(f"Ключ {scope} не существует")
+            continue
+        try:
+            yield from iter_file_records(path)
+        finally:
+            os.remove(path)
+
+
+def derive_undo(reg_text, bat_text, load_scopes):
+    """Строит откат твика по модели реестра.
+
+    load_scopes(список путей) возвращает записи экспорта этих поддеревьев
+    в текущем (до твика) состоянии. Твик применяется к модели в том же
+    порядке, что и apply_tweaks (.reg, затем .bat), откат — точная
+    разница состояний до и после.
+    """
+    reg = list(iter_records((reg_text or '').splitlines()))
+    bat, skipped = bat_records(bat_text)
+    records = reg + bat
+    scopes = scopes_for(records)
+    before = VirtualRegistry(scopes)
+    if scopes:
+        before.load(load_scopes(scopes))
+    after = before.copy().apply(records)
+    changes = before.diff(after)
+    logger.info(f"Откат по модели реестра: изменений {len(changes)}, команд .bat без отката {len(skipped)}")
+    return UndoPlan(before.undo_text(after), changes, skipped)
@@ -0,0 +1,157 @@
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_DB = 'model_cache.db'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 7 * 24 * 3600
+COMPRESS_LEVEL = 6
+
+# Режимы кэша:
+#   off       — кэш не используется
+#   read      — только чтение, новые ответы не сохраняются
+#   readwrite — чтение и запись
+#   refresh   — кэш не читается, но свежие ответы перезаписывают старые
+CACHE_MODES = ('off', 'read', 'readwrite', 'refresh')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    created REAL NOT NULL,
+    expires REAL,
+    last_access REAL NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+)
+'''
+
+
+def normalize_prompt(prompt):
+    """Промпт без различий в пробелах и переводах строк"""
+    return ' '.join(prompt.split())
+
+
+def cache_key(model, prompt):
+    digest = hashlib.sha256()
+    digest.update(model.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(normalize_prompt(prompt).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Постоянный кэш ответов модели в SQLite.
+
+    Ключ — модель и хэш нормализованного промпта, ответ хранится сжатым zlib.
+    У каждой записи свой срок жизни (ttl, None — бессрочно). Если суммарный
+    размер превышает max_bytes, удаляются давно не читавшиеся записи.
+    Объект можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_DB, mode='readwrite', max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, clock=time.time):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Неизвестный режим кэша: {mode}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'writes': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._db = None
+        if mode != 'off':
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(SCHEMA)
+
+    @property
+    def readable(self):
+        return self.mode in ('read', 'readwrite')
+
+    @property
+    def writable(self):
+        return self.mode in ('readwrite', 'refresh')
+
+    def get(self, model, prompt):
+        """Ответ из кэша или None"""
+        if not self.readable:
+            return None
+        key = cache_key(model, prompt)
+        now = self.clock()
+        with self._lock:
+            row = self._db.execute('SELECT expires, data FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            expires, data = row
+            if expires is not None and expires <= now:
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                if self.writable:
+                    with self._db:
+                        self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            if self.writable:
+                with self._db:
+                    self._db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            self.stats['hits'] += 1
+        return zlib.decompress(data).decode('utf-8')
+
+    def put(self, model, prompt, response, ttl=None):
+        """Сохраняет ответ; ttl в секундах (по умолчанию ttl кэша)"""
+        if not self.writable:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        now = self.clock()
+        data = zlib.compress(response.encode('utf-8'), COMPRESS_LEVEL)
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses (key, model, created, expires, last_access, size, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (cache_key(model, prompt), model, now, now + ttl if ttl else None, now, len(data), data))
+                self.stats['writes'] += 1
+                self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?', (now,))
+        if not self.max_bytes:
+            return
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', victims)
+        self.stats['evicted'] += len(victims)
+
+    def usage(self):
+        """(число записей, суммарный сжатый размер)"""
+        if self._db is None:
+            return 0, 0
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+
+    def log_stats(self):
+        if self.mode == 'off':
+            return
+        count, size = self.usage()
+        logger.info(f"Кэш ответов модели ({self.mode}): попаданий {self.stats['hits']}, промахов {self.stats['misses']} "
+                    f"(из них устаревших {self.stats['expired']}), записано {self.stats['writes']}, "
+                    f"вытеснено {self.stats['evicted']}; записей {count}, {size / 1024:.1f} КБ")
+
+    def close(self):
+        if self._db is not None:
+            self.log_stats()
+            self._db.close()
+            self._db = None
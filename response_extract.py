@@ -0,0 +1,162 @@
+import os
+import logging
+from collections import namedtuple
+
+from code_fences import BLOCK_KINDS, scan_blocks
+from reg_parser import REG_HEADERS, ROOT_ALIASES, iter_records, normalize_key_path
+
+logger = logging.getLogger(__name__)
+
+REG_HEADER = 'Windows Registry Editor Version 5.00'
+REG_ROOTS = frozenset(ROOT_ALIASES.values())
+
+# Начала строк, по которым блок без метки опознаётся как .bat
+BAT_HINTS = ('@echo', 'echo ', 'rem ', '::', 'reg add', 'reg delete', 'reg.exe', 'sc ', 'sc.exe',
+             'net ', 'schtasks', 'powercfg', 'bcdedit', 'netsh', 'set ', 'setx ', 'taskkill', 'del ',
+             'dism ', 'fsutil ', 'if ', 'for ', 'call ', 'start ')
+
+# Результат проверки блока:
+#   block    — исходный CodeBlock
+#   kind     — 'reg', 'bat' или None (блок не относится к твикам)
+#   text     — текст для записи в файл (для .reg — с заголовком)
+#   errors   — причины, по которым блок нельзя применять
+#   warnings — замечания, не мешающие применению
+BlockCheck = namedtuple('BlockCheck', 'block kind text errors warnings')
+
+# Результат разбора ответа: reg и bat — выбранные годные блоки (BlockCheck)
+# или None; checks — проверки всех блоков; errors — почему не нашлось reg/bat.
+Extraction = namedtuple('Extraction', 'reg bat checks errors')
+
+
+def classify_block(block):
+    """Тип блока по метке, а для блоков без известной метки — по содержимому"""
+    first = next((line.strip() for line in block.text.splitlines() if line.strip()), '')
+    if first.startswith(REG_HEADERS):
+        return 'reg'
+    kind = BLOCK_KINDS.get(block.label)
+    if kind is not None or block.label not in ('', 'text', 'txt', 'plaintext'):
+        return kind
+    if first.startswith('[') and first.upper().lstrip('[-').startswith(('HKEY_', 'HKLM', 'HKCU')):
+        return 'reg'
+    if first.lower().startswith(BAT_HINTS):
+        return 'bat'
+    return None
+
+
+def check_reg(block):
+    errors = []
+    warnings = []
+    text = block.text
+    lines = text.splitlines()
+    first = next((line.strip() for line in lines if line.strip()), '')
+    if not first.startswith(REG_HEADERS):
+        warnings.append(f"нет заголовка, добавлен '{REG_HEADER}'")
+        text = f'{REG_HEADER}\n\n{text}'
+    counts = {'key': 0, 'delete_key': 0, 'value': 0, 'delete_value': 0}
+    try:
+        for record in iter_records(lines, strict=True):
+            counts[record.kind] += 1
+            if record.kind in ('key', 'delete_key'):
+                root = normalize_key_path(record.key).partition('\\')[0]
+                if root not in REG_ROOTS:
+                    errors.append(f"строка {record.line}: неизвестный корневой раздел {root}")
+    except ValueError as e:
+        errors.append(str(e))
+    if not errors:
+        if not counts['key'] and not counts['delete_key']:
+            errors.append("нет ни одного ключа реестра")
+        elif not counts['value'] and not counts['delete_value'] and not counts['delete_key']:
+            warnings.append("нет ни одного значения")
+    if not block.closed:
+        warnings.append("ответ оборвался внутри блока")
+    return BlockCheck(block, 'reg', text, errors, warnings)
+
+
+def check_bat(block):
+    errors = []
+    warnings = []
+    commands = []
+    for line in block.text.splitlines():
+        lowered = line.strip().lower()
+        if not lowered or lowered == 'rem' or lowered.startswith(('rem ', '::', '@rem ')):
+            continue
+        if lowered in ('@echo off', 'echo off'):
+            continue
+        commands.append(lowered)
+    if not commands:
+        errors.append("нет ни одной команды")
+    if any(command in ('pause', '@pause') for command in commands):
+        warnings.append("есть команда pause: применение будет ждать нажатия клавиши")
+    if not block.closed:
+        warnings.append("ответ оборвался внутри блока")
+    return BlockCheck(block, 'bat', block.text, errors, warnings)
+
+
+def check_block(block):
+    kind = classify_block(block)
+    if kind == 'reg':
+        return check_reg(block)
+    if kind == 'bat':
+        return check_bat(block)
+    return BlockCheck(block, None, block.text, [], [])
+
+
+def extract_blocks(blocks):
+    """Проверяет все блоки и выбирает первый годный блок каждого типа"""
+    checks = [check_block(block) for block in blocks]
+    chosen = {}
+    errors = []
+    for kind, name in (('reg', '.reg'), ('bat', '.bat/.cmd')):
+        candidates = [c for c in checks if c.kind == kind]
+        valid = [c for c in candidates if not c.errors]
+        if valid:
+            chosen[kind] = valid[0]
+        elif candidates:
+            reasons = '; '.join(f"блок в строке {c.block.line}: {', '.join(c.errors)}" for c in candidates)
+            errors.append(f"нет годного {name} кода ({reasons})")
+        else:
+            errors.append(f"в ответе нет блока {name} кода")
+    return Extraction(chosen.get('reg'), chosen.get('bat'), checks, errors)
+
+
+def extract_response(text):
+    """Разбирает готовый ответ модели за один проход"""
+    return extract_blocks(scan_blocks(text))
+
+
+def has_tweaks(text):
+    """Есть ли в ответе хотя бы один годный блок .reg или .bat"""
+    extraction = extract_response(text)
+    return extraction.reg is not None or extraction.bat is not None
+
+
+def finish_spooled(spooler):
+    """Проверяет ответ, записанный BlockSpooler, и оставляет только годные файлы.
+
+    Если годен блок, который уже записан в <путь>.part, файл просто
+    переименовывается; иначе записывается выбранный блок. Если годного
+    блока нет, файла этого типа после вызова не существует.
+    """
+    extraction = extract_blocks(spooler.blocks)
+    for kind, path in spooler.paths.items():
+        check = getattr(extraction, kind)
+        part = spooler.part_path(kind)
+        spooled = spooler.spooled.get(kind)
+        if check is not None and spooled is not None and check.block is spooler.blocks[spooled] \
+                and check.text == check.block.text:
+            os.replace(part, path)
+            continue
+        if os.path.exists(part):
+            os.remove(part)
+        if check is None:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(check.text + '\n')
+    for check in extraction.checks:
+        for warning in check.warnings:
+            logger.warning(f"Блок {check.kind} в строке {check.block.line}: {warning}")
+    for error in extraction.errors:
+        logger.warning(f"Ответ модели: {error}")
+    return extraction
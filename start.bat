@@ -1,23 +1,7 @@
 @echo off
 
-:: Укажите путь к 7za.exe, если он не находится в переменной PATH
-set "sevenZipPath=7za.exe"  
-set "archivePath=tweaks.7z"
-set "targetFolder=Brian"
-
-:: Проверка наличия папки Brian
-if exist "%targetFolder%" (
-    echo Папка "%targetFolder%" уже существует. Архив не будет распакован.
-    exit /b
-)
-
-:: Проверка наличия файла tweaks.7z
-if exist "%archivePath%" (
-    echo Распаковка архива %archivePath%...
-    "%sevenZipPath%" x "%archivePath%"
-    echo Архив успешно распакован.
-) else (
-    echo Файл %archivePath% не найден.
-)
+:: Твики читаются напрямую из tweaks.bundle без распаковки.
+:: Если его нет, main.exe один раз создаст его из tweaks.7z.
+:: Распакованная папка Brian, если она есть, используется вместо архива.
 
 launcher.exe main.exe
\ No newline at end of file
@@ -0,0 +1,76 @@
+import sys
+import time
+import importlib
+from contextlib import contextmanager
+
+# Момент начала работы интерпретатора (модуль импортируется первым)
+START_TIME = time.perf_counter()
+
+# Бюджет времени запуска по умолчанию (в миллисекундах)
+DEFAULT_BUDGET_MS = 1500
+
+
+class StartupProfiler:
+    """Замеряет время импорта тяжёлых библиотек и шагов инициализации"""
+
+    def __init__(self):
+        self.records = []
+
+    def import_module(self, name):
+        """Импортирует модуль, записывая время первого импорта"""
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self.records.append(('import', name, time.perf_counter() - start))
+        return module
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append(('step', name, time.perf_counter() - start))
+
+    def elapsed(self):
+        return time.perf_counter() - START_TIME
+
+    def bootstrap_time(self):
+        """Время от создания процесса до запуска Python-кода.
+
+        Для PyInstaller onefile считается от запуска загрузчика (родительского
+        процесса), который распаковывает архив во временную папку.
+        """
+        try:
+            psutil = self.import_module('psutil')
+            process = psutil.Process()
+            if getattr(sys, 'frozen', False) and process.parent() is not None:
+                process = process.parent()
+            return max(0.0, time.time() - (time.perf_counter() - START_TIME) - process.create_time())
+        except Exception:
+            return None
+
+    def report(self, budget_ms=DEFAULT_BUDGET_MS):
+        """Возвращает (строки отчёта, уложились ли в бюджет)"""
+        lines = []
+        for kind, name, duration in self.records:
+            label = 'импорт' if kind == 'import' else 'шаг'
+            lines.append(f"{duration * 1000:9.1f} мс  {label:6} {name}")
+        bootstrap = self.bootstrap_time()
+        total_ms = self.elapsed() * 1000
+        if bootstrap is not None:
+            lines.append(f"{bootstrap * 1000:9.1f} мс  запуск процесса и интерпретатора")
+            total_ms += bootstrap * 1000
+        within_budget = total_ms <= budget_ms
+        status = 'OK' if within_budget else 'ПРЕВЫШЕН'
+        lines.append(f"{total_ms:9.1f} мс  всего (бюджет {budget_ms} мс: {status})")
+        return lines, within_budget
+
+
+profiler = StartupProfiler()
+
+
+def lazy_import(name):
+    return profiler.import_module(name)
@@ -0,0 +1,216 @@
+import logging
+from collections import namedtuple
+
+from reg_parser import iter_records, format_value_line
+from batch_shell import parse_batch
+
+logger = logging.getLogger(__name__)
+
+REG_HEADER = 'Windows Registry Editor Version 5.00'
+DEFAULT_MAX_TRIALS = 30
+
+# Единица твика, которую можно применить отдельно:
+#   kind  — 'reg' (одна запись .reg) или 'bat' (одна команда .bat)
+#   key   — путь ключа для 'reg', None для 'bat'
+#   text  — строка значения (для удаления и создания ключа — '[-путь]'
+#           или '[путь]'), для 'bat' — команда
+#   label — подпись для отчётов
+TweakUnit = namedtuple('TweakUnit', 'index kind key text label')
+
+# Проверенное подмножество: passed — сохраняет ли оно выигрыш,
+# deltas — изменение медианы каждой метрики, сек (отрицательное — ускорение)
+Trial = namedtuple('Trial', 'units passed deltas')
+
+# Вклад единицы минимального набора: насколько метрики хуже без неё, сек
+# (отрицательное — единица ускоряет; None — не измерено)
+UnitEffect = namedtuple('UnitEffect', 'unit deltas')
+
+# Итог атрибуции:
+#   minimal  — минимальный найденный набор единиц, сохраняющий выигрыш
+#   trials   — сколько подмножеств измерено (без повторов из кэша)
+#   cached   — сколько раз результат взят из кэша
+#   effects  — список UnitEffect для minimal
+#   complete — False, если поиск остановлен по пределу числа замеров
+Attribution = namedtuple('Attribution', 'minimal trials cached effects complete')
+
+
+def split_units(reg_text, bat_text):
+    """Разбивает твик на единицы: записи .reg и команды .bat по порядку"""
+    units = []
+
+    def add(kind, key, text, label):
+        units.append(TweakUnit(len(units), kind, key, text, label))
+
+    pending_key = None
+    for record in iter_records((reg_text or '').splitlines()):
+        if record.kind in ('key', 'delete_key') and pending_key is not None:
+            # Ключ без значений — отдельная единица: твик его создаёт
+            add('reg', pending_key, f'[{pending_key}]', f'[{pending_key}]')
+        pending_key = None
+        if record.kind == 'key':
+            pending_key = record.key
+        elif record.kind == 'delete_key':
+            add('reg', record.key, f'[-{record.key}]', f'[-{record.key}]')
+        else:
+            line = format_value_line(record.name, record.raw)
+            add('reg', record.key, line, f'{record.key}\\{record.name or "@"}')
+    if pending_key is not None:
+        add('reg', pending_key, f'[{pending_key}]', f'[{pending_key}]')
+    if bat_text and bat_text.strip():
+        try:
+            commands = [command.text for command in parse_batch(bat_text, interactive=False)]
+        except ValueError as e:
+            # Сценарий с метками и переходами делится только целиком
+            logger.info(f".bat не делится на команды ({e}), он считается одной единицей")
+            commands = [bat_text.strip()]
+        for command in commands:
+            add('bat', None, command, command)
+    return units
+
+
+def build_scripts(units):
+    """(.reg, .bat) из набора единиц; None, если такой части в наборе нет"""
+    blocks = []
+    key = None
+    for unit in units:
+        if unit.kind != 'reg':
+            continue
+        if unit.text.startswith('['):
+            blocks.append([unit.text])
+            key = None
+            continue
+        if unit.key != key:
+            blocks.append([f'[{unit.key}]'])
+            key = unit.key
+        blocks[-1].append(unit.text)
+    commands = [unit.text for unit in units if unit.kind == 'bat']
+    reg = '\r\n\r\n'.join([REG_HEADER] + ['\r\n'.join(block) for block in blocks]) + '\r\n' if blocks else None
+    bat = '\r\n'.join(['@echo off'] + commands) + '\r\n' if commands else None
+    return reg, bat
+
+
+def keeps_gain(comparisons):
+    """Правило приёма твика, как для итерации: есть ускорение и нет замедлений.
+
+    Вердикты comparisons должны быть уже с поправкой на число метрик (holm).
+    """
+    verdicts = [c.verdict for c in comparisons.values()]
+    return 'better' in verdicts and 'worse' not in verdicts
+
+
+def _split(units, n):
+    size, extra = divmod(len(units), n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(units[start:end])
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+
+class DeltaDebugger:
+    """Поиск минимального набора единиц твика, сохраняющего выигрыш (ddmin).
+
+    evaluate(единицы) применяет набор, сравнивает метрики с эталоном и
+    откатывает его; возвращает {метрика: Comparison}. Каждое подмножество
+    меряется не больше одного раза: результаты хранятся по набору
+    индексов. Пустой набор — это эталон, он не меряется.
+
+    Полный твик уже принят итерацией и тоже не перемеряется. Если
+    пройдено max_trials замеров, поиск останавливается на текущем наборе.
+    """
+
+    def __init__(self, units, evaluate, accept=keeps_gain, max_trials=DEFAULT_MAX_TRIALS, full=None):
+        self.units = list(units)
+        self.evaluate = evaluate
+        self.accept = accept
+        self.max_trials = max_trials
+        self.trials = {frozenset(): Trial((), False, {})}
+        self.measured = 0
+        self.cached = 0
+        self.complete = False
+        if full is not None:
+            self.trials[frozenset(u.index for u in self.units)] = self._trial(self.units, full)
+
+    def _trial(self, units, comparisons):
+        deltas = {name: c.delta for name, c in comparisons.items()}
+        return Trial(tuple(units), self.accept(comparisons), deltas)
+
+    @property
+    def exhausted(self):
+        return self.measured >= self.max_trials
+
+    def test(self, units):
+        """Trial для набора; None, если он не измерен и замеры исчерпаны"""
+        key = frozenset(u.index for u in units)
+        trial = self.trials.get(key)
+        if trial is not None:
+            self.cached += 1
+            return trial
+        if self.exhausted:
+            return None
+        self.measured += 1
+        logger.info(f"Атрибуция: замер {self.measured}/{self.max_trials}, единиц {len(units)} из {len(self.units)}")
+        trial = self.trials[key] = self._trial(units, self.evaluate(list(units)))
+        logger.info(f"Атрибуция: набор из {len(units)} единиц {'сохраняет' if trial.passed else 'не сохраняет'} "
+                    f"выигрыш, Δ {', '.join(f'{k} {v:+.3f}' for k, v in trial.deltas.items() if v is not None)}")
+        return trial
+
+    def minimize(self):
+        current = self.units
+        n = 2
+        self.complete = True
+        while len(current) >= 2:
+            if self.exhausted:
+                self.complete = False
+                break
+            chunks = _split(current, n)
+            reduced = False
+            # Сначала ищем выигрыш в одной части, потом — без одной части
+            for chunk in chunks:
+                trial = self.test(chunk)
+                if trial is None:
+                    break
+                if trial.passed:
+                    current, n, reduced = chunk, 2, True
+                    break
+            if not reduced and len(chunks) > 2:
+                for i in range(len(chunks)):
+                    complement = [u for j, chunk in enumerate(chunks) if j != i for u in chunk]
+                    trial = self.test(complement)
+                    if trial is None:
+                        break
+                    if trial.passed:
+                        current, n, reduced = complement, max(n - 1, 2), True
+                        break
+            if not reduced:
+                if n >= len(current):
+                    break
+                n = min(len(current), n * 2)
+        return current
+
+    def effects(self, minimal):
+        """Вклад каждой единицы: метрики набора без неё минус метрики набора целиком"""
+        whole = self.test(minimal)
+        effects = []
+        for unit in minimal:
+            without = self.test([u for u in minimal if u.index != unit.index])
+            deltas = {}
+            for name, value in (whole.deltas if whole else {}).items():
+                if without is None or value is None:
+                    deltas[name] = None
+                else:
+                    # Без единицы метрика не меняется относительно эталона (пустой набор)
+                    deltas[name] = value - (without.deltas.get(name) or 0.0)
+            effects.append(UnitEffect(unit, deltas))
+        return effects
+
+    def run(self):
+        minimal = self.minimize()
+        complete = self.complete
+        effects = self.effects(minimal)
+        logger.info(f"Атрибуция: {len(minimal)} из {len(self.units)} единиц дают выигрыш; "
+                    f"замеров {self.measured}, из кэша {self.cached}"
+                    f"{'' if complete else ', остановлено по пределу замеров'}")
+        return Attribution(minimal, self.measured, self.cached, effects, complete)
@@ -0,0 +1,124 @@
+import time
+import random
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+BANDIT_DB = 'tweak_bandit.db'
+# Априорное Beta(1, 1): о файле без истории ничего не известно
+PRIOR_ALPHA = 1.0
+PRIOR_BETA = 1.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS arms (
+    fingerprint TEXT NOT NULL,
+    name TEXT NOT NULL,
+    pulls INTEGER NOT NULL,
+    wins REAL NOT NULL,
+    gain_sum REAL NOT NULL,
+    gain_count INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (fingerprint, name)
+);
+'''
+
+# Статистика файла твиков:
+#   pulls     — в скольких итерациях файл был выбран
+#   wins      — сумма наград (1 — твик итерации принят, 0 — нет)
+#   mean      — апостериорное среднее вероятности выигрыша
+#   mean_gain — среднее относительное ускорение метрик в этих итерациях
+#               (доля, положительная — быстрее; None — не измерялось)
+ArmStats = namedtuple('ArmStats', 'name pulls wins mean mean_gain')
+
+
+class TweakBandit:
+    """Многорукий бандит по файлам каталога твиков (сэмплирование Томпсона).
+
+    Рука — файл твиков. Когда модель выбирает файлы для итерации, каждый
+    из них получает награду итерации: 1, если твик принят, и 0, если нет.
+    Для ранжирования из апостериорного Beta каждого файла берётся случайная
+    оценка: файлы с хорошей историей поднимаются наверх, а файлы без истории
+    получают широкий разброс и тоже иногда оказываются в начале списка.
+
+    Статистика хранится в SQLite отдельно для каждого отпечатка системы
+    (fingerprint=None — сводно по всем системам).
+    """
+
+    def __init__(self, path=BANDIT_DB, fingerprint=None, seed=None, clock=time.time):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def _rows(self, names=None):
+        query = ('SELECT name, SUM(pulls), SUM(wins), SUM(gain_sum), SUM(gain_count) FROM arms'
+                 + ('' if self.fingerprint is None else ' WHERE fingerprint = ?') + ' GROUP BY name')
+        params = () if self.fingerprint is None else (self.fingerprint,)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        wanted = None if names is None else set(names)
+        return [row for row in rows if wanted is None or row[0] in wanted]
+
+    def stats(self, names=None):
+        """{имя: ArmStats} для файлов с историей"""
+        result = {}
+        for name, pulls, wins, gain_sum, gain_count in self._rows(names):
+            mean = (PRIOR_ALPHA + wins) / (PRIOR_ALPHA + PRIOR_BETA + pulls)
+            result[name] = ArmStats(name, pulls, wins, mean, gain_sum / gain_count if gain_count else None)
+        return result
+
+    def rank(self, names):
+        """Имена в порядке убывания сэмплированной вероятности выигрыша"""
+        stats = self.stats(names)
+        scores = {}
+        for name in names:
+            arm = stats.get(name)
+            pulls, wins = (arm.pulls, arm.wins) if arm else (0, 0.0)
+            scores[name] = self.rng.betavariate(PRIOR_ALPHA + wins, PRIOR_BETA + max(0.0, pulls - wins))
+        ranked = sorted(names, key=scores.__getitem__, reverse=True)
+        logger.info(f"Бандит: ранжировано файлов {len(names)}, с историей {len(stats)}; "
+                    f"первые: {', '.join(ranked[:5])}")
+        return ranked
+
+    def update(self, names, reward, gain=None):
+        """Награда reward (0..1) и относительное ускорение gain всем файлам итерации"""
+        reward = min(1.0, max(0.0, reward))
+        fingerprint = self.fingerprint or ''
+        with self._lock, self._db:
+            for name in dict.fromkeys(names):
+                self._db.execute(
+                    'INSERT INTO arms (fingerprint, name, pulls, wins, gain_sum, gain_count, updated) '
+                    'VALUES (?, ?, 1, ?, ?, ?, ?) '
+                    'ON CONFLICT(fingerprint, name) DO UPDATE SET pulls = pulls + 1, wins = wins + excluded.wins, '
+                    'gain_sum = gain_sum + excluded.gain_sum, gain_count = gain_count + excluded.gain_count, '
+                    'updated = excluded.updated',
+                    (fingerprint, name, reward, gain or 0.0, 0 if gain is None else 1, self.clock()))
+        logger.info(f"Бандит: награда {reward:.2f}"
+                    f"{'' if gain is None else f', ускорение {gain * 100:+.1f}%'} для {len(names)} файлов")
+
+    def top(self, limit=20):
+        """Файлы с наибольшим апостериорным средним"""
+        return sorted(self.stats().values(), key=lambda arm: (arm.mean, arm.pulls), reverse=True)[:limit]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iteration_gain(comparisons):
+    """Среднее относительное ускорение по метрикам (доля; None — сравнивать нечего)"""
+    gains = [-c.delta / c.before.median for c in comparisons.values()
+             if c.delta is not None and c.before.median]
+    return sum(gains) / len(gains) if gains else None
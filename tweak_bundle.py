@@ -0,0 +1,165 @@
+import io
+import os
+import sys
+import mmap
+import zlib
+import struct
+import hashlib
+import logging
+import tempfile
+import subprocess
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Формат файла tweaks.bundle:
+#   заголовок     <8sII   магия, число членов, размер таблицы
+#   таблица       для каждого члена <HQIIq16s (длина имени, смещение данных,
+#                 сжатый размер, исходный размер, mtime_ns, blake2b-хэш)
+#                 и имя в UTF-8
+#   данные        члены, сжатые zlib, по смещениям из таблицы
+MAGIC = b'AITWBND1'
+HEADER = struct.Struct('<8sII')
+ENTRY = struct.Struct('<HQIIq16s')
+COMPRESS_LEVEL = 9
+
+BUNDLE_FILE = 'tweaks.bundle'
+SEVEN_ZIP = '7za.exe'
+
+BundleMember = namedtuple('BundleMember', 'name offset compressed_size size mtime_ns digest')
+
+
+def member_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class TweakBundle:
+    """Индексированный архив твиков с произвольным доступом к членам.
+
+    Файл отображается в память, таблица смещений читается при открытии,
+    а каждый член распаковывается только при обращении к нему.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            self._file.close()
+            raise ValueError(f"{path}: пустой файл")
+        self.members = self._read_table()
+
+    def _read_table(self):
+        magic, count, table_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path}: не является архивом твиков")
+        members = {}
+        pos = HEADER.size
+        end = HEADER.size + table_size
+        for _ in range(count):
+            name_len, offset, compressed_size, size, mtime_ns, digest = ENTRY.unpack_from(self._map, pos)
+            pos += ENTRY.size
+            name = self._map[pos:pos + name_len].decode('utf-8')
+            pos += name_len
+            members[name] = BundleMember(name, offset, compressed_size, size, mtime_ns, digest)
+        if pos != end:
+            raise ValueError(f"{self.path}: повреждена таблица членов")
+        return members
+
+    def names(self):
+        return sorted(self.members)
+
+    def read(self, name):
+        member = self.members[name]
+        data = zlib.decompress(self._map[member.offset:member.offset + member.compressed_size])
+        if len(data) != member.size or member_digest(data) != member.digest:
+            raise ValueError(f"{self.path}: член {name} повреждён")
+        return data
+
+    def open(self, name):
+        return io.BytesIO(self.read(name))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_bundle(files, out_path):
+    """Записывает архив из списка (имя, путь к файлу)"""
+    members = []
+    blobs = []
+    for name, path in sorted(files):
+        with open(path, 'rb') as f:
+            data = f.read()
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        encoded_name = name.encode('utf-8')
+        members.append((encoded_name, len(compressed), len(data), os.stat(path).st_mtime_ns, member_digest(data)))
+        blobs.append(compressed)
+    table_size = sum(ENTRY.size + len(m[0]) for m in members)
+    offset = HEADER.size + table_size
+    temp_path = f'{out_path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(members), table_size))
+        for encoded_name, compressed_size, size, mtime_ns, digest in members:
+            f.write(ENTRY.pack(len(encoded_name), offset, compressed_size, size, mtime_ns, digest))
+            f.write(encoded_name)
+            offset += compressed_size
+        for blob in blobs:
+            f.write(blob)
+    os.replace(temp_path, out_path)
+    logger.info(f"Создан архив твиков {out_path}: {len(members)} файлов")
+    return len(members)
+
+
+def build_from_folder(folder, out_path=BUNDLE_FILE):
+    files = []
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, folder).replace(os.sep, '/')
+            files.append((name, path))
+    return write_bundle(files, out_path)
+
+
+def build_from_archive(archive_path, out_path=BUNDLE_FILE, seven_zip=SEVEN_ZIP):
+    """Конвертирует tweaks.7z в архив твиков (через 7za.exe или py7zr)"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            import py7zr
+            with py7zr.SevenZipFile(archive_path, 'r') as archive:
+                archive.extractall(temp_dir)
+        except ImportError:
+            result = subprocess.run([seven_zip, 'x', '-y', f'-o{temp_dir}', archive_path],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Ошибка распаковки {archive_path}: {result.stderr or result.stdout}")
+        root = temp_dir
+        # Архив обычно содержит одну папку (Brian) — берём её содержимое
+        entries = os.listdir(root)
+        if len(entries) == 1 and os.path.isdir(os.path.join(root, entries[0])):
+            root = os.path.join(root, entries[0])
+        return build_from_folder(root, out_path)
+
+
+def build_bundle(source, out_path=BUNDLE_FILE):
+    """Создаёт архив твиков из папки или из .7z архива"""
+    if os.path.isdir(source):
+        return build_from_folder(source, out_path)
+    return build_from_archive(source, out_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Использование: python {os.path.basename(__file__)} <папка или tweaks.7z> [{BUNDLE_FILE}]")
+        sys.exit(1)
+    out = sys.argv[2] if len(sys.argv) > 2 else BUNDLE_FILE
+    count = build_bundle(sys.argv[1], out)
+    print(f"Архив {out} создан: {count} файлов")
@@ -0,0 +1,225 @@
+import io
+import os
+import re
+import json
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from reg_parser import sniff_encoding, iter_lines, iter_records, normalize_key_path, SNIFF_SIZE
+from tweak_bundle import TweakBundle, member_digest
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DB = 'tweak_catalog.db'
+TWEAK_EXTENSIONS = ('.reg', '.bat', '.cmd')
+DESCRIPTION_LINES = 10
+
+# reg add / reg delete в .bat/.cmd файлах
+BAT_REG_COMMAND = re.compile(r'\breg(?:\.exe)?\s+(?:add|delete|import)\s+(?:"([^"]+)"|(\S+))', re.IGNORECASE)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    encoding TEXT,
+    description TEXT,
+    keys TEXT,
+    line_count INTEGER
+)
+'''
+
+
+def extract_description(lines, default):
+    """Описание твика — первый комментарий в первых строках файла"""
+    for line in lines[:DESCRIPTION_LINES]:
+        if line.strip().startswith((';', '::', 'REM')) and len(line.strip()) > 1:
+            return line.strip().lstrip(';:/').replace('REM', '').strip()
+    return default
+
+
+def scan_data(name, data):
+    """Собирает по содержимому файла всё, что нужно каталогу"""
+    encoding = sniff_encoding(data[:SNIFF_SIZE])
+    lines = list(iter_lines(io.BytesIO(data), encoding))
+    keys = set()
+    if name.lower().endswith('.reg'):
+        for record in iter_records(lines):
+            if record.kind in ('key', 'delete_key'):
+                keys.add(normalize_key_path(record.key))
+    else:
+        for line in lines:
+            for match in BAT_REG_COMMAND.finditer(line):
+                keys.add(normalize_key_path(match.group(1) or match.group(2)))
+    return {
+        'hash': member_digest(data).hex(),
+        'encoding': encoding,
+        'desc': extract_description(lines, name),
+        'keys': sorted(keys),
+        'line_count': len(lines),
+    }
+
+
+# Источники твиков: обычная папка или индексированный архив tweaks.bundle.
+# list() возвращает {путь: (имя, размер, mtime_ns, хэш или None)}.
+
+class FolderSource:
+    def __init__(self, folder):
+        self.root = folder
+
+    def version(self):
+        return os.stat(self.root).st_mtime_ns
+
+    def list(self):
+        files = {}
+        with os.scandir(self.root) as it:
+            for item in it:
+                if item.is_file() and item.name.lower().endswith(TWEAK_EXTENSIONS):
+                    st = item.stat()
+                    files[item.path] = (item.name, st.st_size, st.st_mtime_ns, None)
+        return files
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def open(self, path):
+        return open(path, 'rb')
+
+
+class BundleSource:
+    def __init__(self, bundle_path):
+        self.root = bundle_path
+        self.bundle = TweakBundle(bundle_path)
+
+    def version(self):
+        return os.stat(self.root).st_mtime_ns
+
+    def list(self):
+        # В архиве хэши уже есть в таблице, файлы читать не нужно
+        return {os.path.join(self.root, m.name): (m.name, m.size, m.mtime_ns, m.digest.hex())
+                for m in self.bundle.members.values()
+                if '/' not in m.name and m.name.lower().endswith(TWEAK_EXTENSIONS)}
+
+    def _name(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def read(self, path):
+        return self.bundle.read(self._name(path))
+
+    def open(self, path):
+        return self.bundle.open(self._name(path))
+
+
+def open_source(location):
+    if os.path.isdir(location):
+        return FolderSource(location)
+    return BundleSource(location)
+
+
+class TweakCatalog:
+    """Постоянный индекс твиков из папки или архива tweaks.bundle.
+
+    Для каждого файла хранит размер, mtime, хэш, кодировку, описание,
+    затрагиваемые ключи реестра и число строк. При обновлении заново читаются
+    только изменившиеся файлы (в пуле потоков), а список для очередной
+    итерации отдаётся из памяти.
+    """
+
+    def __init__(self, location, db_path=CATALOG_DB, workers=None):
+        self.source = open_source(location)
+        self.location = location
+        self.db_path = db_path
+        self.workers = workers
+        self._entries = {}
+        self._listing = None
+        self._version = None
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(SCHEMA)
+        self._load()
+
+    def _load(self):
+        prefix = os.path.join(self.location, '')
+        rows = self._db.execute(
+            'SELECT path, name, size, mtime_ns, hash, encoding, description, keys, line_count '
+            'FROM files WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))
+        for path, name, size, mtime_ns, digest, encoding, desc, keys, line_count in rows:
+            self._entries[path] = {
+                'name': name, 'path': path, 'desc': desc, 'size': size, 'mtime_ns': mtime_ns,
+                'hash': digest, 'encoding': encoding, 'keys': json.loads(keys or '[]'),
+                'line_count': line_count,
+            }
+
+    def _save(self, entries, removed):
+        with self._db:
+            self._db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO files (path, name, size, mtime_ns, hash, encoding, description, keys, line_count) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(e['path'], e['name'], e['size'], e['mtime_ns'], e['hash'], e['encoding'], e['desc'],
+                  json.dumps(e['keys'], ensure_ascii=False), e['line_count']) for e in entries])
+
+    def _is_changed(self, path, size, mtime_ns, digest):
+        entry = self._entries.get(path)
+        if entry is None:
+            return True
+        if digest is not None:
+            return entry['hash'] != digest
+        return entry['size'] != size or entry['mtime_ns'] != mtime_ns
+
+    def refresh(self):
+        """Синхронизирует индекс с источником; возвращает число пересканированных файлов"""
+        self._version = self.source.version()
+        current = self.source.list()
+        changed = [path for path, (_, size, mtime_ns, digest) in current.items()
+                   if self._is_changed(path, size, mtime_ns, digest)]
+        removed = [path for path in self._entries if path not in current]
+        updated = []
+        if changed:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for path, scanned in zip(changed, executor.map(self._scan_safe, changed)):
+                    name, size, mtime_ns, _ = current[path]
+                    entry = {'name': name, 'path': path, 'size': size, 'mtime_ns': mtime_ns}
+                    entry.update(scanned)
+                    self._entries[path] = entry
+                    updated.append(entry)
+        for path in removed:
+            del self._entries[path]
+        if updated or removed:
+            self._save(updated, removed)
+            self._listing = None
+        logger.info(f"Каталог твиков {self.location}: файлов {len(current)}, пересканировано {len(changed)}, удалено {len(removed)}")
+        return len(changed)
+
+    def _scan_safe(self, path):
+        name = os.path.basename(path)
+        try:
+            return scan_data(name, self.source.read(path))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать файл твика {path}: {e}")
+            return {'hash': '', 'encoding': None, 'desc': name, 'keys': [], 'line_count': 0}
+
+    def entries(self):
+        """Список твиков [{'name', 'path', 'desc', ...}] из памяти.
+
+        Источник пересканируется, только если изменилось время модификации
+        папки (добавлен, удалён или переименован файл) или архива.
+        """
+        if self._version is None or self.source.version() != self._version:
+            self.refresh()
+        if self._listing is None:
+            self._listing = [self._entries[path] for path in sorted(self._entries)]
+        return self._listing
+
+    def get(self, name):
+        return self._entries.get(os.path.join(self.location, name))
+
+    def open(self, entry):
+        """Открывает файл твика как бинарный поток (из папки или из архива)"""
+        return self.source.open(entry['path'])
+
+    def close(self):
+        self._db.close()
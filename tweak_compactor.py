@@ -0,0 +1,195 @@
+import re
+import logging
+
+from reg_parser import iter_records, normalize_key_path, format_value_line
+
+logger = logging.getLogger(__name__)
+
+REG_HEADER = 'Windows Registry Editor Version 5.00'
+
+# Команды, повторное выполнение которых ничего не меняет: повтор удаляется,
+# если между ним и первой командой ничего не меняло то же самое
+IDEMPOTENT_COMMANDS = (
+    'reg add', 'reg.exe add', 'reg delete', 'reg.exe delete', 'sc config', 'sc stop', 'sc delete',
+    'sc.exe config', 'sc.exe stop', 'sc.exe delete', 'net stop', 'schtasks /change', 'schtasks /delete',
+    'schtasks.exe /change', 'schtasks.exe /delete', 'powercfg', 'bcdedit /set', 'bcdedit /deletevalue',
+    'netsh', 'fsutil behavior set', 'dism /online /disable-feature', 'dism /online /enable-feature',
+    'taskkill', 'del ', 'rd ', 'rmdir ', 'attrib ', 'icacls ', 'takeown ',
+    'setx ', 'ipconfig /flushdns', 'auditpol ', 'lodctr ', 'winmgmt ', 'w32tm ',
+)
+BAT_NOISE = ('@echo off', 'echo off', 'pause', '@pause', 'cls')
+# Ключи подтверждения и тишины не говорят о том, что меняет команда
+CONFIRM_SWITCHES = {'/f', '/q', '/y'}
+BAT_TOKEN = re.compile(r'"[^"]*"|\S+')
+
+# reg add "ключ" /v имя ... /d данные — для поиска конфликтующих записей одного значения
+REG_ADD = re.compile(r'^reg(?:\.exe)?\s+add\s+(?:"([^"]+)"|(\S+))(.*)$', re.IGNORECASE)
+REG_ADD_NAME = re.compile(r'/v\s+(?:"([^"]*)"|(\S+))|/ve\b', re.IGNORECASE)
+SC_START = re.compile(r'^sc(?:\.exe)?\s+config\s+(?:"([^"]+)"|(\S+))\s+start=\s*(\S+)\s*$', re.IGNORECASE)
+
+
+def compact_reg(texts):
+    """Объединяет несколько .reg в один минимальный файл.
+
+    Значения применяются по порядку (последняя запись побеждает), удаление
+    ключа отменяет всё, что было записано в него и его подключи раньше.
+    Возвращает (текст, отчёт).
+    """
+    keys = {}        # идентификатор ключа -> {'path', 'values': {имя -> (имя, raw)}}
+    deleted = {}     # идентификатор удалённого ключа -> путь
+    report = {'values': 0, 'duplicates': 0, 'conflicts': [], 'deleted_keys': 0}
+    for text in texts:
+        if not text:
+            continue
+        for record in iter_records(text.splitlines()):
+            path = normalize_key_path(record.key)
+            ident = path.lower()
+            if record.kind == 'delete_key':
+                prefix = ident + '\\'
+                for other in [k for k in keys if k == ident or k.startswith(prefix)]:
+                    del keys[other]
+                for other in [k for k in deleted if k.startswith(prefix)]:
+                    del deleted[other]
+                # Удаление подключа уже удалённого ключа ничего не добавляет
+                if not any(ident.startswith(parent + '\\') for parent in deleted):
+                    deleted[ident] = path
+                continue
+            key = keys.setdefault(ident, {'path': path, 'values': {}})
+            if record.kind == 'key':
+                continue
+            report['values'] += 1
+            name_ident = record.name.lower()
+            previous = key['values'].get(name_ident)
+            if previous is not None:
+                if previous[1] == record.raw:
+                    report['duplicates'] += 1
+                else:
+                    report['conflicts'].append((path, record.name or '@', previous[1], record.raw))
+            key['values'][name_ident] = (record.name, record.raw)
+    report['deleted_keys'] = len(deleted)
+
+    lines = [REG_HEADER, '']
+    # Сначала удаления: всё, что осталось в keys, было записано после них
+    for ident in sorted(deleted):
+        lines.append(f'[-{deleted[ident]}]')
+        lines.append('')
+    for ident in sorted(keys):
+        key = keys[ident]
+        lines.append(f'[{key["path"]}]')
+        for name_ident in sorted(key['values'], key=lambda n: (n != '', n)):
+            name, raw = key['values'][name_ident]
+            lines.append(format_value_line(name, raw))
+        lines.append('')
+    report['keys'] = len(keys)
+    return '\r\n'.join(lines) + '\r\n', report
+
+
+def _command_identity(command):
+    """Что именно меняет команда: ('reg', ключ, имя) или ('sc', служба); иначе None"""
+    match = REG_ADD.match(command)
+    if match:
+        key = normalize_key_path(match.group(1) or match.group(2)).lower()
+        name_match = REG_ADD_NAME.search(match.group(3))
+        if name_match is None:
+            return None
+        name = '' if name_match.group(0).lower() == '/ve' else (name_match.group(1) or name_match.group(2) or '')
+        return ('reg', key, name.lower())
+    match = SC_START.match(command)
+    if match:
+        return ('sc', (match.group(1) or match.group(2)).lower())
+    return None
+
+
+def _tokens(command):
+    return [token.strip('"').lower() for token in BAT_TOKEN.findall(command.lstrip('@'))]
+
+
+def _targets(plain):
+    """Аргументы идемпотентной команды после её имени: по ним ищутся команды, меняющие то же самое"""
+    prefix = max((p for p in IDEMPOTENT_COMMANDS if plain.startswith(p)), key=len)
+    return set(_tokens(plain[len(prefix):])) - CONFIRM_SWITCHES
+
+
+def _touches(command, targets):
+    return command is not None and not targets.isdisjoint(_tokens(command))
+
+
+def compact_bat(texts):
+    """Объединяет несколько .bat в один без повторов идемпотентных команд.
+
+    Комментарии, пустые строки и pause удаляются. Повтор идемпотентной
+    команды удаляется, только если между повторами нет команд с теми же
+    аргументами: иначе net stop X / net start X / net stop X оставил бы
+    службу запущенной. Из команд, задающих одно и то же значение реестра
+    (reg add) или тип запуска службы (sc config start=), остаётся
+    последняя. Строки внутри блоков в скобках, метки и goto не трогаются.
+    Возвращает (текст, отчёт).
+    """
+    commands = []
+    report = {'commands': 0, 'duplicates': 0, 'conflicts': []}
+    seen = {}
+    last_writer = {}
+    for text in texts:
+        if not text:
+            continue
+        depth = 0
+        for line in text.splitlines():
+            command = line.strip()
+            lowered = command.lower()
+            if depth == 0:
+                if not command or lowered == 'rem' or lowered.startswith(('rem ', '::', '@rem ')):
+                    continue
+                if lowered in BAT_NOISE:
+                    continue
+            depth += command.count('(') - command.count(')')
+            depth = max(depth, 0)
+            report['commands'] += 1
+            plain = lowered.lstrip('@')
+            if depth == 0 and '(' not in command and plain.startswith(IDEMPOTENT_COMMANDS):
+                identity = _command_identity(command.lstrip('@'))
+                if identity is not None:
+                    # Значение задаётся последней командой, более ранние не нужны
+                    if identity in last_writer:
+                        previous = commands[last_writer[identity]]
+                        if ' '.join(previous.lower().lstrip('@').split()) == ' '.join(plain.split()):
+                            report['duplicates'] += 1
+                        else:
+                            report['conflicts'].append((previous, command))
+                        commands[last_writer[identity]] = None
+                    last_writer[identity] = len(commands)
+                else:
+                    normalized = ' '.join(plain.split())
+                    previous = seen.get(normalized)
+                    if previous is not None:
+                        targets = _targets(normalized)
+                        if not any(_touches(other, targets) for other in commands[previous + 1:]):
+                            report['duplicates'] += 1
+                            continue
+                    seen[normalized] = len(commands)
+            commands.append(command)
+    kept = [command for command in commands if command is not None]
+    report['kept'] = len(kept)
+    return '\r\n'.join(['@echo off'] + kept) + '\r\n', report
+
+
+def compact_tweaks(reg_texts, bat_texts):
+    """Сжимает итоговые твики и возвращает (reg, bat, отчёт)"""
+    reg_text, reg_report = compact_reg(reg_texts)
+    bat_text, bat_report = compact_bat(bat_texts)
+    raw_size = sum(len(t.encode('utf-8')) for t in reg_texts + bat_texts if t)
+    compact_size = len(reg_text.encode('utf-8')) + len(bat_text.encode('utf-8'))
+    report = {
+        'reg': reg_report,
+        'bat': bat_report,
+        'raw_bytes': raw_size,
+        'compact_bytes': compact_size,
+    }
+    logger.info(f"Сжатие итоговых твиков: {raw_size} -> {compact_size} байт; "
+                f"reg: значений {reg_report['values']}, ключей {reg_report['keys']}, дубликатов {reg_report['duplicates']}, "
+                f"конфликтов {len(reg_report['conflicts'])}; bat: команд {bat_report['commands']} -> {bat_report['kept']}, "
+                f"дубликатов {bat_report['duplicates']}, конфликтов {len(bat_report['conflicts'])}")
+    for path, name, old, new in reg_report['conflicts']:
+        logger.info(f"Конфликт в реестре: [{path}] {name}: {old} -> {new}")
+    for old, new in bat_report['conflicts']:
+        logger.info(f"Конфликт команд: {old} -> {new}")
+    return reg_text, bat_text, report
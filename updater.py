@@ -6,6 +6,8 @@ from pathlib import Path
 import shutil
 import sys
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
 
@@ -37,8 +39,18 @@ logging.basicConfig(
 REPO_OWNER = "anton18-png"
 REPO_NAME = "AI-Tweaker"
 REPO_BRANCH = "main"
-GITHUB_API_URL = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents"
-GITHUB_RAW_URL = f"https://raw.githubusercontent.com/{REPO_OWNER}/{REPO_NAME}/{REPO_BRANCH}"
+# Адреса можно подменить переменными окружения (например, локальным сервером для проверки)
+API_ROOT = os.environ.get('UPDATER_API_ROOT', "https://api.github.com").rstrip('/')
+RAW_ROOT = os.environ.get('UPDATER_RAW_ROOT', "https://raw.githubusercontent.com").rstrip('/')
+GITHUB_API_URL = f"{API_ROOT}/repos/{REPO_OWNER}/{REPO_NAME}/contents"
+GITHUB_TREE_URL = f"{API_ROOT}/repos/{REPO_OWNER}/{REPO_NAME}/git/trees/{REPO_BRANCH}?recursive=1"
+GITHUB_RAW_URL = f"{RAW_ROOT}/{REPO_OWNER}/{REPO_NAME}/{REPO_BRANCH}"
+MAX_RETRIES = 3
+# Сколько файлов загружается одновременно
+DOWNLOAD_WORKERS = 4
+CHUNK_SIZE = 256 * 1024
+# Как часто обновлять строку прогресса, сек
+PROGRESS_INTERVAL = 0.5
 
 # Добавляем заголовки для API GitHub
 HEADERS = {
@@ -51,63 +63,80 @@ def normalize_path(path):
     return os.path.normpath(os.path.join(SCRIPT_DIR, path))
 
 def calculate_file_hash(file_path):
-    """Вычисляет SHA-256 хэш файла"""
+    """Вычисляет git blob SHA-1 файла, не читая его в память целиком"""
     try:
         file_path = normalize_path(file_path)
+        file_hash = hashlib.sha1(b"blob %d\0" % os.path.getsize(file_path))
         with open(file_path, 'rb') as f:
-            file_hash = hashlib.sha256()
-            while chunk := f.read(8192):
+            while chunk := f.read(1024 * 1024):
                 file_hash.update(chunk)
-            return file_hash.hexdigest()
+        return file_hash.hexdigest()
     except Exception as e:
         logging.error(f"Ошибка при вычислении хэша файла {file_path}: {e}")
         return None
 
-def get_remote_files(path=""):
-    """Получает список файлов и их хэши из репозитория GitHub"""
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Общая сессия с пулом соединений на все потоки загрузки"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+def fetch(url):
+    """GET с повторными попытками при сбое"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            response = get_session().get(url, timeout=10)
+            response.raise_for_status()
+            return response
+        except requests.RequestException:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(1)
+
+def remote_entry(item):
+    # sha в ответах API — git blob SHA-1 содержимого, size — его размер в байтах
+    return {
+        'sha': item['sha'],
+        'download_url': f"{GITHUB_RAW_URL}/{item['path']}",
+        'size': item.get('size', 0),
+    }
+
+def get_remote_tree():
+    """Все файлы репозитория одним запросом к git/trees; None, если дерево обрезано API"""
+    tree = fetch(GITHUB_TREE_URL).json()
+    if tree.get('truncated'):
+        logging.warning("Дерево репозитория обрезано API, файлы перечисляются по каталогам")
+        return None
+    return {item['path']: remote_entry(item) for item in tree['tree'] if item['type'] == 'blob'}
+
+def get_remote_contents(path=""):
+    """Список файлов каталога и подкаталогов через contents API"""
+    url = f"{GITHUB_API_URL}/{path}" if path else GITHUB_API_URL
+    files = {}
+    for item in fetch(url).json():
+        if item['type'] == 'file':
+            files[item['path']] = remote_entry(item)
+        elif item['type'] == 'dir':
+            # Рекурсивно обходим подкаталоги
+            files.update(get_remote_contents(item['path']))
+    return files
+
+def get_remote_files():
+    """Получает список файлов и их git blob SHA из репозитория GitHub без загрузки содержимого"""
     try:
-        url = f"{GITHUB_API_URL}/{path}" if path else GITHUB_API_URL
-        
-        # Добавляем повторные попытки при сбое
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, headers=HEADERS, timeout=10)
-                response.raise_for_status()
-                break
-            except requests.RequestException as e:
-                if attempt == max_retries - 1:
-                    raise
-                time.sleep(1)
-        
-        files = {}
-        for item in response.json():
-            if item['type'] == 'file':
-                # Получаем содержимое файла для вычисления хэша
-                raw_url = f"{GITHUB_RAW_URL}/{item['path']}"
-                
-                # Повторные попытки для загрузки содержимого
-                for attempt in range(max_retries):
-                    try:
-                        content_response = requests.get(raw_url, headers=HEADERS, timeout=10)
-                        content_response.raise_for_status()
-                        break
-                    except requests.RequestException as e:
-                        if attempt == max_retries - 1:
-                            raise
-                        time.sleep(1)
-                
-                # Вычисляем хэш содержимого
-                content_hash = hashlib.sha256(content_response.content).hexdigest()
-                files[item['path']] = {
-                    'sha': content_hash,
-                    'download_url': raw_url,
-                    'size': len(content_response.content)
-                }
-            elif item['type'] == 'dir':
-                # Рекурсивно обходим подкаталоги
-                files.update(get_remote_files(item['path']))
-        
+        files = get_remote_tree()
+        if files is None:
+            files = get_remote_contents()
+        logging.info(f"В репозитории {len(files)} файлов")
         return files
     except Exception as e:
         logging.error(f"Ошибка при получении файлов из репозитория: {e}")
@@ -138,24 +167,125 @@ def backup_file(file_path):
         print(f"Ошибка при создании резервной копии {file_path}: {e}")
         return False
 
-def download_file(url, file_path):
-    """Загружает файл из репозитория"""
-    try:
-        file_path = normalize_path(file_path)
-        
-        # Добавляем повторные попытки при сбое
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, headers=HEADERS, timeout=10)
-                response.raise_for_status()
+class DownloadProgress:
+    """Общий прогресс параллельных загрузок: байты, проценты и скорость"""
+
+    def __init__(self, total_bytes, total_files, clock=time.monotonic):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.clock = clock
+        self.done_bytes = 0
+        self.done_files = 0
+        self.started = clock()
+        self._shown = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.done_bytes += count
+            now = self.clock()
+            if now - self._shown >= PROGRESS_INTERVAL:
+                self._shown = now
+                self._show(now)
+
+    def file_done(self):
+        with self._lock:
+            self.done_files += 1
+            self._show(self.clock())
+
+    def speed(self):
+        elapsed = self.clock() - self.started
+        return self.done_bytes / elapsed if elapsed > 0 else 0.0
+
+    def _show(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        percent = f" ({self.done_bytes * 100 / self.total_bytes:.0f}%)" if self.total_bytes else ""
+        print(f"\rЗагружено {self.done_bytes / 1024 / 1024:.1f} из {self.total_bytes / 1024 / 1024:.1f} МБ{percent}, "
+              f"файлов {self.done_files}/{self.total_files}, {self.done_bytes / elapsed / 1024 / 1024:.2f} МБ/с",
+              end='', flush=True)
+
+def _content_total(response, offset):
+    """Полный размер файла по ответу на запрос с Range (None — неизвестен)"""
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code == 206 and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    return int(length) + offset if length and length.isdigit() else None
+
+def _hash_existing(blob, temp_file, offset):
+    with open(temp_file, 'rb') as f:
+        remaining = offset
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
                 break
-            except requests.RequestException as e:
-                if attempt == max_retries - 1:
-                    raise
-                print(f"Попытка {attempt + 1} из {max_retries} загрузки файла {file_path}")
-                time.sleep(1)
-        
+            blob.update(chunk)
+            remaining -= len(chunk)
+
+def _stream_to_temp(url, temp_file, size, progress):
+    """Докачивает temp_file с места обрыва; возвращает git blob SHA полного содержимого"""
+    offset = os.path.getsize(temp_file) if os.path.exists(temp_file) else 0
+    if offset and size and offset >= size:
+        if offset == size:
+            # Файл уже загружен целиком: запрос не нужен, SHA проверит download_file
+            logging.info(f"{temp_file} уже загружен полностью")
+            return calculate_file_hash(temp_file)
+        # Во временном файле больше данных, чем в файле репозитория
+        if progress is not None:
+            progress.add(-offset)
+        os.remove(temp_file)
+        offset = 0
+    # Без сжатия: смещение Range должно считаться в байтах самого файла,
+    # а не сжатого потока (raw.githubusercontent сжимает текстовые файлы)
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    with get_session().get(url, headers=headers, stream=True, timeout=10) as response:
+        if response.status_code == 416:
+            # Во временном файле больше данных, чем на сервере: качаем заново
+            if progress is not None:
+                progress.add(-offset)
+            os.remove(temp_file)
+            return _stream_to_temp(url, temp_file, size, progress)
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            # Сервер не поддерживает Range и отдаёт файл целиком
+            logging.info(f"Сервер не поддерживает докачку, {temp_file} загружается заново")
+            if progress is not None:
+                progress.add(-offset)
+            offset = 0
+        elif offset:
+            logging.info(f"Докачка {temp_file} с {offset} байт")
+        total = _content_total(response, offset) or size
+        blob = hashlib.sha1(b"blob %d\0" % total) if total else None
+        if blob is not None and offset:
+            _hash_existing(blob, temp_file, offset)
+        with open(temp_file, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                if blob is not None:
+                    blob.update(chunk)
+                if progress is not None:
+                    progress.add(len(chunk))
+    if blob is None or os.path.getsize(temp_file) != total:
+        # Размер заранее неизвестен или не сошёлся: хэш по файлу на диске
+        return calculate_file_hash(temp_file)
+    return blob.hexdigest()
+
+def download_file(url, file_path, expected_sha=None, size=0, progress=None):
+    """Загружает файл из репозитория с докачкой; expected_sha — ожидаемый git blob SHA содержимого.
+
+    Данные пишутся потоком в file_path.tmp и хэшируются по ходу загрузки.
+    При обрыве .tmp остаётся, и следующая попытка (в том числе при
+    следующем запуске) продолжает его запросом Range. Готовый файл
+    атомарно заменяет старый.
+    """
+    file_path = normalize_path(file_path)
+    temp_file = f"{file_path}.tmp"
+    try:
         # Создаем директории, если они не существуют
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         
@@ -169,25 +299,59 @@ def download_file(url, file_path):
                 print(f"Файл {file_path} занят другим процессом. Пропускаем...")
                 return False
         
-        # Записываем содержимое во временный файл
-        temp_file = f"{file_path}.tmp"
-        with open(temp_file, 'wb') as f:
-            f.write(response.content)
+        resumed = os.path.exists(temp_file)
+        if resumed and progress is not None:
+            # Уже загруженное при прошлом запуске входит в прогресс
+            progress.add(os.path.getsize(temp_file))
+        for attempt in range(MAX_RETRIES):
+            try:
+                digest = _stream_to_temp(url, temp_file, size, progress)
+            except requests.RequestException as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                logging.warning(f"Попытка {attempt + 1} из {MAX_RETRIES} загрузки файла {file_path}: {e}")
+                time.sleep(1)
+                continue
+            if not expected_sha or digest == expected_sha:
+                break
+            # Несовпадение: остатки прошлой версии в .tmp или повреждённые данные
+            if progress is not None:
+                progress.add(-os.path.getsize(temp_file))
+            os.remove(temp_file)
+            if not resumed:
+                raise ValueError(f"содержимое не совпадает с SHA {expected_sha} из репозитория")
+            logging.warning(f"Докачанный {temp_file} не совпал с SHA из репозитория, загрузка заново")
+            resumed = False
         
-        # Перемещаем временный файл на место целевого
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        os.rename(temp_file, file_path)
+        # Атомарно заменяем целевой файл временным
+        os.replace(temp_file, file_path)
         
         relative_path = os.path.relpath(file_path, SCRIPT_DIR)
         logging.info(f"Файл {relative_path} успешно загружен")
         return True
     except Exception as e:
         logging.error(f"Ошибка при загрузке файла {file_path}: {e}")
-        print(f"Ошибка при загрузке файла {file_path}: {e}")
-        if os.path.exists(f"{file_path}.tmp"):
-            os.remove(f"{file_path}.tmp")
+        print(f"\nОшибка при загрузке файла {file_path}: {e}")
         return False
+    finally:
+        if progress is not None:
+            progress.file_done()
+
+def download_files(files, workers=DOWNLOAD_WORKERS):
+    """Загружает [(путь, remote_info)] в пуле потоков; возвращает {путь: успех}"""
+    progress = DownloadProgress(sum(info['size'] for _, info in files), len(files))
+
+    def download(item):
+        file_path, info = item
+        return file_path, download_file(info['download_url'], file_path, info['sha'], info['size'], progress)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = dict(pool.map(download, files))
+    elapsed = time.monotonic() - progress.started
+    print(f"\nЗагружено {progress.done_bytes / 1024 / 1024:.1f} МБ за {elapsed:.1f} сек "
+          f"({progress.speed() / 1024 / 1024:.2f} МБ/с)")
+    logging.info(f"Загружено {progress.done_bytes} байт за {elapsed:.1f} сек, файлов {sum(results.values())} из {len(files)}")
+    return results
 
 def check_and_update(auto_update=False):
     """Проверяет и обновляет файлы при необходимости"""
@@ -218,7 +382,12 @@ def check_and_update(auto_update=False):
                 updates_needed = True
                 continue
             
-            # Сравниваем хэши
+            # Сравниваем размер, а при совпадении — git blob SHA
+            if remote_info['size'] and os.path.getsize(local_path) != remote_info['size']:
+                print(f"Обнаружено несоответствие в файле {file_path}")
+                files_to_update.append((file_path, remote_info))
+                updates_needed = True
+                continue
             local_hash = calculate_file_hash(local_path)
             if local_hash != remote_info['sha']:
                 print(f"Обнаружено несоответствие в файле {file_path}")
@@ -246,10 +415,9 @@ def check_and_update(auto_update=False):
         success_count = 0
         total_files = len(files_to_update)
         
-        for index, (file_path, remote_info) in enumerate(files_to_update, 1):
-            print(f"\nОбработка файла {file_path} ({index}/{total_files})")
-            
-            if download_file(remote_info['download_url'], file_path):
+        results = download_files(files_to_update)
+        for file_path, ok in results.items():
+            if ok:
                 print(f"Файл {file_path} успешно обновлен")
                 success_count += 1
             else: